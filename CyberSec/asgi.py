@@ -12,5 +12,13 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'CyberSec.settings')
+# Serve the read-heavy polls views with their native async versions.
+os.environ.setdefault('POLLS_ASYNC_VIEWS', '1')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Importing polls needs the app registry, so only after Django is set up.
+from polls.live import with_live_results  # noqa: E402
+
+# /<id>/results/stream/ pushes live vote counts as server-sent events.
+application = with_live_results(django_application)
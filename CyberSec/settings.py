@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,8 +44,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'polls.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'polls.routers.PinPrimaryMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -56,6 +59,173 @@ ROOT_URLCONF = 'CyberSec.urls'
 
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 
+# With POLLS_USER_CACHE_SECONDS set, request.user comes from
+# CachedModelBackend (polls.auth_backends), which keeps users in memory for
+# that long instead of loading them on every request (0 = off). Sessions
+# record the backend's path, so switching backends logs everyone out; it's
+# only switched in where the cache is on.
+POLLS_USER_CACHE_SECONDS = 0
+
+# POLLS_SESSION_PROFILE takes the session and user lookups off the database:
+# 'cached_db' reads sessions from the 'sessions' cache and only writes
+# through to the database, 'signed_cookies' keeps them in a signed cookie
+# (no server-side state, so logging out can't revoke a copied cookie).
+# Both also cache users for a few seconds.
+POLLS_SESSION_PROFILE = os.environ.get('POLLS_SESSION_PROFILE', 'db')
+if POLLS_SESSION_PROFILE == 'cached_db':
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+    SESSION_CACHE_ALIAS = 'sessions'
+elif POLLS_SESSION_PROFILE == 'signed_cookies':
+    SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+if POLLS_SESSION_PROFILE != 'db':
+    AUTHENTICATION_BACKENDS = ['polls.auth_backends.CachedModelBackend']
+    POLLS_USER_CACHE_SECONDS = 5
+
+# "Already voted" checks (detail page, repeat votes, the marks on the index)
+# come from a per-process cache of each user's voted question ids, see
+# polls.voted. Entries live POLLS_VOTED_CACHE_SECONDS (0 = check the database
+# every time), for at most POLLS_VOTED_CACHE_USERS users.
+POLLS_VOTED_CACHE_SECONDS = 300
+POLLS_VOTED_CACHE_USERS = 10000
+
+# Vote counters: 'single' bumps Choice.votes on every vote, 'sharded' spreads
+# votes over POLLS_COUNTER_SHARDS rows per choice which the
+# flush_vote_counters command folds back into Choice.votes.
+POLLS_COUNTER_MODE = 'single'
+POLLS_COUNTER_SHARDS = 8
+# How many seconds the results page may lag behind in sharded mode (0 = live).
+POLLS_RESULTS_MAX_STALENESS = 2
+
+# Votes on one poll that arrive while a vote on it is being written are
+# written together, up to POLLS_VOTE_BATCH_SIZE per transaction (see
+# polls.coalescer). POLLS_VOTE_COALESCE_MS holds the first vote back to
+# batch even without contention. Each poll admits POLLS_VOTE_POLL_RATE
+# votes a second (0 = no limit) with bursts of POLLS_VOTE_POLL_BURST; a vote
+# over the rate waits for its turn if that's at most POLLS_VOTE_MAX_WAIT_MS
+# away (the request thread sleeps meanwhile), otherwise it gets a 429. All
+# per process.
+POLLS_VOTE_COALESCING = True
+POLLS_VOTE_BATCH_SIZE = 200
+POLLS_VOTE_COALESCE_MS = 0
+POLLS_VOTE_POLL_RATE = 500
+POLLS_VOTE_POLL_BURST = 500
+POLLS_VOTE_MAX_WAIT_MS = 20
+
+# Cache alias holding the results page tallies. Swap the 'results' backend
+# for django.core.cache.backends.filebased.FileBasedCache or
+# django.core.cache.backends.redis.RedisCache to share it between processes.
+POLLS_RESULTS_CACHE = 'results'
+POLLS_RESULTS_CACHE_TIMEOUT = None
+
+# Serve the index, results and search pages with the async views in
+# polls/async_views.py. CyberSec/asgi.py turns this on.
+POLLS_ASYNC_VIEWS = os.environ.get('POLLS_ASYNC_VIEWS') == '1'
+
+# Live results (ASGI only): vote deltas are pushed to open results pages
+# at most this many times a second. With several worker processes, run
+# `manage.py live_broker` and set POLLS_LIVE_BROKER = '127.0.0.1:8799'.
+# A broker that can't be reached is skipped for POLLS_LIVE_BROKER_RETRY
+# seconds.
+POLLS_LIVE_MAX_UPDATES_PER_SECOND = 2
+POLLS_LIVE_BROKER = os.environ.get('POLLS_LIVE_BROKER') or None
+POLLS_LIVE_BROKER_RETRY = 5
+
+# Questions per page on the index page.
+POLLS_INDEX_PAGE_SIZE = 5
+
+# JSON API (polls.api): questions per list page, and the most ids one
+# batch request may ask for.
+POLLS_API_PAGE_SIZE = 50
+POLLS_API_BATCH_LIMIT = 100
+
+# Question search: 'auto' uses the SQLite FTS5 table when it exists and the
+# in-process inverted index otherwise; 'fts5' or 'python' force one.
+POLLS_SEARCH_BACKEND = 'auto'
+POLLS_SEARCH_PAGE_SIZE = 20
+# Results past this many are never returned, however far you page.
+POLLS_SEARCH_LIMIT = 200
+
+# Sliding-window throttles: scope -> (requests, per seconds). Login counts
+# failed attempts per username; the others count requests per user or
+# client address. Counters live in the POLLS_THROTTLE_CACHE alias, which
+# needs to be shared (e.g. Redis) when running several processes.
+POLLS_THROTTLE_ENABLED = True
+POLLS_THROTTLE_CACHE = 'throttle'
+POLLS_THROTTLE_RATES = {
+    'login': (5, 300),
+    'register': (10, 3600),
+    'vote': (30, 60),
+    'search': (60, 60),
+}
+
+# Login attempts are written to LoginAttempt in batches of this size, or
+# when the oldest buffered attempt is this many seconds old.
+POLLS_AUDIT_BATCH_SIZE = 100
+POLLS_AUDIT_FLUSH_INTERVAL = 10
+
+# Background jobs (polls.jobs): search index updates, login audit rows,
+# results cache warming and counter reconciliation. Off, they run inline;
+# with POLLS_JOBS=1 they're queued in the Job table and `manage.py run_jobs`
+# workers run them. Cache warming needs a POLLS_RESULTS_CACHE shared by
+# the web and worker processes.
+POLLS_JOBS_ENABLED = os.environ.get('POLLS_JOBS') == '1'
+POLLS_JOBS_OUTBOX_SIZE = 100
+POLLS_JOBS_OUTBOX_INTERVAL = 1
+POLLS_JOBS_LEASE = 300
+POLLS_JOBS_MAX_ATTEMPTS = 5
+POLLS_JOBS_RETRY_DELAY = 2  # seconds, doubled on every further attempt
+
+# Per-request timings, SQL, template and cache counts per view (see
+# polls.instrumentation), served in Prometheus text format at
+# /polls/metrics/ to staff, or to scrapers sending
+# "Authorization: Bearer <POLLS_METRICS_TOKEN>".
+POLLS_METRICS_TOKEN = os.environ.get('POLLS_METRICS_TOKEN') or None
+# Run this share of requests under cProfile and keep the stats of the ones
+# slower than POLLS_PROFILE_SLOW_MS in POLLS_PROFILE_DIR (unset = off).
+POLLS_PROFILE_DIR = os.environ.get('POLLS_PROFILE_DIR') or None
+POLLS_PROFILE_SAMPLE_RATE = 0.01
+POLLS_PROFILE_SLOW_MS = 500
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'polls-throttle',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+    'results': {
+        'BACKEND': 'polls.cache_backends.SizedLocMemCache',
+        'LOCATION': 'polls-results',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'MAX_BYTES': 16 * 1024 * 1024,
+        },
+    },
+    # Sessions for POLLS_SESSION_PROFILE=cached_db. Running several processes,
+    # this has to be shared (e.g. Redis): a logout only clears the copy in
+    # the process that handled it.
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'polls-sessions',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+    # Rendered {% cache %} fragments, keyed by Question.updated_at (polls.fragments).
+    'template_fragments': {
+        'BACKEND': 'polls.cache_backends.SizedLocMemCache',
+        'LOCATION': 'polls-fragments',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'MAX_BYTES': 16 * 1024 * 1024,
+        },
+    },
+}
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -73,6 +243,18 @@ TEMPLATES = [
     },
 ]
 
+# POLLS_TEMPLATE_PROFILE=production compiles each template once per process
+# with the cached loader, even with DEBUG on. Template edits then need a
+# restart.
+if os.environ.get('POLLS_TEMPLATE_PROFILE') == 'production':
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
 WSGI_APPLICATION = 'CyberSec.wsgi.application'
 
 
@@ -82,10 +264,72 @@ WSGI_APPLICATION = 'CyberSec.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('POLLS_DB_NAME') or BASE_DIR / 'db.sqlite3',
     }
 }
 
+# POLLS_DB_PROFILE=sqlite-production turns on the tuned SQLite setup:
+# persistent connections, a 20s busy timeout, the POLLS_SQLITE_PRAGMAS
+# below (applied by polls.db on every new connection) and a separate
+# read-only connection for the index, results and search views.
+POLLS_DB_PROFILE = os.environ.get('POLLS_DB_PROFILE', 'default')
+POLLS_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'busy_timeout': 20000,
+    'temp_store': 'MEMORY',
+    'cache_size': -20000,  # KiB
+}
+
+if POLLS_DB_PROFILE == 'sqlite-production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {'timeout': 20},
+    })
+    DATABASES['readonly'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f"file:{DATABASES['default']['NAME']}?mode=ro",
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {'timeout': 20},
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# Read replicas for the @read_only views (index, detail, results, search).
+# POLLS_DB_REPLICAS is a comma-separated list of database files; locally,
+# plain SQLite copies stand in for replicas and `manage.py sync_replicas`
+# refreshes them from 'default'. A client that has just POSTed reads from
+# 'default' for POLLS_REPLICA_PIN_SECONDS so it sees its own writes.
+POLLS_READ_REPLICAS = []
+for number, name in enumerate(filter(None, os.environ.get('POLLS_DB_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'CONN_MAX_AGE': DATABASES['default'].get('CONN_MAX_AGE', 0),
+        'TEST': {'MIRROR': 'default'},
+    }
+    POLLS_READ_REPLICAS.append(f'replica{number}')
+if not POLLS_READ_REPLICAS and 'readonly' in DATABASES:
+    POLLS_READ_REPLICAS = ['readonly']
+POLLS_REPLICA_PIN_SECONDS = 5
+
+# `manage.py archive_polls` archives polls POLLS_ARCHIVE_AFTER seconds after
+# they close, moving POLLS_ARCHIVE_BATCH_SIZE votes per transaction (see
+# polls.archive). Archived Vote rows go to POLLS_ARCHIVE_DATABASE; with
+# POLLS_ARCHIVE_DB set to a file name they're kept in that separate SQLite
+# database (create its table with `manage.py migrate --database archive`).
+POLLS_ARCHIVE_AFTER = 7 * 24 * 3600
+POLLS_ARCHIVE_BATCH_SIZE = 1000
+POLLS_ARCHIVE_DATABASE = 'default'
+if os.environ.get('POLLS_ARCHIVE_DB'):
+    DATABASES['archive'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['POLLS_ARCHIVE_DB'],
+    }
+    POLLS_ARCHIVE_DATABASE = 'archive'
+
+DATABASE_ROUTERS = ['polls.routers.ReadOnlyRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
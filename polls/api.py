@@ -0,0 +1,138 @@
+"""
+JSON read API for polls.
+
+    GET api/questions/?cursor=...        one keyset page of published polls, newest first
+    GET api/questions/<id>/              one poll
+    GET api/questions/batch/?ids=1,2,3   up to POLLS_API_BATCH_LIMIT polls in one call
+
+Every response has the same shape: the field names once, then one array
+per question, in the order of `fields`:
+
+    {"fields": ["id", "question_text", ..., "choices"],
+     "choice_fields": ["id", "choice_text", "votes"],
+     "questions": [[1, "Tea or coffee?", ..., [[1, "Tea", 3], [2, "Coffee", 5]]]]}
+
+?fields=question_text,total_votes picks the question fields (id always
+comes first); leave out "choices" and the choice query is skipped. Rows
+are read with values_list() and never become model instances. A page or
+batch costs the same queries however many polls it holds: one for the
+questions and one for all their choices and tallies. Keys aren't repeated
+per row, the JSON has no whitespace, and responses are gzipped for
+clients that accept it.
+"""
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
+from django.utils import timezone
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_GET
+
+from . import counters
+from .models import Question
+from .pagination import InvalidCursor, keyset_page
+from .routers import read_only
+
+QUESTION_FIELDS = ('id', 'question_text', 'pub_date', 'updated_at', 'total_votes', 'choice_count', 'choices')
+CHOICE_FIELDS = ('id', 'choice_text', 'votes')
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def parse_fields(value):
+    if not value:
+        return list(QUESTION_FIELDS)
+    fields = ['id'] + [name for name in dict.fromkeys(value.split(',')) if name and name != 'id']
+    unknown = set(fields) - set(QUESTION_FIELDS)
+    if unknown:
+        raise BadRequest(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return fields
+
+
+def parse_ids(value):
+    try:
+        ids = list(dict.fromkeys(int(part) for part in value.split(',') if part))
+    except ValueError:
+        raise BadRequest("ids must be a comma-separated list of integers.")
+    if not ids:
+        raise BadRequest("ids is required.")
+    limit = getattr(settings, 'POLLS_API_BATCH_LIMIT', 100)
+    if len(ids) > limit:
+        raise BadRequest(f"At most {limit} ids per request.")
+    return ids
+
+
+def columns(fields):
+    # pk and pub_date first: keyset_page reads them off the rows to build cursors.
+    return ['pk', 'pub_date'] + [name for name in fields if name not in ('id', 'pub_date', 'choices')]
+
+
+def serialize(rows, fields):
+    """One array per row, in the order of `fields`, with the choices filled in if asked for."""
+    rows = list(rows)
+    tallies = counters.tallies([row.pk for row in rows]) if 'choices' in fields else {}
+    getters = {'id': lambda row: row.pk, 'choices': lambda row: tallies[row.pk]}
+    return [
+        [getters[name](row) if name in getters else getattr(row, name) for name in fields]
+        for row in rows
+    ]
+
+
+def respond(fields, rows, **extra):
+    return JsonResponse(
+        {'fields': fields, 'choice_fields': CHOICE_FIELDS, 'questions': serialize(rows, fields), **extra},
+        json_dumps_params={'separators': (',', ':')},
+    )
+
+
+def api_view(view):
+    """GET only, logged in, read from a replica, gzipped, and BadRequest turned into a 400."""
+    def wrapped(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as exc:
+            return HttpResponseBadRequest(str(exc))
+    wrapped.__name__ = view.__name__
+    wrapped.__doc__ = view.__doc__
+    return login_required(require_GET(read_only(gzip_page(wrapped))))
+
+
+def published():
+    # Questions with a future pub_date aren't shown anywhere yet.
+    return Question.objects.filter(pub_date__lte=timezone.now())
+
+
+@api_view
+def questions(request):
+    fields = parse_fields(request.GET.get('fields'))
+    try:
+        page = keyset_page(
+            published().values_list(*columns(fields), named=True),
+            cursor=request.GET.get('cursor') or None,
+            page_size=getattr(settings, 'POLLS_API_PAGE_SIZE', 50),
+        )
+    except InvalidCursor:
+        raise BadRequest("Invalid cursor.")
+    return respond(fields, page.object_list, next_cursor=page.next_cursor, prev_cursor=page.prev_cursor)
+
+
+@api_view
+def question(request, pk):
+    fields = parse_fields(request.GET.get('fields'))
+    rows = list(published().filter(pk=pk).values_list(*columns(fields), named=True))
+    if not rows:
+        raise Http404("No question found.")
+    return respond(fields, rows)
+
+
+@api_view
+def batch(request):
+    """The polls in ?ids=, in that order; ids that don't exist (or aren't published yet) are listed under "missing"."""
+    fields = parse_fields(request.GET.get('fields'))
+    ids = parse_ids(request.GET.get('ids', ''))
+    rows = {row.pk: row for row in published().filter(pk__in=ids).values_list(*columns(fields), named=True)}
+    return respond(
+        fields, [rows[pk] for pk in ids if pk in rows],
+        missing=[pk for pk in ids if pk not in rows],
+    )
@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class PollsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'polls'
+
+    def ready(self):
+        # Keeps the search index in sync with Question saves and deletes, and
+        # drops changed users from the CachedModelBackend cache.
+        from . import signals  # noqa: F401
+        # Registers the background job handlers with polls.jobs.
+        from . import tasks  # noqa: F401
+        from django.db.backends.signals import connection_created
+        from .db import configure_sqlite
+        connection_created.connect(configure_sqlite, dispatch_uid='polls.configure_sqlite')
+        # Per-request SQL and template timings for InstrumentationMiddleware.
+        from .instrumentation import install_query_counter, instrument_templates
+        connection_created.connect(install_query_counter, dispatch_uid='polls.install_query_counter')
+        instrument_templates()
@@ -0,0 +1,102 @@
+"""
+Archival of closed polls, run by `manage.py archive_polls`.
+
+Once a question has been closed (Question.closes_at) for
+POLLS_ARCHIVE_AFTER seconds it's archived in three steps:
+
+1. freeze: the tally is checked against the Vote rows (counters.reconcile)
+   and copied, pending shard counts included, into ArchivedChoice. Then
+   archived_at is set. From here on it's read-only; reconcile skips it.
+2. move: the Vote rows go to ArchivedVote POLLS_ARCHIVE_BATCH_SIZE at a
+   time, each batch inserted there and deleted from polls_vote.
+3. finish: the Choice rows (and any counter shards) are deleted.
+
+The results page and the API keep working throughout, since
+counters.tallies() reads ArchivedChoice for questions with no choices
+left. So polls_vote and polls_choice only hold live polls.
+
+ArchivedVote lives in the POLLS_ARCHIVE_DATABASE alias, which can be a
+separate SQLite file (see settings). A batch is inserted there before it's
+deleted from polls_vote, and the insert ignores rows it already has, so a
+run that dies halfway is simply picked up by the next one. The "voted"
+marks and the vote exports only cover Vote rows that haven't been archived.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import counters
+from .models import ArchivedChoice, ArchivedVote, Choice, Question, Vote
+from .results_cache import results_cache
+
+
+def archive_database():
+    return getattr(settings, 'POLLS_ARCHIVE_DATABASE', 'default')
+
+
+def due(now=None):
+    """
+    Ids of the questions to archive: closed more than POLLS_ARCHIVE_AFTER
+    seconds ago, plus any a previous run froze but didn't finish.
+    """
+    cutoff = (now or timezone.now()) - timedelta(seconds=getattr(settings, 'POLLS_ARCHIVE_AFTER', 0))
+    closed = Question.objects.filter(archived_at__isnull=True, closes_at__lte=cutoff).order_by('closes_at', 'pk')
+    unfinished = Choice.objects.filter(question__archived_at__isnull=False).values_list('question_id', flat=True)
+    return list(dict.fromkeys([*unfinished.distinct(), *closed.values_list('pk', flat=True)]))
+
+
+def freeze(question_id):
+    counters.reconcile(question_ids=[question_id])
+    tally = counters.tally(question_id)
+    now = timezone.now()
+    with transaction.atomic():
+        ArchivedChoice.objects.bulk_create(
+            [ArchivedChoice(id=row['id'], question_id=question_id, choice_text=row['choice_text'], votes=row['votes'])
+             for row in tally],
+            ignore_conflicts=True,
+        )
+        Question.objects.filter(pk=question_id, archived_at__isnull=True).update(
+            archived_at=now, total_votes=sum(row['votes'] for row in tally), updated_at=now,
+        )
+        transaction.on_commit(lambda: results_cache.invalidate(question_id))
+
+
+def move_votes(question_id, batch_size=None):
+    """Move the question's Vote rows to ArchivedVote. Returns how many were moved."""
+    batch_size = batch_size or getattr(settings, 'POLLS_ARCHIVE_BATCH_SIZE', 1000)
+    moved = 0
+    while True:
+        rows = list(
+            Vote.objects.filter(question_id=question_id).order_by('pk')
+            .values_list('pk', 'user_id', 'question_id', 'choice_id')[:batch_size]
+        )
+        if not rows:
+            return moved
+        with transaction.atomic():
+            ArchivedVote.objects.using(archive_database()).bulk_create(
+                [ArchivedVote(id=pk, user_id=user_id, question_id=qid, choice_id=choice_id)
+                 for pk, user_id, qid, choice_id in rows],
+                ignore_conflicts=True,
+            )
+            Vote.objects.filter(pk__in=[row[0] for row in rows]).delete()
+        moved += len(rows)
+
+
+def finish(question_id):
+    with transaction.atomic():
+        Choice.objects.filter(question_id=question_id).delete()
+        Question.objects.filter(pk=question_id).update(updated_at=timezone.now())
+        transaction.on_commit(lambda: results_cache.invalidate(question_id))
+
+
+def archive(now=None, batch_size=None, limit=None):
+    """Archive every question that's due (or the first `limit`). Returns (questions archived, votes moved)."""
+    questions = votes = 0
+    for question_id in due(now)[:limit]:
+        freeze(question_id)
+        votes += move_votes(question_id, batch_size)
+        finish(question_id)
+        questions += 1
+    return questions, votes
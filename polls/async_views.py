@@ -0,0 +1,147 @@
+"""
+Native async versions of the read-heavy polls views, used when the site
+runs under ASGI (CyberSec/asgi.py sets POLLS_ASYNC_VIEWS). A request that
+is waiting on a slow client or on the database no longer holds a worker
+thread for its whole lifetime.
+
+Django 4.0 has no async ORM methods yet (aget/afirst arrived in 4.1), so
+queries are grouped into one sync_to_async call per view; template
+rendering and everything else stays on the event loop. The results page is
+the exception: its tally is read lazily from inside a cached template
+fragment, so it's rendered in the worker thread too.
+"""
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404, JsonResponse
+from django.shortcuts import render
+from django.utils import timezone
+
+from .models import Question
+from .pagination import InvalidCursor, keyset_page
+from .results_cache import results_cache
+from .routers import read_alias_for, read_only, reading_from
+from . import conditional, fragments, search as search_index, voted
+from .throttle import Throttle, client_key, too_many_requests
+
+
+def _load_user(request):
+    # Evaluate the lazy request.user (session + user queries) off the event
+    # loop; templates can then use it without touching the database.
+    return request.user.is_authenticated
+
+
+async def is_authenticated(request):
+    return await sync_to_async(_load_user)(request)
+
+
+def async_login_required(view):
+    async def wrapped(request, *args, **kwargs):
+        if not await is_authenticated(request):
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    wrapped.__name__ = view.__name__
+    wrapped.__doc__ = view.__doc__
+    return wrapped
+
+
+@async_login_required
+@read_only
+async def index(request):
+    def fetch():
+        queryset = Question.objects.filter(pub_date__lte=timezone.now())
+        if not voted.enabled():
+            queryset = voted.with_vote_flag(queryset, request.user)
+        page = keyset_page(
+            queryset,
+            cursor=request.GET.get('cursor') or None,
+            page_size=getattr(settings, 'POLLS_INDEX_PAGE_SIZE', 5),
+        )
+        return page, voted.mark(request.user, page.object_list)
+    try:
+        page, voted_ids = await sync_to_async(fetch)()
+    except InvalidCursor:
+        raise Http404("Invalid cursor.")
+    return conditional.respond(
+        request,
+        lambda: render(request, 'polls/index.html', {
+            'latest_question_list': page.object_list,
+            'next_cursor': page.next_cursor,
+            'prev_cursor': page.prev_cursor,
+            'list_version': fragments.list_version(page.object_list),
+            'voted_version': fragments.voted_version(voted_ids),
+        }),
+        etag=conditional.index_etag(page, voted_ids),
+    )
+
+
+def _question_and_tally(pk):
+    try:
+        question = Question.objects.only('id', 'question_text', 'updated_at').get(pk=pk)
+    except Question.DoesNotExist:
+        raise Http404("No question found.")
+    return question, results_cache.get_tally(question)
+
+
+def _render_results(request, pk):
+    try:
+        question = Question.objects.only('id', 'question_text', 'updated_at', 'closes_at').get(pk=pk)
+    except Question.DoesNotExist:
+        raise Http404("No question found.")
+    # Rendered in a worker thread so the tally can stay lazy: it's only
+    # fetched when the {% cache %} fragment misses.
+    etag, last_modified = conditional.results_validators(question)
+    return conditional.respond(
+        request,
+        lambda: render(request, 'polls/results.html', {
+            'question': question,
+            'choices': partial(results_cache.get_tally, question),
+            'live_results': True,
+            'results_version': fragments.stamp(question),
+            'fragment_timeout': fragments.results_timeout(),
+        }),
+        etag=etag,
+        last_modified=last_modified,
+    )
+
+
+@async_login_required
+@read_only
+async def results(request, pk):
+    return await sync_to_async(_render_results)(request, pk)
+
+
+@async_login_required
+@read_only
+async def results_json(request, pk):
+    question, tally = await sync_to_async(_question_and_tally)(pk)
+    return JsonResponse({
+        'id': question.id,
+        'question_text': question.question_text,
+        'choices': tally,
+    })
+
+
+search_throttle = Throttle('search')
+
+
+async def search(request):
+    # The session and user come from 'default'; only the search itself goes to a replica.
+    await is_authenticated(request)
+    if not await sync_to_async(search_throttle.attempt, thread_sensitive=False)(client_key(request)):
+        return too_many_requests(search_throttle)
+    keyword = request.GET.get('keyword', '')
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        page = 1
+    with reading_from(read_alias_for(request)):
+        results = await sync_to_async(search_index.search)(keyword, page=page)
+    return render(request, 'polls/search_results.html', {
+        'results': results.results,
+        'keyword': keyword,
+        'page': results.page,
+        'has_next': results.has_next,
+    })
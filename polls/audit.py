@@ -0,0 +1,68 @@
+"""
+Batched audit log of login attempts.
+
+record() only appends to an in-process buffer; the buffer is written to
+LoginAttempt with one bulk INSERT once it holds POLLS_AUDIT_BATCH_SIZE
+attempts or its oldest entry is POLLS_AUDIT_FLUSH_INTERVAL seconds old,
+and again when the process exits. The login request itself therefore
+doesn't write to the database. With background jobs on, attempts are
+queued as 'audit.login' jobs instead and a run_jobs worker writes them.
+Throttling doesn't read these rows; see polls.throttle.
+"""
+import atexit
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+from . import jobs
+from .models import LoginAttempt
+
+
+class LoginAuditLog:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._oldest = None
+
+    def record(self, username, success):
+        if jobs.enabled():
+            jobs.enqueue('audit.login', {
+                'username': username, 'success': success, 'timestamp': timezone.now().isoformat(),
+            })
+            return
+        with self._lock:
+            self._pending.append(LoginAttempt(username=username, success=success, timestamp=timezone.now()))
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            due = (
+                len(self._pending) >= getattr(settings, 'POLLS_AUDIT_BATCH_SIZE', 100)
+                or time.monotonic() - self._oldest >= getattr(settings, 'POLLS_AUDIT_FLUSH_INTERVAL', 10)
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending, self._oldest = self._pending, [], None
+        if pending:
+            LoginAttempt.objects.bulk_create(pending)
+        return len(pending)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+
+login_audit = LoginAuditLog()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        login_audit.flush()
+    except DatabaseError:
+        pass
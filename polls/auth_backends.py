@@ -0,0 +1,72 @@
+"""
+ModelBackend with a short-lived, per-process cache of users.
+
+Every login_required request resolves request.user through the backend's
+get_user(), which is a SELECT on auth_user. CachedModelBackend answers it
+from memory for POLLS_USER_CACHE_SECONDS (0 turns the cache off). Saving or
+deleting a user drops it from this process's cache straight away; other
+processes keep their copy until it expires, so a deactivated user or a
+password change can take that long to end sessions served by them. Keep
+the TTL short.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+
+
+class UserCache:
+    """Users by primary key, each kept for a fixed number of seconds; least recently used go first."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._users = OrderedDict()  # pk -> (expires, user)
+
+    def get(self, pk):
+        with self._lock:
+            entry = self._users.get(pk)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._users[pk]
+                return None
+            self._users.move_to_end(pk)
+        # Each request gets its own instance, so nothing a view sets on
+        # request.user (e.g. the permission cache) leaks into the next one.
+        return copy.copy(entry[1])
+
+    def set(self, pk, user, timeout):
+        with self._lock:
+            self._users[pk] = (time.monotonic() + timeout, copy.copy(user))
+            self._users.move_to_end(pk)
+            while len(self._users) > self.max_entries:
+                self._users.popitem(last=False)
+
+    def discard(self, pk):
+        with self._lock:
+            self._users.pop(pk, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+user_cache = UserCache()
+
+
+class CachedModelBackend(ModelBackend):
+
+    def get_user(self, user_id):
+        timeout = getattr(settings, 'POLLS_USER_CACHE_SECONDS', 0)
+        if not timeout:
+            return super().get_user(user_id)
+        user = user_cache.get(user_id)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                user_cache.set(user_id, user, timeout)
+        return user
@@ -0,0 +1,9 @@
+"""
+Synthetic load for the polls app.
+
+seed.seed() fills the database with bench users, polls and votes using bulk
+inserts, and scenarios.run() drives the polls URLs with a weighted mix of
+requests, reporting latency percentiles, throughput and queries per request.
+`manage.py seed_polls` and `manage.py bench_polls` wrap them; reports are
+plain JSON so two runs can be diffed with `bench_polls --compare`.
+"""
@@ -0,0 +1,318 @@
+import http.client
+import random
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlencode, urlsplit
+
+from django.contrib.auth.models import User
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections
+from django.middleware.csrf import _get_new_csrf_string
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..models import Choice, Question
+from .seed import TOPICS, USER_PREFIX
+
+# Relative weight of each request type in the mix.
+DEFAULT_MIX = {
+    'index': 20,
+    'detail': 20,
+    'results': 20,
+    'vote': 15,
+    'search': 15,
+    'add': 5,
+    'edit': 5,
+}
+# Not in the default mix; ask for them with --mix, e.g. results=1,api_batch=1.
+API_REQUESTS = ('api_list', 'api_get', 'api_batch')
+# Polls fetched by one api_batch request.
+API_BATCH_SIZE = 20
+
+
+class Workload:
+    """What the virtual users can ask for: the seeded polls and who owns them."""
+
+    def __init__(self, limit=None):
+        questions = Question.objects.filter(user__username__startswith=USER_PREFIX).order_by('-pk')
+        if limit:
+            questions = questions[:limit]
+        self.owners = dict(questions.values_list('pk', 'user_id'))
+        if not self.owners:
+            raise ValueError("No bench polls found; run `manage.py seed_polls` first.")
+        self.question_ids = list(self.owners)
+        self.choices = defaultdict(list)
+        for question_id, choice_id, text in (
+            Choice.objects.filter(question_id__in=self.question_ids)
+            .order_by('pk').values_list('question_id', 'pk', 'choice_text').iterator()
+        ):
+            self.choices[question_id].append((choice_id, text))
+        self.owned = defaultdict(list)
+        for question_id, user_id in self.owners.items():
+            self.owned[user_id].append(question_id)
+        self.user_ids = list(self.owned)
+
+    def request(self, name, user_id, rng):
+        """(method, path, data) for one request of type `name` made by `user_id`."""
+        question_id = rng.choice(self.question_ids)
+        if name == 'index':
+            return 'GET', reverse('polls:index'), None
+        if name == 'detail':
+            return 'GET', reverse('polls:detail', args=(question_id,)), None
+        if name == 'results':
+            return 'GET', reverse('polls:results', args=(question_id,)), None
+        if name == 'api_list':
+            return 'GET', reverse('polls:api_questions'), None
+        if name == 'api_get':
+            return 'GET', reverse('polls:api_question', args=(question_id,)), None
+        if name == 'api_batch':
+            ids = rng.sample(self.question_ids, min(API_BATCH_SIZE, len(self.question_ids)))
+            return 'GET', reverse('polls:api_batch'), {'ids': ','.join(map(str, ids))}
+        if name == 'vote':
+            choice_id, _ = rng.choice(self.choices[question_id])
+            return 'POST', reverse('polls:vote', args=(question_id,)), {'choice': choice_id}
+        if name == 'search':
+            return 'GET', reverse('polls:search'), {'keyword': rng.choice(TOPICS)}
+        if name == 'edit' and self.owned[user_id]:
+            question_id = rng.choice(self.owned[user_id])
+            texts = [text for _, text in self.choices[question_id]]
+            return 'POST', reverse('polls:edit_question', args=(question_id,)), formset_data(
+                f'Edited poll {question_id}?', texts
+            )
+        # 'add', or 'edit' by a user who owns nothing.
+        return 'POST', reverse('polls:add_question'), formset_data(
+            f'New {rng.choice(TOPICS)} poll?', ['Yes', 'No', 'Maybe']
+        )
+
+
+def formset_data(question_text, choice_texts, forms=5):
+    data = {
+        'question_text': question_text,
+        'choices-TOTAL_FORMS': str(max(forms, len(choice_texts))),
+        'choices-INITIAL_FORMS': '0',
+    }
+    for n, text in enumerate(choice_texts):
+        data[f'choices-{n}-choice_text'] = text
+    return data
+
+
+class ClientTransport:
+    """Requests through the Django test client, in the calling thread."""
+
+    name = 'client'
+
+    def __init__(self, user):
+        self.client = Client()
+        self.client.force_login(user)
+
+    def send(self, method, path, data):
+        with CaptureQueriesContext(connection) as queries:
+            if method == 'GET':
+                response = self.client.get(path, data)
+            else:
+                response = self.client.post(path, data)
+        return response.status_code, len(queries), len(response.content)
+
+    def close(self):
+        pass
+
+
+class HTTPTransport:
+    """Requests over a keep-alive HTTP connection to a running server."""
+
+    name = 'http'
+
+    def __init__(self, user, base_url):
+        url = urlsplit(base_url)
+        self.connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+        login = Client()
+        login.force_login(user)
+        session = login.cookies['sessionid'].value
+        # Any 32-character secret works as a CSRF cookie if the header repeats it.
+        self.csrf = _get_new_csrf_string()
+        self.cookie = f'sessionid={session}; csrftoken={self.csrf}'
+
+    def send(self, method, path, data):
+        headers = {'Cookie': self.cookie}
+        body = None
+        if method == 'GET' and data:
+            path = f'{path}?{urlencode(data)}'
+        elif method == 'POST':
+            body = urlencode(data or {})
+            headers.update({
+                'Content-Type': 'application/x-www-form-urlencoded',
+                'X-CSRFToken': self.csrf,
+            })
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        size = len(response.read())
+        queries = response.getheader('X-Query-Count')
+        return response.status, int(queries) if queries is not None else None, size
+
+    def close(self):
+        self.connection.close()
+
+
+def count_queries(app):
+    """WSGI middleware adding an X-Query-Count header, for HTTPTransport to read."""
+
+    def counting_app(environ, start_response):
+        count = 0
+
+        def counter(execute, sql, params, many, context):
+            nonlocal count
+            count += 1
+            return execute(sql, params, many, context)
+
+        def counted_start_response(status, headers, exc_info=None):
+            return start_response(status, headers + [('X-Query-Count', str(count))], exc_info)
+
+        with connection.execute_wrapper(counter):
+            return app(environ, counted_start_response)
+
+    return counting_app
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server():
+    """Serve the project on a free local port in background threads. Returns (server, base_url)."""
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler)
+    server.set_app(count_queries(get_wsgi_application()))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, f'http://{host}:{port}'
+
+
+def percentile(timings, p):
+    """Nearest-rank percentile of sorted `timings`, in milliseconds."""
+    return timings[min(len(timings) - 1, int(len(timings) * p))] * 1000
+
+
+def summarize(timings, queries, sizes, errors, elapsed):
+    timings = sorted(timings)
+    counted = [n for n in queries if n is not None]
+    summary = {
+        'requests': len(timings) + errors,
+        'errors': errors,
+        'throughput_rps': round(len(timings) / elapsed, 1) if elapsed else 0,
+        'p50_ms': None, 'p95_ms': None, 'p99_ms': None,
+        'queries_per_request': round(sum(counted) / len(counted), 2) if counted else None,
+        'bytes_per_request': round(sum(sizes) / len(sizes)) if sizes else None,
+    }
+    if timings:
+        summary.update({
+            'p50_ms': round(percentile(timings, 0.50), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'p99_ms': round(percentile(timings, 0.99), 2),
+        })
+    return summary
+
+
+def run(requests=1000, concurrency=4, mix=None, base_url=None, random_seed=0, workload=None):
+    """
+    Send `requests` requests drawn from `mix` (name -> weight) using
+    `concurrency` virtual users, each a bench user with its own session.
+    Requests go through the test client, or over HTTP to `base_url`.
+    Returns the report as a dict.
+    """
+    mix = mix or DEFAULT_MIX
+    unknown = set(mix) - set(DEFAULT_MIX) - set(API_REQUESTS)
+    if unknown:
+        raise ValueError(f"Unknown request types: {', '.join(sorted(unknown))}")
+    workload = workload or Workload()
+    users = list(User.objects.filter(pk__in=workload.user_ids[:concurrency]))
+    names, weights = zip(*mix.items())
+
+    lock = threading.Lock()
+    remaining = requests
+    results = defaultdict(lambda: {'timings': [], 'queries': [], 'sizes': [], 'errors': 0})
+
+    def virtual_user(n):
+        nonlocal remaining
+        rng = random.Random(random_seed + n)
+        user = users[n % len(users)]
+        transport = HTTPTransport(user, base_url) if base_url else ClientTransport(user)
+        try:
+            while True:
+                with lock:
+                    if remaining <= 0:
+                        return
+                    remaining -= 1
+                name = rng.choices(names, weights)[0]
+                method, path, data = workload.request(name, user.pk, rng)
+                started = time.perf_counter()
+                try:
+                    status, queries, size = transport.send(method, path, data)
+                except (OSError, http.client.HTTPException):
+                    status, queries, size = None, None, None
+                took = time.perf_counter() - started
+                with lock:
+                    result = results[name]
+                    if status is None or status >= 400:
+                        result['errors'] += 1
+                    else:
+                        result['timings'].append(took)
+                        result['queries'].append(queries)
+                        result['sizes'].append(size)
+        finally:
+            transport.close()
+
+    started = time.perf_counter()
+    if concurrency == 1:
+        virtual_user(0)
+    else:
+        def in_thread(n):
+            try:
+                virtual_user(n)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=in_thread, args=(n,)) for n in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'transport': 'http' if base_url else 'client',
+        'requests': requests,
+        'concurrency': concurrency,
+        'mix': dict(mix),
+        'elapsed_s': round(elapsed, 3),
+        'overall': summarize(
+            [t for r in results.values() for t in r['timings']],
+            [q for r in results.values() for q in r['queries']],
+            [b for r in results.values() for b in r['sizes']],
+            sum(r['errors'] for r in results.values()),
+            elapsed,
+        ),
+        'scenarios': {
+            name: summarize(r['timings'], r['queries'], r['sizes'], r['errors'], elapsed)
+            for name, r in sorted(results.items())
+        },
+    }
+
+
+def compare(baseline, current):
+    """Lines describing how `current` differs from `baseline`, one per request type."""
+    lines = []
+    for name in ['overall'] + sorted(set(baseline['scenarios']) | set(current['scenarios'])):
+        before = baseline['overall'] if name == 'overall' else baseline['scenarios'].get(name)
+        after = current['overall'] if name == 'overall' else current['scenarios'].get(name)
+        if not before or not after or not before['p95_ms'] or not after['p95_ms']:
+            continue
+        lines.append(
+            f"{name:>8}: p95 {before['p95_ms']:.2f} -> {after['p95_ms']:.2f} ms "
+            f"({(after['p95_ms'] / before['p95_ms'] - 1) * 100:+.0f}%), "
+            f"queries {before['queries_per_request']} -> {after['queries_per_request']}"
+        )
+    return lines
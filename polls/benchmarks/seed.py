@@ -0,0 +1,94 @@
+import random
+from collections import Counter, namedtuple
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .. import search
+from ..models import Choice, Question, Vote
+
+USER_PREFIX = 'bench-user-'
+
+SeedResult = namedtuple('SeedResult', 'users questions choices votes')
+
+TOPICS = [
+    'coffee', 'tea', 'python', 'django', 'weekend', 'holiday', 'music', 'movies',
+    'football', 'hockey', 'pizza', 'sushi', 'summer', 'winter', 'cats', 'dogs',
+    'books', 'games', 'lunch', 'office',
+]
+OPENERS = ['Favourite', 'Best', 'Worst', 'Most overrated', 'Preferred', 'Next']
+
+
+def seed(users=100, questions=1000, choices=4, votes=10_000, batch_size=2000, random_seed=0):
+    """
+    Add `users` bench users and `questions` polls with `choices` choices
+    each, and spread up to `votes` votes over them: a few popular polls get
+    most of the votes and the first choices are picked more often, like
+    real traffic. A poll can't get more votes than there are users, so
+    heavily skewed runs insert fewer. Choice.votes and the Question totals
+    are filled in to match, so the data passes reconcile_vote_totals.
+    Returns a SeedResult of counts.
+    """
+    rng = random.Random(random_seed)
+    offset = User.objects.filter(username__startswith=USER_PREFIX).count()
+    password = make_password(None)
+    user_ids = []
+    for start in range(0, users, batch_size):
+        created = User.objects.bulk_create(
+            User(username=f'{USER_PREFIX}{offset + n}', password=password)
+            for n in range(start, min(start + batch_size, users))
+        )
+        user_ids.extend(user.pk for user in created)
+    if not user_ids:
+        return SeedResult(0, 0, 0, 0)
+
+    popularity = [1 / (rank + 1) for rank in range(questions)]
+    per_question = Counter(rng.choices(range(questions), popularity, k=votes)) if questions else Counter()
+    choice_weights = [1 / (rank + 1) for rank in range(choices)]
+
+    total_votes = 0
+    for start in range(0, questions, batch_size):
+        with transaction.atomic():
+            batch = []
+            for n in range(start, min(start + batch_size, questions)):
+                voters = rng.sample(user_ids, min(per_question[n], len(user_ids))) if choices else []
+                picks = rng.choices(range(choices), choice_weights, k=len(voters))
+                question = Question(
+                    question_text=f'{rng.choice(OPENERS)} {rng.choice(TOPICS)} and {rng.choice(TOPICS)}? #{n}',
+                    user_id=rng.choice(user_ids),
+                    total_votes=len(voters),
+                    choice_count=choices,
+                )
+                batch.append((question, voters, picks))
+            Question.objects.bulk_create([question for question, _, _ in batch])
+
+            choice_rows = []
+            for question, _, picks in batch:
+                tally = Counter(picks)
+                choice_rows.append([
+                    Choice(question=question, user_id=question.user_id,
+                           choice_text=f'Option {c + 1}', votes=tally[c])
+                    for c in range(choices)
+                ])
+            Choice.objects.bulk_create([choice for row in choice_rows for choice in row])
+
+            vote_rows = [
+                Vote(user_id=voter, question=question, choice=row[pick])
+                for (question, voters, picks), row in zip(batch, choice_rows)
+                for voter, pick in zip(voters, picks)
+            ]
+            Vote.objects.bulk_create(vote_rows, batch_size=batch_size)
+            total_votes += len(vote_rows)
+
+    # bulk_create() skips the signals that keep the search index current.
+    search.get_index().rebuild()
+    return SeedResult(len(user_ids), questions, questions * choices, total_votes)
+
+
+def clear():
+    """Delete every bench user; their polls and votes go with them."""
+    with transaction.atomic():
+        deleted, _ = User.objects.filter(username__startswith=USER_PREFIX).delete()
+    search.get_index().rebuild()
+    return deleted
@@ -0,0 +1,54 @@
+"""Cache backends used by the polls app."""
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+
+# Byte totals per named cache, shared like LocMemCache's own storage.
+_sizes = {}
+
+
+class SizedLocMemCache(LocMemCache):
+    """
+    LocMemCache that also evicts least recently used entries once the
+    pickled values take more than OPTIONS['MAX_BYTES'] (default 16 MiB).
+
+    MAX_ENTRIES still applies on top of the byte limit.
+    """
+
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        self._max_bytes = int(params.get('OPTIONS', {}).get('MAX_BYTES', 16 * 1024 * 1024))
+        self._size = _sizes.setdefault(name, {'bytes': 0})
+
+    @property
+    def size_bytes(self):
+        return self._size['bytes']
+
+    def _set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        self._delete(key)
+        super()._set(key, value, timeout)
+        self._size['bytes'] += len(value)
+        # The least recently used entry sits at the end of the OrderedDict.
+        while self._size['bytes'] > self._max_bytes and len(self._cache) > 1:
+            self._delete(next(reversed(self._cache)))
+
+    def _delete(self, key):
+        value = self._cache.get(key)
+        if not super()._delete(key):
+            return False
+        self._size['bytes'] -= len(value)
+        return True
+
+    def _cull(self):
+        if self._cull_frequency == 0:
+            self._cache.clear()
+            self._expire_info.clear()
+            self._size['bytes'] = 0
+        else:
+            for i in range(len(self._cache) // self._cull_frequency):
+                self._delete(next(reversed(self._cache)))
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._expire_info.clear()
+            self._size['bytes'] = 0
@@ -0,0 +1,222 @@
+"""
+Write coalescing and admission control for votes on hot polls.
+
+When one poll trends, its votes all update the same Choice and Question
+rows, so they commit one after another and every other write waits
+behind them. VoteCoalescer turns that queue into group commits. The
+first vote on a poll writes straight away, as before. Votes that arrive
+while a write for that poll is in progress join one open batch, and when
+the write finishes that batch is written in a single transaction by
+services.record_votes(): one UPDATE per choice and one multi-row INSERT.
+A batch holds at most POLLS_VOTE_BATCH_SIZE votes, and
+POLLS_VOTE_COALESCE_MS holds the first vote back that long to let a
+batch form even before the rows are busy (0 = only batch under
+contention). Each request still gets its own outcome, AlreadyVoted and
+InvalidChoice included.
+
+Admission is a token bucket per poll: POLLS_VOTE_POLL_RATE votes a
+second with bursts of POLLS_VOTE_POLL_BURST. A vote over the rate waits
+for its turn, sleeping on the request thread, only if that's at most
+POLLS_VOTE_MAX_WAIT_MS away; otherwise it's shed straight away with
+Overloaded (a 429) rather than tie up a worker. Both the batches and the
+buckets are per process.
+
+Totals for every poll go to the metrics registry. stats() has the
+per-poll numbers for the busiest polls, which would be too many series
+to label in Prometheus.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import instrumentation
+from .services import record_vote, record_votes
+
+# Votes per batch.
+BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+# Polls whose admission state and stats are kept; the least recently voted on go first.
+MAX_POLLS = 10000
+
+
+class Overloaded(Exception):
+    """The poll is over its vote rate and its queue is full."""
+
+    def __init__(self, question_id, retry_after):
+        super().__init__(question_id)
+        self.seconds = retry_after
+
+    def retry_after(self):
+        return self.seconds
+
+
+class _Batch:
+    __slots__ = ('votes', 'results', 'done')
+
+    def __init__(self):
+        self.votes = []
+        self.results = None
+        self.done = threading.Event()
+
+
+class _Poll:
+    """Admission bucket, open batch and stats of one question."""
+
+    def __init__(self, burst, now):
+        self.tokens = burst
+        self.updated = now
+        self.batch = None
+        self.writing = threading.Lock()
+        self.votes = self.queued = self.shed = 0
+        self.batches = self.max_batch = 0
+        self.latency_sum = self.latency_max = 0.0
+
+
+class VoteCoalescer:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._polls = OrderedDict()  # question id -> _Poll
+
+    def _poll(self, question_id, now):
+        # Callers hold the lock.
+        poll = self._polls.get(question_id)
+        if poll is None:
+            poll = self._polls[question_id] = _Poll(getattr(settings, 'POLLS_VOTE_POLL_BURST', 500), now)
+            while len(self._polls) > MAX_POLLS:
+                self._polls.popitem(last=False)
+        self._polls.move_to_end(question_id)
+        return poll
+
+    def _admit(self, question_id, poll, now):
+        """Seconds to wait before writing; raises Overloaded if that's too long. Callers hold the lock."""
+        rate = getattr(settings, 'POLLS_VOTE_POLL_RATE', 0)
+        if not rate:
+            return 0
+        burst = getattr(settings, 'POLLS_VOTE_POLL_BURST', 500)
+        poll.tokens = min(burst, poll.tokens + (now - poll.updated) * rate)
+        poll.updated = now
+        # Tokens go negative by the number of votes waiting their turn.
+        if (1 - poll.tokens) / rate > getattr(settings, 'POLLS_VOTE_MAX_WAIT_MS', 20) / 1000:
+            poll.shed += 1
+            raise Overloaded(question_id, max(1, round((1 - poll.tokens) / rate)))
+        poll.tokens -= 1
+        if poll.tokens >= 0:
+            return 0
+        poll.queued += 1
+        return -poll.tokens / rate
+
+    def record_vote(self, user, question_id, choice_id):
+        """services.record_vote(), admitted and batched with the other votes on the poll."""
+        question_id, choice_id = int(question_id), int(choice_id)
+        started = time.monotonic()
+        with self._lock:
+            poll = self._poll(question_id, started)
+            try:
+                wait = self._admit(question_id, poll, started)
+            except Overloaded:
+                _count_admission('shed')
+                raise
+        _count_admission('queued' if wait else 'admitted')
+        if wait:
+            time.sleep(wait)
+
+        if not getattr(settings, 'POLLS_VOTE_COALESCING', True):
+            try:
+                record_vote(user, question_id, choice_id)
+            finally:
+                self._observe(poll, 1, time.monotonic() - started)
+            return
+
+        with self._lock:
+            batch = poll.batch
+            leader = batch is None
+            if leader:
+                batch = poll.batch = _Batch()
+            index = len(batch.votes)
+            batch.votes.append((user, choice_id))
+            if len(batch.votes) >= getattr(settings, 'POLLS_VOTE_BATCH_SIZE', 200):
+                poll.batch = None
+        if leader:
+            self._write(question_id, poll, batch)
+        else:
+            batch.done.wait()
+        self._observe(poll, None, time.monotonic() - started)
+        if batch.results[index] is not None:
+            raise batch.results[index]
+
+    def _write(self, question_id, poll, batch):
+        window = getattr(settings, 'POLLS_VOTE_COALESCE_MS', 0)
+        if window:
+            time.sleep(window / 1000)
+        # Votes keep joining the batch while the previous one is being written.
+        with poll.writing:
+            with self._lock:
+                if poll.batch is batch:
+                    poll.batch = None
+            try:
+                if len(batch.votes) == 1:
+                    batch.results = [self._write_one(question_id, *batch.votes[0])]
+                else:
+                    batch.results = record_votes(question_id, batch.votes)
+            except Exception as exc:
+                batch.results = [exc] * len(batch.votes)
+                raise
+            finally:
+                batch.done.set()
+                with self._lock:
+                    poll.batches += 1
+                    poll.max_batch = max(poll.max_batch, len(batch.votes))
+                instrumentation.registry.observe('polls_vote_batch_size', 'Votes written per transaction.',
+                                                 BATCH_BUCKETS, (), len(batch.votes))
+
+    @staticmethod
+    def _write_one(question_id, user, choice_id):
+        # The plain single-vote path, so a lone vote costs what it did before.
+        try:
+            record_vote(user, question_id, choice_id)
+        except Exception as exc:
+            return exc
+        return None
+
+    def _observe(self, poll, batch_size, elapsed):
+        with self._lock:
+            poll.votes += 1
+            poll.latency_sum += elapsed
+            poll.latency_max = max(poll.latency_max, elapsed)
+            if batch_size:
+                poll.batches += 1
+                poll.max_batch = max(poll.max_batch, batch_size)
+        instrumentation.registry.observe('polls_vote_seconds', 'Time from admission to the vote being written, queueing included.',
+                                         instrumentation.TIME_BUCKETS, (), elapsed)
+
+    def stats(self, limit=20):
+        """Per-poll numbers for the `limit` polls with the most votes."""
+        with self._lock:
+            polls = sorted(self._polls.items(), key=lambda item: item[1].votes, reverse=True)[:limit]
+            return [
+                {
+                    'id': question_id,
+                    'votes': poll.votes,
+                    'queued': poll.queued,
+                    'shed': poll.shed,
+                    'batches': poll.batches,
+                    'mean_batch_size': poll.votes / poll.batches if poll.batches else 0.0,
+                    'max_batch_size': poll.max_batch,
+                    'mean_latency_ms': 1000 * poll.latency_sum / poll.votes if poll.votes else 0.0,
+                    'max_latency_ms': 1000 * poll.latency_max,
+                }
+                for question_id, poll in polls
+            ]
+
+    def reset(self):
+        with self._lock:
+            self._polls.clear()
+
+
+def _count_admission(result):
+    instrumentation.registry.inc('polls_vote_admission_total', 'Votes by admission result.', (('result', result),))
+
+
+coalescer = VoteCoalescer()
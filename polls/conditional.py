@@ -0,0 +1,65 @@
+"""
+Conditional GET for the index and results pages.
+
+Both pages only show Question rows, and every write bumps updated_at (see
+polls.fragments). The validators can therefore be worked out from the
+rows the view loads anyway, before the tally is fetched or anything is
+rendered. A client repeating the request with If-None-Match or
+If-Modified-Since gets an empty 304 instead of the page.
+
+Django's condition() decorator can't wrap the async views and would load
+the rows twice, so the views call respond() themselves.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from . import counters, fragments
+
+
+def index_etag(page, voted_ids=()):
+    """ETag of one keyset page of the index: its questions, the user's votes on them and where the cursors lead."""
+    version = (
+        f'{fragments.list_version(page.object_list)}|{fragments.voted_version(voted_ids)}'
+        f'|{page.next_cursor}|{page.prev_cursor}'
+    )
+    return hashlib.md5(version.encode()).hexdigest()
+
+
+def results_validators(question):
+    """
+    (etag, last_modified) for the results page of `question`. In sharded
+    counter mode unflushed votes don't move updated_at, so the ETag also
+    changes every POLLS_RESULTS_MAX_STALENESS seconds, there's no
+    Last-Modified, and with a staleness of 0 there are no validators.
+    """
+    if counters.counter_mode() == 'sharded':
+        staleness = getattr(settings, 'POLLS_RESULTS_MAX_STALENESS', 0)
+        if not staleness:
+            return None, None
+        return f'{fragments.stamp(question)}.{int(time.time() // staleness)}', None
+    return fragments.stamp(question), question.updated_at
+
+
+def respond(request, render, etag=None, last_modified=None):
+    """
+    A 304 Not Modified if the request's validators still match, otherwise
+    render(). Either way the response carries ETag and Last-Modified, and
+    no-cache so browsers revalidate instead of guessing a lifetime from
+    Last-Modified.
+    """
+    etag = quote_etag(etag) if etag else None
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = render()
+    if request.method in ('GET', 'HEAD') and response.status_code in (200, 304):
+        if etag:
+            response.headers.setdefault('ETag', etag)
+        if timestamp:
+            response.headers.setdefault('Last-Modified', http_date(timestamp))
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
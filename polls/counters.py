@@ -0,0 +1,226 @@
+"""
+Vote counters.
+
+In the default 'single' mode every vote bumps Choice.votes directly. In
+'sharded' mode a vote bumps one of POLLS_COUNTER_SHARDS ChoiceCounterShard
+rows picked at random, so concurrent voters on a hot choice spread over
+several rows instead of queueing on one. flush() (run periodically by the
+flush_vote_counters command) folds the shards back into Choice.votes.
+
+Question.total_votes moves with Choice.votes in the same transaction: on
+every vote in 'single' mode, on every flush in 'sharded' mode (so the hot
+question row isn't touched per vote there). reconcile() checks both
+against the Vote rows.
+
+Votes only count while the question is open (see Question.closes_at).
+Archived questions have no Choice rows left; their tallies are read from
+ArchivedChoice instead.
+"""
+import random
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import ArchivedChoice, Choice, ChoiceCounterShard, Question, Vote
+
+
+def counter_mode():
+    return getattr(settings, 'POLLS_COUNTER_MODE', 'single')
+
+
+def still_open(prefix=''):
+    """Q for questions taking votes; `prefix` is the lookup path to the question, e.g. 'question__'."""
+    return Q(**{f'{prefix}closes_at__isnull': True}) | Q(**{f'{prefix}closes_at__gt': timezone.now()})
+
+
+def increment(question_id, choice_id):
+    """Add one vote to `choice_id`. Returns False if it isn't a choice of `question_id` or the question is closed."""
+    if counter_mode() != 'sharded':
+        if not Choice.objects.filter(pk=choice_id, question_id=question_id).update(votes=F('votes') + 1):
+            return False
+        # Checking closes_at here costs nothing extra; the caller rolls back the choice UPDATE.
+        return bool(Question.objects.filter(still_open(), pk=question_id).update(
+            total_votes=F('total_votes') + 1, updated_at=timezone.now()
+        ))
+
+    return _add_to_shard(question_id, choice_id, 1)
+
+
+def increment_many(question_id, counts):
+    """
+    Add counts[choice_id] votes to each of those choices of `question_id`:
+    one UPDATE per choice, in id order like reconcile() takes its locks,
+    and in 'single' mode one for the question. Returns False, for the
+    caller to roll back, if a choice is gone or the question is closed.
+    """
+    if counter_mode() != 'sharded':
+        for choice_id, count in sorted(counts.items()):
+            if not Choice.objects.filter(pk=choice_id, question_id=question_id).update(votes=F('votes') + count):
+                return False
+        return bool(Question.objects.filter(still_open(), pk=question_id).update(
+            total_votes=F('total_votes') + sum(counts.values()), updated_at=timezone.now()
+        ))
+    for choice_id, count in sorted(counts.items()):
+        if not _add_to_shard(question_id, choice_id, count):
+            return False
+    return True
+
+
+def _add_to_shard(question_id, choice_id, count):
+    shard = random.randrange(getattr(settings, 'POLLS_COUNTER_SHARDS', 8))
+    shards = ChoiceCounterShard.objects.filter(
+        still_open('choice__question__'), choice_id=choice_id, choice__question_id=question_id, shard=shard
+    )
+    if shards.update(count=F('count') + count):
+        return True
+    if not Choice.objects.filter(still_open('question__'), pk=choice_id, question_id=question_id).exists():
+        return False
+    try:
+        with transaction.atomic():
+            ChoiceCounterShard.objects.create(choice_id=choice_id, shard=shard, count=count)
+    except IntegrityError:
+        # Someone else created the shard in the meantime.
+        shards.update(count=F('count') + count)
+    return True
+
+
+def _with_totals(choices):
+    """Annotate `choices` with `total`: Choice.votes plus, in sharded mode, the pending shard counts."""
+    if counter_mode() == 'sharded':
+        return choices.annotate(total=F('votes') + Coalesce(Sum('shards__count'), Value(0)))
+    return choices.annotate(total=F('votes'))
+
+
+def tally(question_id):
+    """[{'id', 'choice_text', 'votes'}] for a question, including pending shard counts."""
+    return [
+        {'id': pk, 'choice_text': text, 'votes': total}
+        for pk, text, total in tallies([question_id])[question_id]
+    ]
+
+
+def tallies(question_ids):
+    """
+    {question_id: [(id, choice_text, votes), ...]} for many questions, in
+    one query, plus one for any of them that have no choices (archived).
+    """
+    choices = _with_totals(Choice.objects.filter(question_id__in=question_ids).order_by('question_id', 'id'))
+    result = {question_id: [] for question_id in question_ids}
+    for question_id, pk, text, total in choices.values_list('question_id', 'id', 'choice_text', 'total'):
+        result[question_id].append((pk, text, total))
+    empty = [question_id for question_id, rows in result.items() if not rows]
+    if empty:
+        archived = ArchivedChoice.objects.filter(question_id__in=empty).order_by('question_id', 'id')
+        for question_id, pk, text, votes in archived.values_list('question_id', 'id', 'choice_text', 'votes'):
+            result[question_id].append((pk, text, votes))
+    return result
+
+
+def flush(batch_size=500):
+    """
+    Fold pending shard counts into Choice.votes. Returns the number of votes moved.
+
+    Each shard is decremented by the amount read (only if it still holds at
+    least that much) rather than zeroed, so increments that land during a
+    flush aren't lost and two flushers running at once can't double count.
+    The read happens outside the transaction so the write transaction is as
+    short as possible.
+    """
+    moved = 0
+    last_id = 0
+    while True:
+        pending = list(
+            ChoiceCounterShard.objects.filter(pk__gt=last_id, count__gt=0)
+            .order_by('pk').values_list('id', 'choice_id', 'choice__question_id', 'count')[:batch_size]
+        )
+        if not pending:
+            return moved
+        last_id = pending[-1][0]
+        per_choice, per_question = {}, {}
+        with transaction.atomic():
+            for shard_id, choice_id, question_id, count in pending:
+                if ChoiceCounterShard.objects.filter(
+                    pk=shard_id, count__gte=count
+                ).update(count=F('count') - count):
+                    per_choice[choice_id] = per_choice.get(choice_id, 0) + count
+                    per_question[question_id] = per_question.get(question_id, 0) + count
+            for choice_id, count in per_choice.items():
+                Choice.objects.filter(pk=choice_id).update(votes=F('votes') + count)
+                moved += count
+            for question_id, count in per_question.items():
+                Question.objects.filter(pk=question_id).update(
+                    total_votes=F('total_votes') + count, updated_at=timezone.now()
+                )
+
+
+def pending_total():
+    return ChoiceCounterShard.objects.aggregate(n=Coalesce(Sum('count'), Value(0)))['n']
+
+
+def reconcile(batch_size=500, repair=True, question_ids=None):
+    """
+    Check Choice.votes, Question.total_votes and Question.choice_count
+    against the Vote and Choice rows, `batch_size` questions at a time,
+    and fix any drift if `repair`. Only `question_ids` are checked if
+    given. Returns (questions checked, questions that had drifted).
+
+    Shard counts that haven't been flushed yet aren't in Choice.votes, so
+    they're subtracted from the expected values. The choices of a batch
+    are locked first, in the same order the vote path takes its locks.
+    Archived questions are frozen and skipped.
+    """
+    checked = drifted = 0
+    last_id = 0
+    candidates = Question.objects.filter(archived_at__isnull=True)
+    if question_ids is not None:
+        candidates = candidates.filter(pk__in=question_ids)
+    while True:
+        with transaction.atomic():
+            ids = list(
+                candidates.filter(pk__gt=last_id).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                return checked, drifted
+            last_id = ids[-1]
+
+            choices = list(
+                Choice.objects.select_for_update().filter(question_id__in=ids)
+                .order_by('pk').values_list('id', 'question_id', 'votes')
+            )
+            # Read after taking the locks so a vote committing meanwhile isn't counted as drift.
+            questions = Question.objects.filter(pk__in=ids).values_list('id', 'total_votes', 'choice_count')
+            cast = dict(
+                Vote.objects.filter(question_id__in=ids)
+                .values('choice_id').annotate(n=Count('id')).values_list('choice_id', 'n')
+            )
+            pending = dict(
+                ChoiceCounterShard.objects.filter(choice__question_id__in=ids)
+                .values('choice_id').annotate(n=Sum('count')).values_list('choice_id', 'n')
+            )
+
+            expected = {question_id: [0, 0] for question_id in ids}
+            stale_choices, stale = [], set()
+            for choice_id, question_id, votes in choices:
+                flushed = cast.get(choice_id, 0) - pending.get(choice_id, 0)
+                expected[question_id][0] += flushed
+                expected[question_id][1] += 1
+                if votes != flushed:
+                    stale_choices.append(Choice(pk=choice_id, votes=flushed))
+                    stale.add(question_id)
+            stale_questions = []
+            for question_id, total_votes, choice_count in questions:
+                if [total_votes, choice_count] != expected[question_id]:
+                    total_votes, choice_count = expected[question_id]
+                    stale_questions.append(Question(pk=question_id, total_votes=total_votes, choice_count=choice_count))
+                    stale.add(question_id)
+
+            checked += len(ids)
+            drifted += len(stale)
+            if repair:
+                Choice.objects.bulk_update(stale_choices, ['votes'])
+                Question.objects.bulk_update(stale_questions, ['total_votes', 'choice_count'])
+                Question.objects.filter(pk__in=stale).update(updated_at=timezone.now())
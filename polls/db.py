@@ -0,0 +1,26 @@
+"""
+Per-connection SQLite tuning for the 'sqlite-production' database profile.
+
+configure_sqlite() is connected to connection_created in PollsConfig.ready()
+and applies POLLS_SQLITE_PRAGMAS to every new SQLite connection. WAL lets
+readers carry on while a vote is being written, and with CONN_MAX_AGE the
+pragmas are paid once per connection rather than once per request.
+"""
+from django.conf import settings
+
+
+def is_read_only(connection):
+    return 'mode=ro' in str(connection.settings_dict['NAME'])
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite' or getattr(settings, 'POLLS_DB_PROFILE', 'default') != 'sqlite-production':
+        return
+    pragmas = dict(getattr(settings, 'POLLS_SQLITE_PRAGMAS', {}))
+    if is_read_only(connection):
+        # journal_mode is a property of the database file; only writers set it.
+        pragmas.pop('journal_mode', None)
+        pragmas['query_only'] = 1
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
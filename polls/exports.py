@@ -0,0 +1,76 @@
+"""
+Streaming exports of questions, choices and votes for analytics.
+
+Rows are read with QuerySet.iterator(chunk_size=...) and written out a
+line at a time (optionally gzipped on the fly), so memory stays flat
+however big the tables are. Exports can be incremental: pass the last id
+from the previous run as `since_id`, or a `since` datetime to only export
+rows belonging to questions published after it.
+"""
+import csv
+import json
+import zlib
+
+from .models import Choice, Question, Vote
+
+EXPORTS = {
+    'questions': (Question, ['id', 'question_text', 'pub_date', 'user_id'], 'pub_date'),
+    'choices': (Choice, ['id', 'question_id', 'choice_text', 'votes', 'user_id'], 'question__pub_date'),
+    'votes': (Vote, ['id', 'user_id', 'question_id', 'choice_id'], 'question__pub_date'),
+}
+
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+def export_rows(kind, since_id=None, since=None, chunk_size=2000):
+    """Tuples of EXPORTS[kind] fields in id order."""
+    model, fields, date_field = EXPORTS[kind]
+    queryset = model.objects.order_by('id')
+    if since_id is not None:
+        queryset = queryset.filter(id__gt=since_id)
+    if since is not None:
+        queryset = queryset.filter(**{f'{date_field}__gt': since})
+    return queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+
+
+class _Echo:
+    """File-like object whose write() hands the line back to csv.writer's caller."""
+
+    def write(self, value):
+        return value
+
+
+def render_lines(kind, rows, fmt):
+    fields = EXPORTS[kind][1]
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(fields)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(fields, row)), default=str) + '\n'
+
+
+def encode(lines, compress=False, block_size=64 * 1024):
+    """
+    Encode lines to bytes in blocks of roughly `block_size`, gzipping them
+    when `compress` is set.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    buffer, size = [], 0
+    for line in lines:
+        data = line.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= block_size:
+            block = b''.join(buffer)
+            buffer, size = [], 0
+            block = compressor.compress(block) if compressor else block
+            if block:
+                yield block
+    block = b''.join(buffer)
+    if compressor:
+        block = compressor.compress(block) + compressor.flush()
+    if block:
+        yield block
@@ -4,7 +4,8 @@ from .models import Question, Choice
 class QuestionForm(forms.ModelForm):
     class Meta:
         model = Question
-        fields = ['question_text']
+        fields = ['question_text', 'closes_at']
+        widgets = {'closes_at': forms.DateTimeInput(attrs={'type': 'datetime-local'}, format='%Y-%m-%dT%H:%M')}
 
 ChoiceFormset = forms.inlineformset_factory(
     Question, Choice, fields=('choice_text',), extra=1, max_num=10, validate_max=True
@@ -0,0 +1,37 @@
+"""
+Versions for the {% cache %} fragments in the polls templates.
+
+A fragment is keyed by the Question.updated_at stamps of what it shows.
+Every write path bumps the stamp (votes, counter flushes, edits,
+reconcile_vote_totals), so a change starts a new fragment straight away
+and stale versions just age out of the LRU. Fragments live in the
+'template_fragments' cache alias.
+"""
+from django.conf import settings
+
+from . import counters
+
+
+def stamp(question):
+    return f'{question.pk}.{question.updated_at.timestamp()}'
+
+
+def list_version(questions):
+    """Version of a rendered list of questions, e.g. one index page."""
+    return ','.join(stamp(question) for question in questions)
+
+
+def voted_version(question_ids):
+    """Version of the "voted" marks on a list: users who voted on the same polls share a fragment."""
+    return ','.join(str(pk) for pk in question_ids) or '-'
+
+
+def results_timeout():
+    """
+    None (keep until the stamp changes), except in sharded mode: there a
+    vote doesn't move the stamp until it's flushed, so the fragment may
+    only live as long as the tally is allowed to be stale (0 = not at all).
+    """
+    if counters.counter_mode() == 'sharded':
+        return getattr(settings, 'POLLS_RESULTS_MAX_STALENESS', 0)
+    return None
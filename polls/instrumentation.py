@@ -0,0 +1,261 @@
+"""
+Per-request performance instrumentation.
+
+InstrumentationMiddleware times each request and collects, through a
+context variable, what happened while it ran:
+
+- SQL queries and the time spent in them (an execute_wrapper that
+  PollsConfig.ready() installs on every new database connection),
+- template render time (Template.render, wrapped in ready()),
+- cache hits and misses (reported by callers such as ResultsCache).
+
+The numbers are folded into in-memory histograms labelled with the view
+name and served in Prometheus text format by the metrics view. They're per
+process, so scrape every worker. A POLLS_PROFILE_SAMPLE_RATE share of
+requests also runs under cProfile; the stats of those slower than
+POLLS_PROFILE_SLOW_MS are written to POLLS_PROFILE_DIR.
+"""
+import asyncio
+import bisect
+import contextvars
+import cProfile
+import random
+import re
+import threading
+import time
+from functools import wraps
+from pathlib import Path
+
+from django.conf import settings
+
+# Request durations, and query and template time, in seconds.
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'query_seconds', 'template_seconds', 'rendering', 'cache')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.template_seconds = 0.0
+        self.rendering = False
+        self.cache = {}
+
+
+_current = contextvars.ContextVar('polls_request_stats', default=None)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    """Histograms, counters and collected gauges keyed by (name, labels), rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}  # name -> (kind, help, {labels: Histogram or count})
+        self._collectors = []
+
+    def _series(self, name, kind, help):
+        return self._metrics.setdefault(name, (kind, help, {}))[2]
+
+    def observe(self, name, help, buckets, labels, value):
+        with self._lock:
+            series = self._series(name, 'histogram', help)
+            series.setdefault(labels, Histogram(buckets)).observe(value)
+
+    def inc(self, name, help, labels, amount=1):
+        with self._lock:
+            series = self._series(name, 'counter', help)
+            series[labels] = series.get(labels, 0) + amount
+
+    def collector(self, func):
+        """
+        Register func() to be called on every render. It returns gauges
+        read at scrape time, as (name, help, labels, value) tuples.
+        """
+        self._collectors.append(func)
+        return func
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+
+    def render(self):
+        gauges = {}
+        for collect in self._collectors:
+            for name, help, labels, value in collect():
+                gauges.setdefault(name, ('gauge', help, {}))[2][labels] = value
+        lines = []
+        with self._lock:
+            for name, (kind, help, series) in sorted({**self._metrics, **gauges}.items()):
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in sorted(series.items()):
+                    if kind != 'histogram':
+                        lines.append(f'{name}{_labels(labels)} {value}')
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(value.buckets + ('+Inf',), value.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_labels(labels + (("le", str(bound)),))} {cumulative}')
+                    lines.append(f'{name}_sum{_labels(labels)} {value.sum:.6f}')
+                    lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+registry = Registry()
+
+
+def count_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_seconds += time.perf_counter() - started
+
+
+def install_query_counter(sender, connection, **kwargs):
+    """connection_created receiver; the same wrapper object survives reconnects, so add it once."""
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def instrument_templates():
+    """Wrap Template.render to time the outermost render of each request."""
+    from django.template.base import Template
+
+    original = Template.render
+    if getattr(original, 'instrumented', False):
+        return
+
+    @wraps(original)
+    def render(self, context):
+        stats = _current.get()
+        if stats is None or stats.rendering:
+            # Not in a request, or an {% include %} inside a render already being timed.
+            return original(self, context)
+        stats.rendering = True
+        started = time.perf_counter()
+        try:
+            return original(self, context)
+        finally:
+            stats.rendering = False
+            stats.template_seconds += time.perf_counter() - started
+
+    render.instrumented = True
+    Template.render = render
+
+
+def cache_access(cache, hit):
+    """Count a lookup in `cache` against the current request, if there is one."""
+    stats = _current.get()
+    if stats is not None:
+        key = (('cache', cache), ('result', 'hit' if hit else 'miss'))
+        stats.cache[key] = stats.cache.get(key, 0) + 1
+
+
+def record(request, response, stats, elapsed):
+    match = getattr(request, 'resolver_match', None)
+    labels = (('view', match.view_name if match else 'unresolved'),)
+    registry.inc('polls_requests_total', 'Requests by view and status code.',
+                 labels + (('status', str(getattr(response, 'status_code', 500))),))
+    registry.observe('polls_request_duration_seconds', 'Time to produce the response.',
+                     TIME_BUCKETS, labels, elapsed)
+    registry.observe('polls_request_queries', 'SQL queries per request.',
+                     QUERY_COUNT_BUCKETS, labels, stats.queries)
+    registry.observe('polls_request_query_seconds', 'Time spent in SQL queries per request.',
+                     TIME_BUCKETS, labels, stats.query_seconds)
+    registry.observe('polls_request_template_seconds', 'Time spent rendering templates per request.',
+                     TIME_BUCKETS, labels, stats.template_seconds)
+    for key, count in stats.cache.items():
+        registry.inc('polls_cache_requests_total', 'Cache lookups by view, cache and result.', labels + key, count)
+    return labels[0][1]
+
+
+def _profiling():
+    return (
+        getattr(settings, 'POLLS_PROFILE_DIR', None)
+        and random.random() < getattr(settings, 'POLLS_PROFILE_SAMPLE_RATE', 0)
+    )
+
+
+def _dump_profile(profiler, view, elapsed):
+    if elapsed * 1000 < getattr(settings, 'POLLS_PROFILE_SLOW_MS', 500):
+        return
+    directory = Path(settings.POLLS_PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    name = re.sub(r'[^\w.-]', '_', view)
+    profiler.dump_stats(directory / f'{time.strftime("%Y%m%d-%H%M%S")}-{name}-{elapsed * 1000:.0f}ms.prof')
+
+
+class InstrumentationMiddleware:
+    """Put this first in MIDDLEWARE so the other middleware's queries are counted too."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Tell Django's handler this middleware is a coroutine function.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        profiler = cProfile.Profile() if _profiling() else None
+        started = time.perf_counter()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            response = self.get_response(request)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            _current.reset(token)
+        elapsed = time.perf_counter() - started
+        view = record(request, response, stats, elapsed)
+        if profiler is not None:
+            _dump_profile(profiler, view, elapsed)
+        return response
+
+    async def __acall__(self, request):
+        # cProfile only sees one thread and would mix in other requests on
+        # the event loop, so async requests are timed but never profiled.
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        record(request, response, stats, time.perf_counter() - started)
+        return response
@@ -0,0 +1,211 @@
+"""
+Background jobs for work that doesn't have to finish inside the request.
+
+Handlers are registered by kind (see polls.tasks) and take a list of
+payloads, so a worker runs many jobs of one kind in a single call:
+
+    jobs.enqueue('search.index', {'id': 1, 'text': 'Tea or coffee?'})
+
+With POLLS_JOBS_ENABLED off (the default) enqueue() just runs the handler
+straight away. With it on, enqueue() waits for the surrounding transaction
+to commit and adds the job to an in-process outbox. The outbox is written
+to the Job table with one bulk INSERT once it holds POLLS_JOBS_OUTBOX_SIZE
+jobs or POLLS_JOBS_OUTBOX_INTERVAL seconds after its first job, so the
+request that queued a job doesn't pay for a write. Jobs still in the
+outbox when a process dies are lost, so only queue work that can be
+redone (rebuild_search_index, reconcile_vote_totals).
+
+`manage.py run_jobs` workers claim the oldest due job together with up to
+the handler's batch_size more of the same kind. A claim pushes run_at
+POLLS_JOBS_LEASE seconds ahead, so the jobs of a worker that dies become
+due again. A failed batch is retried after POLLS_JOBS_RETRY_DELAY seconds,
+doubling on every attempt, and is kept with failed_at set after
+POLLS_JOBS_MAX_ATTEMPTS attempts. Delivery is at least once.
+"""
+import atexit
+import threading
+import time
+import traceback
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from . import instrumentation
+from .models import Job
+
+# Queue latency, from enqueue() to the end of the run, in seconds.
+LATENCY_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+Handler = namedtuple('Handler', 'func batch_size')
+HANDLERS = {}
+
+
+def handler(kind, batch_size=100):
+    """Register func(payloads) as the handler of `kind` jobs."""
+    def register(func):
+        HANDLERS[kind] = Handler(func, batch_size)
+        return func
+    return register
+
+
+def enabled():
+    return getattr(settings, 'POLLS_JOBS_ENABLED', False)
+
+
+def enqueue(kind, payload):
+    if kind not in HANDLERS:
+        raise KeyError(f"No handler for {kind!r} jobs.")
+    if not enabled():
+        HANDLERS[kind].func([payload])
+        return
+    job = Job(kind=kind, payload=payload, created_at=timezone.now())
+    transaction.on_commit(lambda: outbox.add(job))
+
+
+class Outbox:
+    """Jobs waiting to be inserted, flushed by size or by a timer thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._timer = None
+
+    def add(self, job):
+        with self._lock:
+            self._pending.append(job)
+            due = len(self._pending) >= getattr(settings, 'POLLS_JOBS_OUTBOX_SIZE', 100)
+            if not due and self._timer is None:
+                self._timer = threading.Timer(getattr(settings, 'POLLS_JOBS_OUTBOX_INTERVAL', 1), self._flush_in_thread)
+                self._timer.daemon = True
+                self._timer.start()
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if pending:
+            Job.objects.bulk_create(pending)
+        return len(pending)
+
+    def _flush_in_thread(self):
+        try:
+            self.flush()
+        finally:
+            connections.close_all()
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+
+outbox = Outbox()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        outbox.flush()
+    except DatabaseError:
+        pass
+
+
+def claim(now=None):
+    """
+    Claim the oldest due job and up to its handler's batch_size - 1 more
+    due jobs of the same kind. Returns (kind, [Job]); kind is None if
+    nothing is due.
+    """
+    now = now or timezone.now()
+    due = Job.objects.filter(failed_at__isnull=True, run_at__lte=now)
+    kind = due.order_by('run_at').values_list('kind', flat=True).first()
+    if kind is None:
+        return None, []
+    batch_size = HANDLERS[kind].batch_size if kind in HANDLERS else 1
+    ids = list(due.filter(kind=kind).order_by('run_at').values_list('pk', flat=True)[:batch_size])
+    token = uuid.uuid4().hex
+    lease = timedelta(seconds=getattr(settings, 'POLLS_JOBS_LEASE', 300))
+    # run_at__lte is checked again so a job another worker claimed meanwhile
+    # is skipped. Attempts count from the claim, so a job whose worker keeps
+    # dying still runs out of them.
+    Job.objects.filter(pk__in=ids, run_at__lte=now).update(
+        run_at=now + lease, claimed_by=token, attempts=F('attempts') + 1,
+    )
+    return kind, list(Job.objects.filter(claimed_by=token).order_by('run_at', 'pk'))
+
+
+def run(kind, jobs):
+    """Run one claimed batch. Returns True if it succeeded."""
+    started = time.perf_counter()
+    labels = (('kind', kind),)
+    ids = [job.pk for job in jobs]
+    try:
+        if kind not in HANDLERS:
+            raise KeyError(f"No handler for {kind!r} jobs.")
+        with transaction.atomic():
+            HANDLERS[kind].func([job.payload for job in jobs])
+            Job.objects.filter(pk__in=ids, claimed_by=jobs[0].claimed_by).delete()
+    except Exception:
+        retry(jobs, traceback.format_exc())
+        instrumentation.registry.inc('polls_jobs_total', 'Jobs run, by kind and result.',
+                                     labels + (('result', 'error'),), len(jobs))
+        return False
+    finished = timezone.now()
+    registry = instrumentation.registry
+    registry.inc('polls_jobs_total', 'Jobs run, by kind and result.', labels + (('result', 'done'),), len(jobs))
+    registry.observe('polls_job_batch_seconds', 'Time to run one batch of jobs.',
+                     instrumentation.TIME_BUCKETS, labels, time.perf_counter() - started)
+    for job in jobs:
+        registry.observe('polls_job_latency_seconds', 'Time from enqueue to done.',
+                         LATENCY_BUCKETS, labels, (finished - job.created_at).total_seconds())
+    return True
+
+
+def retry(jobs, error):
+    now = timezone.now()
+    max_attempts = getattr(settings, 'POLLS_JOBS_MAX_ATTEMPTS', 5)
+    delay = getattr(settings, 'POLLS_JOBS_RETRY_DELAY', 2)
+    for job in jobs:
+        job.last_error = error
+        job.claimed_by = ''
+        if job.attempts >= max_attempts:
+            job.failed_at = now
+        else:
+            job.run_at = now + timedelta(seconds=delay * 2 ** (job.attempts - 1))
+    Job.objects.bulk_update(jobs, ['attempts', 'last_error', 'claimed_by', 'failed_at', 'run_at'])
+
+
+def work(max_batches=None):
+    """Claim and run due batches until none are left (or `max_batches` ran). Returns the number of jobs run."""
+    count = batches = 0
+    while max_batches is None or batches < max_batches:
+        kind, jobs = claim()
+        if not jobs:
+            break
+        run(kind, jobs)
+        count += len(jobs)
+        batches += 1
+    return count
+
+
+@instrumentation.registry.collector
+def queue_depth():
+    """Queued and failed jobs by kind, read from the Job table at scrape time."""
+    rows = (
+        Job.objects.values('kind')
+        .annotate(queued=Count('pk', filter=Q(failed_at__isnull=True)), failed=Count('pk', filter=Q(failed_at__isnull=False)))
+        .values_list('kind', 'queued', 'failed')
+    )
+    gauges = []
+    for kind, queued, failed in rows:
+        gauges.append(('polls_jobs_queued', 'Jobs waiting to run, by kind.', (('kind', kind),), queued))
+        gauges.append(('polls_jobs_failed', 'Jobs that ran out of attempts, by kind.', (('kind', kind),), failed))
+    return gauges
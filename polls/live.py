@@ -0,0 +1,327 @@
+"""
+Live vote-count updates for the results page.
+
+record_vote() publishes {choice_id: delta} for a question once the vote
+commits. Subscribers (the results stream, one per open results page) get
+the deltas merged together and delivered at most
+POLLS_LIVE_MAX_UPDATES_PER_SECOND times a second, however fast votes
+arrive.
+
+Without POLLS_LIVE_BROKER the bus only reaches subscribers in the same
+process. With several worker processes, run the live_broker command and
+point POLLS_LIVE_BROKER at it ('host:port'): publishes go to the broker,
+and each process holding subscribers keeps one connection to it and fans
+the messages out locally. Publishing to the broker happens on a
+background thread. Delivery is best effort; the page is still correct on
+reload.
+
+The stream itself is a small ASGI app (results_stream_app) mounted in
+CyberSec/asgi.py, because Django 4.0 can't stream from async iterators.
+"""
+import asyncio
+import json
+import queue
+import re
+import socket
+import threading
+import time
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import close_old_connections
+from django.http.cookie import parse_cookie
+from django.utils import timezone
+
+from .models import Question
+
+# Publishes waiting for the broker; further ones go to local subscribers only.
+QUEUE_SIZE = 10000
+
+
+class Subscription:
+
+    def __init__(self, question_id, loop):
+        self.question_id = question_id
+        self.loop = loop
+        self.pending = {}
+        self.event = asyncio.Event()
+        self.last_sent = float('-inf')
+
+    def deliver(self, deltas):
+        # Always runs on self.loop.
+        for choice_id, delta in deltas.items():
+            self.pending[choice_id] = self.pending.get(choice_id, 0) + delta
+        self.event.set()
+
+    async def next_batch(self, interval):
+        """
+        Wait for deltas and return them merged, no sooner than `interval`
+        seconds after the previous batch. Cancelling the wait loses nothing.
+        """
+        await self.event.wait()
+        wait = self.last_sent + interval - self.loop.time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self.event.clear()
+        batch, self.pending = self.pending, {}
+        self.last_sent = self.loop.time()
+        return batch
+
+
+class LocalBus:
+    """Fans deltas out to the subscriptions in this process. publish() is thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, question_id):
+        subscription = Subscription(question_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions.setdefault(question_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.question_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.question_id, None)
+
+    def has_subscribers(self):
+        with self._lock:
+            return bool(self._subscriptions)
+
+    def publish(self, question_id, deltas):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(question_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, deltas)
+            except RuntimeError:
+                # The subscriber's event loop is gone.
+                self.unsubscribe(subscription)
+
+
+local_bus = LocalBus()
+
+
+def broker_address():
+    address = getattr(settings, 'POLLS_LIVE_BROKER', None)
+    if not address:
+        return None
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+def encode_message(question_id, deltas):
+    return (json.dumps({'q': question_id, 'd': deltas}, separators=(',', ':')) + '\n').encode()
+
+
+def decode_message(line):
+    message = json.loads(line)
+    return int(message['q']), {int(choice_id): int(delta) for choice_id, delta in message['d'].items()}
+
+
+class BrokerPublisher:
+    """
+    Best-effort connection to the broker. Publishes are queued and written
+    by one background thread, so a vote never waits on the broker. If the
+    broker can't be reached, publishing to it stops for
+    POLLS_LIVE_BROKER_RETRY seconds and votes only reach this process's
+    subscribers meanwhile.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()  # the socket
+        self._start_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._thread = None
+        self._sock = None
+        self._down_until = float('-inf')
+
+    def available(self):
+        return time.monotonic() >= self._down_until
+
+    def send(self, address, question_id, deltas):
+        """Queue a message for the broker. False if it's marked down or the queue is full."""
+        if not self.available():
+            return False
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='polls-live-publisher', daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait((address, question_id, deltas))
+        except queue.Full:
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            address, question_id, deltas = self._queue.get()
+            if not (self.available() and self._write(address, encode_message(question_id, deltas))):
+                local_bus.publish(question_id, deltas)
+
+    def _write(self, address, data):
+        with self._lock:
+            # A connection the broker dropped gets one fresh attempt.
+            for _ in range(2):
+                reconnect = self._sock is None
+                try:
+                    if reconnect:
+                        self._sock = socket.create_connection(address, timeout=0.5)
+                    self._sock.sendall(data)
+                    return True
+                except OSError:
+                    if self._sock is not None:
+                        self._sock.close()
+                    self._sock = None
+                    if reconnect:
+                        break
+            self._down_until = time.monotonic() + getattr(settings, 'POLLS_LIVE_BROKER_RETRY', 5)
+            return False
+
+    def close(self):
+        with self._lock:
+            if self._sock is not None:
+                self._sock.close()
+            self._sock = None
+            self._down_until = float('-inf')
+
+
+_publisher = BrokerPublisher()
+
+
+def publish(question_id, deltas):
+    address = broker_address()
+    if address is None or not _publisher.send(address, question_id, deltas):
+        # No broker, or it's down: at least reach this process's subscribers.
+        local_bus.publish(question_id, deltas)
+
+
+_relay_task = None
+
+
+async def _relay_from_broker(address):
+    """Feed broker messages into local_bus while this process has subscribers."""
+    backoff = 0.5
+    while local_bus.has_subscribers():
+        try:
+            reader, writer = await asyncio.open_connection(*address)
+            try:
+                writer.write(b'SUB\n')
+                await writer.drain()
+                backoff = 0.5
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    try:
+                        local_bus.publish(*decode_message(line))
+                    except (ValueError, KeyError, TypeError):
+                        continue
+            finally:
+                writer.close()
+        except OSError:
+            pass
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, 10)
+
+
+def _ensure_relay():
+    global _relay_task
+    address = broker_address()
+    if address is not None and (_relay_task is None or _relay_task.done()):
+        _relay_task = asyncio.get_running_loop().create_task(_relay_from_broker(address))
+
+
+def _session_user_id(cookie_header):
+    session_key = parse_cookie(cookie_header).get(settings.SESSION_COOKIE_NAME)
+    if session_key is None:
+        return None
+
+    class SessionRequest:
+        session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+
+    try:
+        user = get_user(SessionRequest())
+        return user.pk if user.is_authenticated else None
+    finally:
+        close_old_connections()
+
+
+def _is_published(question_id):
+    try:
+        return Question.objects.filter(pk=question_id, pub_date__lte=timezone.now()).exists()
+    finally:
+        close_old_connections()
+
+
+STREAM_PATH = re.compile(r'^/(?:polls/)?(?P<question_id>\d+)/results/stream/$')
+
+
+async def results_stream_app(scope, receive, send, question_id):
+    """Server-sent events with vote deltas for one question: data: {"<choice id>": delta, ...}"""
+    headers = dict(scope['headers'])
+    cookie = headers.get(b'cookie', b'').decode('latin-1')
+    if await sync_to_async(_session_user_id)(cookie) is None:
+        await send({'type': 'http.response.start', 'status': 403, 'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': b'Login required.'})
+        return
+    # Like the API, treat questions that aren't published yet as missing.
+    if not await sync_to_async(_is_published)(question_id):
+        await send({'type': 'http.response.start', 'status': 404, 'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': b'No question found.'})
+        return
+
+    subscription = local_bus.subscribe(question_id)
+    _ensure_relay()
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    loop = asyncio.get_running_loop()
+    watcher = loop.create_task(watch_disconnect())
+    interval = 1 / getattr(settings, 'POLLS_LIVE_MAX_UPDATES_PER_SECOND', 2)
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+        while True:
+            next_batch = loop.create_task(subscription.next_batch(interval))
+            done, _ = await asyncio.wait({next_batch, watcher}, timeout=15, return_when=asyncio.FIRST_COMPLETED)
+            if watcher in done:
+                next_batch.cancel()
+                break
+            if next_batch in done:
+                body = b'data: ' + json.dumps(next_batch.result()).encode() + b'\n\n'
+            else:
+                next_batch.cancel()
+                # Comment line to keep proxies from closing an idle stream.
+                body = b': ping\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        watcher.cancel()
+        local_bus.unsubscribe(subscription)
+
+
+def with_live_results(django_app):
+    """Wrap the Django ASGI app so /<id>/results/stream/ is served by results_stream_app."""
+    async def application(scope, receive, send):
+        if scope['type'] == 'http':
+            match = STREAM_PATH.match(scope['path'])
+            if match:
+                return await results_stream_app(scope, receive, send, int(match['question_id']))
+        return await django_app(scope, receive, send)
+    return application
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from polls import archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Archive polls closed more than POLLS_ARCHIVE_AFTER seconds ago: freeze their tallies, "
+        "move their votes to the archive table and delete their choices."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Votes moved per transaction (default: POLLS_ARCHIVE_BATCH_SIZE).")
+        parser.add_argument('--limit', type=int, default=None, help="Archive at most this many polls.")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the polls that are due.")
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            self.stdout.write(f"{len(archive.due()[:options['limit']])} polls are due for archiving.")
+            return
+        questions, votes = archive.archive(batch_size=options['batch_size'], limit=options['limit'])
+        self.stdout.write(f"Archived {questions} polls, moved {votes} votes to '{archive.archive_database()}'.")
@@ -0,0 +1,116 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections
+from django.utils import timezone
+
+from polls import counters
+from polls.models import Choice, Question
+from polls.pagination import keyset_page
+from polls.routers import read_only_alias, reading_from
+from polls.services import record_vote
+
+PROFILES = ('default', 'sqlite-production')
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the default and sqlite-production database profiles under "
+        "concurrent readers and vote writers. Each profile runs in its own "
+        "process against a scratch database file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--worker', action='store_true', help="Internal: run one profile in this process.")
+
+    def handle(self, *args, **options):
+        if options['worker']:
+            self.stdout.write(json.dumps(self.run_worker(options)))
+            return
+
+        for profile in PROFILES:
+            with tempfile.TemporaryDirectory() as tmp:
+                env = {**os.environ, 'POLLS_DB_PROFILE': profile, 'POLLS_DB_NAME': str(Path(tmp) / 'bench.sqlite3')}
+                output = subprocess.run(
+                    [sys.executable, sys.argv[0], 'bench_db', '--worker',
+                     '--readers', str(options['readers']),
+                     '--writers', str(options['writers']),
+                     '--seconds', str(options['seconds'])],
+                    env=env, capture_output=True, text=True, check=True,
+                ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            self.stdout.write(
+                f"{profile:>17}: {result['reads_per_second']:8.1f} reads/s, "
+                f"{result['writes_per_second']:7.1f} votes/s, "
+                f"{result['errors']} errors ({result['read_alias'] or 'default'} for reads)"
+            )
+
+    def run_worker(self, options):
+        call_command('migrate', verbosity=0)
+        owner = User.objects.create_user('bench-owner')
+        for i in range(50):
+            question = Question.objects.create(user=owner, question_text=f'Question {i}', pub_date=timezone.now())
+            Choice.objects.bulk_create([Choice(question=question, user=owner, choice_text=t) for t in ('Yes', 'No')])
+        target = Question.objects.latest('pk')
+        choice_id = target.choice_set.values_list('pk', flat=True).first()
+        alias = read_only_alias()
+        close_old_connections()
+
+        stop = threading.Event()
+        lock = threading.Lock()
+        totals = {'reads': 0, 'writes': 0, 'errors': 0}
+
+        def count(key):
+            with lock:
+                totals[key] += 1
+
+        def reader():
+            while not stop.is_set():
+                try:
+                    with reading_from(alias):
+                        list(keyset_page(Question.objects.all(), None, 5).object_list)
+                        counters.tally(target.pk)
+                    count('reads')
+                except OperationalError:
+                    count('errors')
+                # What the request_finished handler does between requests.
+                close_old_connections()
+
+        def writer():
+            while not stop.is_set():
+                try:
+                    user = User.objects.create_user(f'voter-{uuid.uuid4().hex}')
+                    record_vote(user, target.pk, choice_id)
+                    count('writes')
+                except OperationalError:
+                    count('errors')
+                close_old_connections()
+
+        threads = [threading.Thread(target=reader) for _ in range(options['readers'])]
+        threads += [threading.Thread(target=writer) for _ in range(options['writers'])]
+        for thread in threads:
+            thread.start()
+        time.sleep(options['seconds'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        return {
+            'read_alias': alias,
+            'reads_per_second': totals['reads'] / options['seconds'],
+            'writes_per_second': totals['writes'] / options['seconds'],
+            'errors': totals['errors'],
+        }
@@ -0,0 +1,105 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "HTTP load generator: keeps --concurrency keep-alive connections busy "
+        "against a running server and reports throughput and latency "
+        "percentiles. Compare e.g. `uvicorn CyberSec.asgi:application` "
+        "(async views) with `gunicorn CyberSec.wsgi` on the same URL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help="e.g. http://127.0.0.1:8000/polls/1/results/")
+        parser.add_argument('--concurrency', type=int, default=1000)
+        parser.add_argument('--requests', type=int, default=20000)
+        parser.add_argument('--cookie', action='append', default=[],
+                            help="name=value, e.g. sessionid=... for login-protected pages. Repeatable.")
+        parser.add_argument('--timeout', type=float, default=30)
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError("Only plain http:// URLs are supported.")
+        result = asyncio.run(self.run(url, options))
+        timings = sorted(result['timings'])
+        if not timings:
+            raise CommandError(f"No successful requests ({result['errors']} errors).")
+
+        def pct(p):
+            return timings[min(len(timings) - 1, int(len(timings) * p))] * 1000
+
+        self.stdout.write(
+            f"{len(timings)} ok, {result['errors']} errors, {result['elapsed']:.2f}s, "
+            f"{len(timings) / result['elapsed']:.0f} req/s\n"
+            f"latency p50 {pct(0.50):.1f} ms, p95 {pct(0.95):.1f} ms, p99 {pct(0.99):.1f} ms"
+        )
+
+    async def run(self, url, options):
+        path = (url.path or '/') + (f'?{url.query}' if url.query else '')
+        headers = [f'GET {path} HTTP/1.1', f'Host: {url.netloc}', 'Connection: keep-alive']
+        if options['cookie']:
+            headers.append('Cookie: ' + '; '.join(options['cookie']))
+        request = ('\r\n'.join(headers) + '\r\n\r\n').encode()
+
+        remaining = options['requests']
+        timings, errors = [], 0
+
+        async def worker():
+            nonlocal remaining, errors
+            reader = writer = None
+            while remaining > 0:
+                remaining -= 1
+                started = time.perf_counter()
+                try:
+                    if writer is None:
+                        reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+                    writer.write(request)
+                    status, keep_alive = await asyncio.wait_for(read_response(reader), options['timeout'])
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                    errors += 1
+                    if writer is not None:
+                        writer.close()
+                    reader = writer = None
+                    continue
+                if status < 400:
+                    timings.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+                if not keep_alive:
+                    writer.close()
+                    reader = writer = None
+            if writer is not None:
+                writer.close()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(options['concurrency'])))
+        return {'timings': timings, 'errors': errors, 'elapsed': time.perf_counter() - started}
+
+
+async def read_response(reader):
+    """Read one HTTP/1.1 response; returns (status, keep_alive)."""
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.read()
+        return status, False
+    return status, headers.get('connection', '').lower() != 'close'
@@ -0,0 +1,62 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from polls.models import Question
+from polls.pagination import encode_cursor, keyset_page
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed synthetic questions and compare fetching index pages at "
+        "increasing depth with OFFSET against keyset cursors. The seeded "
+        "questions are removed afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=200_000)
+        parser.add_argument('--depths', type=int, nargs='+', default=[0, 1_000, 10_000, 100_000])
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--chunk-size', type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        first_id = (Question.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        remaining = options['questions']
+        while remaining:
+            n = min(remaining, options['chunk_size'])
+            with transaction.atomic():
+                Question.objects.bulk_create(
+                    Question(question_text=f'Question {remaining - i}') for i in range(n)
+                )
+            remaining -= n
+
+        queryset = Question.objects.all()
+        page_size = options['page_size']
+        try:
+            for depth in options['depths']:
+                offset = self.time(options['repeat'], lambda: list(
+                    queryset.order_by('-pub_date', '-pk')[depth:depth + page_size]
+                ))
+                # The cursor a reader would hold after paging down to `depth`.
+                cursor = None
+                if depth:
+                    last = queryset.order_by('-pub_date', '-pk')[depth - 1]
+                    cursor = encode_cursor(last, 'next')
+                keyset = self.time(options['repeat'], lambda: keyset_page(queryset, cursor, page_size))
+                self.stdout.write(
+                    f"depth {depth:>8}: OFFSET {offset * 1000:8.2f} ms   keyset {keyset * 1000:6.2f} ms"
+                )
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute("DELETE FROM polls_question WHERE id >= %s AND user_id IS NULL", [first_id])
+
+    def time(self, repeat, run):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings)
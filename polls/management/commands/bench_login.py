@@ -0,0 +1,57 @@
+import statistics
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from polls.audit import login_audit
+
+
+class Command(BaseCommand):
+    help = "Measure login POST latency with the login throttle on and off."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--fast-hasher', action='store_true',
+                            help="Use MD5 password hashing so the throttle overhead isn't hidden by PBKDF2.")
+
+    def handle(self, *args, **options):
+        hashers = ['django.contrib.auth.hashers.MD5PasswordHasher'] if options['fast_hasher'] else None
+        overrides = {'ALLOWED_HOSTS': ['testserver']}
+        if hashers:
+            overrides['PASSWORD_HASHERS'] = hashers
+
+        with override_settings(**overrides):
+            tag = uuid.uuid4().hex[:8]
+            user = User.objects.create_user(f'bench-{tag}', password='bench-password-1')
+            try:
+                for enabled in (False, True):
+                    with override_settings(POLLS_THROTTLE_ENABLED=enabled):
+                        self.run(user, enabled, options['requests'])
+            finally:
+                login_audit.flush()
+                user.delete()
+
+    def run(self, user, enabled, requests):
+        caches['throttle'].clear()
+        client = Client()
+        url = reverse('polls:login')
+        timings = []
+        for i in range(requests):
+            # Alternate good and bad passwords; a success resets the failure count.
+            password = 'bench-password-1' if i % 2 else 'wrong'
+            started = time.perf_counter()
+            client.post(url, {'username': user.username, 'password': password})
+            timings.append(time.perf_counter() - started)
+            client.cookies.clear()
+        timings.sort()
+        self.stdout.write(
+            f"throttle {'on ' if enabled else 'off'}: "
+            f"p50 {statistics.median(timings) * 1000:.2f} ms, "
+            f"p95 {timings[int(len(timings) * 0.95) - 1] * 1000:.2f} ms"
+        )
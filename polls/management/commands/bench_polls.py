@@ -0,0 +1,84 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from polls.benchmarks import scenarios
+
+
+def parse_mix(value):
+    """'index=20,vote=10' -> {'index': 20, 'vote': 10}"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        try:
+            mix[name.strip()] = float(weight or 1)
+        except ValueError:
+            raise CommandError(f"Bad --mix entry {part!r}; expected name=weight.")
+    return mix
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the polls pages (index, detail, vote, results, search, add, "
+        "edit) with the bench data from seed_polls and report p50/p95/p99 "
+        "latency, throughput, queries and bytes per request as JSON. The "
+        "JSON API (api_list, api_get, api_batch) can be added with --mix."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--mix', type=parse_mix, default=None,
+                            help="Request weights, e.g. index=20,vote=10. Default: "
+                                 + ','.join(f'{k}={v}' for k, v in scenarios.DEFAULT_MIX.items()))
+        parser.add_argument('--transport', choices=['client', 'server'], default='client',
+                            help="'client' uses the Django test client in-process; 'server' starts a "
+                                 "local threaded WSGI server and sends real HTTP requests to it.")
+        parser.add_argument('--url', help="Send HTTP requests to this already running server instead.")
+        parser.add_argument('--questions', type=int, default=None,
+                            help="Only use the newest N bench polls (a smaller hot set).")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep-throttles', action='store_true',
+                            help="Leave the request throttles on; by default they'd reject most of the load.")
+        parser.add_argument('--output', help="Write the JSON report here instead of stdout.")
+        parser.add_argument('--compare', help="A previous report to compare this run against.")
+
+    def handle(self, *args, **options):
+        overrides = {'ALLOWED_HOSTS': ['testserver', '127.0.0.1', 'localhost']}
+        if not options['keep_throttles']:
+            overrides['POLLS_THROTTLE_ENABLED'] = False
+
+        with override_settings(**overrides):
+            try:
+                workload = scenarios.Workload(limit=options['questions'])
+            except ValueError as exc:
+                raise CommandError(exc)
+            server, base_url = None, options['url']
+            if options['transport'] == 'server' and not base_url:
+                server, base_url = scenarios.start_server()
+            try:
+                report = scenarios.run(
+                    requests=options['requests'], concurrency=options['concurrency'],
+                    mix=options['mix'], base_url=base_url, random_seed=options['seed'],
+                    workload=workload,
+                )
+            except ValueError as exc:
+                raise CommandError(exc)
+            finally:
+                if server is not None:
+                    server.shutdown()
+                    server.server_close()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            for line in scenarios.compare(baseline, report):
+                self.stderr.write(line)
@@ -0,0 +1,77 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from polls import search
+from polls.models import Question
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'pe', 'ja', 'ho', 'ku']
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed synthetic questions and compare the search index against the "
+        "old LIKE '%%keyword%%' scan. The seeded questions are removed afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=1_000_000)
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--chunk-size', type=int, default=10_000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        vocabulary = sorted({
+            ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+            for _ in range(20_000)
+        })
+
+        self.stdout.write(f"Seeding {options['questions']} questions...")
+        first_id = (Question.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        remaining = options['questions']
+        while remaining:
+            n = min(remaining, options['chunk_size'])
+            with transaction.atomic():
+                Question.objects.bulk_create(
+                    Question(question_text=' '.join(rng.sample(vocabulary, 6)).capitalize() + '?')
+                    for _ in range(n)
+                )
+            remaining -= n
+
+        try:
+            started = time.perf_counter()
+            search.get_index().rebuild(chunk_size=options['chunk_size'])
+            self.stdout.write(f"Index rebuilt in {time.perf_counter() - started:.2f}s")
+
+            keywords = [rng.choice(vocabulary) for _ in range(options['queries'])]
+            like = self.time_queries(keywords, self.like_search)
+            indexed = self.time_queries(keywords, lambda keyword: search.search(keyword).results)
+            for name, timings in (('LIKE scan', like), ('search index', indexed)):
+                self.stdout.write(
+                    f"{name:>12}: median {statistics.median(timings) * 1000:.2f} ms, "
+                    f"max {max(timings) * 1000:.2f} ms"
+                )
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute("DELETE FROM polls_question WHERE id >= %s AND user_id IS NULL", [first_id])
+            search.get_index().rebuild(chunk_size=options['chunk_size'])
+
+    def time_queries(self, keywords, run):
+        timings = []
+        for keyword in keywords:
+            started = time.perf_counter()
+            run(keyword)
+            timings.append(time.perf_counter() - started)
+        return timings
+
+    def like_search(self, keyword):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT * FROM polls_question WHERE question_text LIKE %s",
+                ['%' + keyword + '%'],
+            )
+            return cursor.fetchall()
@@ -0,0 +1,118 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+from django.test.utils import override_settings
+
+from polls import counters
+from polls.benchmarks.scenarios import percentile
+from polls.coalescer import Overloaded, coalescer
+from polls.models import Choice, Question, Vote
+from polls.services import AlreadyVoted, record_vote
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire parallel votes at a single Choice through record_vote() and "
+        "check that the final counter matches the number of Vote rows. "
+        "Use --counter-mode both to compare the single-row and sharded counters, "
+        "and --coalesce both to compare plain votes with polls.coalescer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--votes', type=int, default=2000, help="Number of distinct voters.")
+        parser.add_argument('--workers', type=int, default=32, help="Size of the thread pool.")
+        parser.add_argument('--duplicates', type=int, default=1,
+                            help="How many times each voter tries to vote (extra attempts must be rejected).")
+        parser.add_argument('--counter-mode', choices=['single', 'sharded', 'both'],
+                            default=getattr(settings, 'POLLS_COUNTER_MODE', 'single'))
+        parser.add_argument('--coalesce', choices=['off', 'on', 'both'], default='off',
+                            help="Vote through polls.coalescer (admission control off unless POLLS_VOTE_POLL_RATE "
+                                 "is passed with --rate).")
+        parser.add_argument('--rate', type=float, default=0, help="POLLS_VOTE_POLL_RATE for the coalesced runs.")
+        parser.add_argument('--keep', action='store_true', help="Keep the generated users and poll.")
+
+    def handle(self, *args, **options):
+        modes = ['single', 'sharded'] if options['counter_mode'] == 'both' else [options['counter_mode']]
+        paths = ['off', 'on'] if options['coalesce'] == 'both' else [options['coalesce']]
+        failed = False
+        for mode in modes:
+            for path in paths:
+                with override_settings(POLLS_COUNTER_MODE=mode, POLLS_VOTE_POLL_RATE=options['rate']):
+                    coalescer.reset()
+                    label = f'{mode}, coalesced' if path == 'on' else mode
+                    failed |= not self.run(label, mode, path == 'on', options)
+        if failed:
+            raise CommandError("Vote counts don't match.")
+        self.stdout.write(self.style.SUCCESS("Counts are exact."))
+
+    def run(self, label, mode, coalesce, options):
+        tag = uuid.uuid4().hex[:8]
+        User.objects.bulk_create(
+            User(username=f'bench-{tag}-{i}') for i in range(options['votes'])
+        )
+        # bulk_create doesn't return primary keys on every backend.
+        users = list(User.objects.filter(username__startswith=f'bench-{tag}-'))
+        question = Question.objects.create(question_text=f'Benchmark {tag}')
+        choice = Choice.objects.create(question=question, choice_text='hot', user=users[0])
+
+        attempts = [user for user in users for _ in range(options['duplicates'])]
+        outcome = {'ok': 0, 'duplicate': 0, 'shed': 0, 'error': 0}
+        vote = coalescer.record_vote if coalesce else record_vote
+
+        def cast(user):
+            started = time.perf_counter()
+            try:
+                vote(user, question.id, choice.id)
+                return 'ok', time.perf_counter() - started
+            except AlreadyVoted:
+                return 'duplicate', time.perf_counter() - started
+            except Overloaded:
+                return 'shed', time.perf_counter() - started
+            except Exception:
+                return 'error', time.perf_counter() - started
+            finally:
+                # Each worker thread has its own connection; don't leak them.
+                connections.close_all()
+
+        timings = []
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            for result, took in pool.map(cast, attempts):
+                outcome[result] += 1
+                timings.append(took)
+        elapsed = time.perf_counter() - started
+        timings.sort()
+        close_old_connections()
+
+        if mode == 'sharded':
+            counters.flush()
+        choice.refresh_from_db()
+        vote_rows = Vote.objects.filter(question=question).count()
+
+        self.stdout.write(
+            f"[{label}] {len(attempts)} attempts in {elapsed:.2f}s "
+            f"({len(attempts) / elapsed:.0f} votes/s): "
+            f"{outcome['ok']} recorded, {outcome['duplicate']} duplicates, "
+            f"{outcome['shed']} shed, {outcome['error']} errors"
+        )
+        self.stdout.write(
+            f"[{label}] p50 {percentile(timings, 0.5):.1f} ms, p95 {percentile(timings, 0.95):.1f} ms, "
+            f"p99 {percentile(timings, 0.99):.1f} ms"
+        )
+        if coalesce:
+            stats = coalescer.stats(limit=1)[0]
+            self.stdout.write(
+                f"[{label}] {stats['batches']} batches, mean {stats['mean_batch_size']:.1f} votes, "
+                f"max {stats['max_batch_size']}"
+            )
+        self.stdout.write(f"[{label}] Choice.votes={choice.votes} Vote rows={vote_rows}")
+
+        if not options['keep']:
+            question.delete()
+            User.objects.filter(username__startswith=f'bench-{tag}-').delete()
+        return choice.votes == vote_rows == outcome['ok'] and outcome['ok'] <= len(users)
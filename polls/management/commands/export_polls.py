@@ -0,0 +1,52 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from polls.exports import EXPORTS, FORMATS, encode, export_rows, render_lines
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream questions, choices or votes to a file or stdout as CSV or JSONL. "
+        "The last exported id is printed to stderr to use as the next --since-id."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--output', '-o', help="Output file (default: stdout).")
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--since-id', type=int, help="Only export rows with a larger id.")
+        parser.add_argument('--since', help="Only export rows of questions published after this ISO datetime.")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError("--since must be an ISO 8601 datetime.")
+
+        last_id = options['since_id']
+        count = 0
+
+        def tracked(rows):
+            nonlocal last_id, count
+            for row in rows:
+                last_id, count = row[0], count + 1
+                yield row
+
+        rows = tracked(export_rows(options['kind'], options['since_id'], since, options['chunk_size']))
+        blocks = encode(render_lines(options['kind'], rows, options['format']), compress=options['gzip'])
+
+        out = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for block in blocks:
+                out.write(block)
+        finally:
+            if options['output']:
+                out.close()
+            else:
+                out.flush()
+        self.stderr.write(f"Exported {count} {options['kind']}. Last id: {last_id}")
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from polls import counters
+
+
+class Command(BaseCommand):
+    help = "Fold pending counter shards into Choice.votes (POLLS_COUNTER_MODE = 'sharded')."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Keep running and flush every N seconds. 0 flushes once and exits.")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        while True:
+            moved = counters.flush(batch_size=options['batch_size'])
+            if options['verbosity'] > 1 or not options['interval']:
+                self.stdout.write(f"Flushed {moved} votes.")
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,86 @@
+import csv
+import json
+import sys
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.models import Question
+from polls.services import bulk_create_polls
+
+
+MAX_LENGTH = Question._meta.get_field('question_text').max_length
+
+
+def checked(number, question_text, choices):
+    if not isinstance(question_text, str) or not isinstance(choices, list):
+        raise CommandError(f"Record {number}: question_text must be a string and choices a list.")
+    too_long = [text for text in [question_text, *choices] if len(str(text)) > MAX_LENGTH]
+    if too_long:
+        raise CommandError(f"Record {number}: texts are limited to {MAX_LENGTH} characters.")
+    return question_text, [str(text) for text in choices]
+
+
+def read_jsonl(stream):
+    """{"question_text": "...", "choices": ["...", ...]} per line."""
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            question_text, choices = record['question_text'], record.get('choices', [])
+        except (ValueError, KeyError, TypeError):
+            raise CommandError(f"Record {number}: expected a JSON object with question_text.")
+        yield checked(number, question_text, choices)
+
+
+def read_csv(stream):
+    """question_text followed by any number of choice columns; a header row is optional."""
+    for number, row in enumerate(csv.reader(stream), 1):
+        if not row or (number == 1 and row[0] == 'question_text'):
+            continue
+        yield checked(number, row[0], row[1:])
+
+
+class Command(BaseCommand):
+    help = (
+        "Import polls from a JSONL or CSV file ('-' reads stdin). The file is "
+        "streamed and written in chunked transactions, so memory use doesn't "
+        "grow with the file size. Each chunk commits on its own."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['jsonl', 'csv'],
+                            help="Defaults to the file extension.")
+        parser.add_argument('--user', required=True, help="Username that will own the imported polls.")
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['user']!r}.")
+
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        reader = read_csv if fmt == 'csv' else read_jsonl
+
+        total = 0
+        try:
+            records = reader(stream)
+            while True:
+                chunk = list(islice(records, options['chunk_size']))
+                if not chunk:
+                    break
+                polls = [(text.strip(), choices) for text, choices in chunk if text and text.strip()]
+                if polls:
+                    total += len(bulk_create_polls(user, polls))
+                if options['verbosity'] > 1:
+                    self.stdout.write(f"{total} polls imported...")
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        self.stdout.write(self.style.SUCCESS(f"Imported {total} polls."))
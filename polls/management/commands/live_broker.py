@@ -0,0 +1,63 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+
+class Broker:
+    """
+    Relays newline-delimited messages from publishers to every connection
+    that sent 'SUB'. Stands in for a real message broker so live results
+    work across several worker processes on one machine.
+    """
+
+    def __init__(self):
+        self.subscribers = set()
+
+    async def handle(self, reader, writer):
+        try:
+            first = await reader.readline()
+            if first.strip() == b'SUB':
+                self.subscribers.add(writer)
+                # Wait for the subscriber to go away.
+                await reader.read()
+                return
+            line = first
+            while line:
+                self.relay(line)
+                line = await reader.readline()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.subscribers.discard(writer)
+            writer.close()
+
+    def relay(self, line):
+        for subscriber in list(self.subscribers):
+            if subscriber.is_closing() or subscriber.transport.get_write_buffer_size() > 1024 * 1024:
+                # Gone, or too slow to keep up: drop it; it will reconnect.
+                self.subscribers.discard(subscriber)
+                subscriber.close()
+                continue
+            subscriber.write(line)
+
+
+async def serve(host, port):
+    broker = Broker()
+    server = await asyncio.start_server(broker.handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+class Command(BaseCommand):
+    help = "Run the local message broker that relays live vote updates between worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bind', default='127.0.0.1:8799', help="host:port to listen on.")
+
+    def handle(self, *args, **options):
+        host, port = options['bind'].rsplit(':', 1)
+        self.stdout.write(f"Live results broker listening on {host}:{port}")
+        try:
+            asyncio.run(serve(host, int(port)))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from polls.search import get_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the question search index from polls_question."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        index = get_index()
+        count = index.rebuild(chunk_size=options['chunk_size'])
+        self.stdout.write(f"Indexed {count} questions ({type(index).__name__}).")
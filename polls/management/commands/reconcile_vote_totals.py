@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from polls import counters, jobs
+
+
+class Command(BaseCommand):
+    help = "Check Choice.votes, Question.total_votes and Question.choice_count against the Vote rows and repair drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help="Report drift without repairing it.")
+        parser.add_argument('--enqueue', action='store_true',
+                            help="Queue a 'counters.reconcile' job for the run_jobs workers instead.")
+
+    def handle(self, *args, **options):
+        if options['enqueue']:
+            jobs.enqueue('counters.reconcile', {})
+            jobs.outbox.flush()
+            self.stdout.write("Queued a reconcile job." if jobs.enabled() else "Jobs are off; reconciled in place.")
+            return
+        checked, drifted = counters.reconcile(batch_size=options['batch_size'], repair=not options['dry_run'])
+        action = 'found' if options['dry_run'] else 'repaired'
+        self.stdout.write(f"Checked {checked} questions, {action} drift in {drifted}.")
@@ -0,0 +1,60 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections
+
+from polls import instrumentation, jobs
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves this worker's job metrics (and the queue depth) to a Prometheus scraper."""
+
+    def do_GET(self):
+        try:
+            body = instrumentation.registry.render().encode()
+        finally:
+            connections.close_all()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued background jobs (POLLS_JOBS_ENABLED). Start as many "
+        "workers as needed; each batch is claimed by one of them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Run the jobs that are due and exit.")
+        parser.add_argument('--sleep', type=float, default=1.0,
+                            help="Seconds to wait before looking again when no job is due.")
+        parser.add_argument('--metrics-port', type=int, default=None,
+                            help="Serve job latency, results and queue depth in Prometheus format on this port.")
+
+    def handle(self, *args, **options):
+        if options['metrics_port']:
+            server = ThreadingHTTPServer(('127.0.0.1', options['metrics_port']), MetricsHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        while True:
+            try:
+                count = jobs.work()
+            except DatabaseError as exc:
+                # Database gone or locked for too long: drop the connection and try again later.
+                self.stderr.write(f"Job worker database error: {exc}")
+                connections.close_all()
+                count = 0
+            if options['verbosity'] > 1 or (options['once'] and count):
+                self.stdout.write(f"Ran {count} jobs.")
+            if options['once']:
+                return
+            if not count:
+                time.sleep(options['sleep'])
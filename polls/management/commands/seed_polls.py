@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from polls.benchmarks import seed
+
+
+class Command(BaseCommand):
+    help = "Bulk-insert synthetic bench users, polls and votes for bench_polls, or remove them with --clear."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--questions', type=int, default=1000)
+        parser.add_argument('--choices', type=int, default=4, help="Choices per question.")
+        parser.add_argument('--votes', type=int, default=10_000)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, for repeatable data.")
+        parser.add_argument('--clear', action='store_true', help="Delete all bench data instead.")
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted = seed.clear()
+            self.stdout.write(f"Deleted {deleted} bench rows.")
+            return
+        result = seed.seed(
+            users=options['users'], questions=options['questions'], choices=options['choices'],
+            votes=options['votes'], batch_size=options['batch_size'], random_seed=options['seed'],
+        )
+        self.stdout.write(
+            f"Seeded {result.users} users, {result.questions} questions, "
+            f"{result.choices} choices and {result.votes} votes."
+        )
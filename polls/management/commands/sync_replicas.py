@@ -0,0 +1,42 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from polls.routers import read_replicas
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the 'default' SQLite database over each replica file in "
+        "POLLS_READ_REPLICAS. Stands in for replication when trying the "
+        "replica router locally."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Keep running and copy every N seconds. 0 copies once and exits.")
+
+    def handle(self, *args, **options):
+        source = connections['default']
+        if source.vendor != 'sqlite':
+            raise CommandError("sync_replicas only copies SQLite databases; use real replication elsewhere.")
+        replicas = [alias for alias in read_replicas() if alias != 'readonly']
+        if not replicas:
+            raise CommandError("No replicas configured; set POLLS_DB_REPLICAS.")
+
+        while True:
+            source.ensure_connection()
+            for alias in replicas:
+                connections[alias].close()
+                target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+                try:
+                    source.connection.backup(target)
+                finally:
+                    target.close()
+            if options['verbosity'] > 1 or not options['interval']:
+                self.stdout.write(f"Copied 'default' to {', '.join(replicas)}.")
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,35 @@
+from django.db import migrations, models
+from django.db.models import Count, F
+
+
+def remove_duplicate_votes(apps, schema_editor):
+    """Drop duplicate votes left behind by the old check-then-insert vote path."""
+    Vote = apps.get_model('polls', 'Vote')
+    Choice = apps.get_model('polls', 'Choice')
+    duplicates = (
+        Vote.objects.values('user_id', 'question_id')
+        .annotate(n=Count('id'))
+        .filter(n__gt=1)
+    )
+    for row in duplicates:
+        extra = Vote.objects.filter(
+            user_id=row['user_id'], question_id=row['question_id']
+        ).order_by('id')[1:]
+        for vote in extra:
+            Choice.objects.filter(pk=vote.choice_id, votes__gt=0).update(votes=F('votes') - 1)
+            vote.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0006_loginattempt'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_votes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(fields=('user', 'question'), name='unique_vote_per_user_question'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+
+def create_fts_table(apps, schema_editor):
+    """Create and fill the FTS5 index on SQLite builds that have FTS5."""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if not cursor.fetchone()[0]:
+            return
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS polls_question_fts "
+            "USING fts5(question_text, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        cursor.execute(
+            "INSERT INTO polls_question_fts (rowid, question_text) "
+            "SELECT id, question_text FROM polls_question"
+        )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS polls_question_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0008_choicecountershard'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
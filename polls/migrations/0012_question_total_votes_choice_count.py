@@ -0,0 +1,34 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_totals(apps, schema_editor):
+    Question = apps.get_model('polls', 'Question')
+    Choice = apps.get_model('polls', 'Choice')
+    per_question = Choice.objects.filter(question=OuterRef('pk')).values('question')
+    Question.objects.update(
+        total_votes=Coalesce(Subquery(per_question.annotate(n=Sum('votes')).values('n')), Value(0)),
+        choice_count=Coalesce(Subquery(per_question.annotate(n=Count('id')).values('n')), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0011_loginattempt_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='choice_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='total_votes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
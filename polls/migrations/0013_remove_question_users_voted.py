@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+def restore_users_voted(apps, schema_editor):
+    """Going back: rebuild users_voted from the Vote rows, which have been the record since 0007."""
+    Vote = apps.get_model('polls', 'Vote')
+    Through = apps.get_model('polls', 'Question').users_voted.through
+    rows = Vote.objects.values_list('question_id', 'user_id').iterator(chunk_size=2000)
+    batch = []
+    for question_id, user_id in rows:
+        batch.append(Through(question_id=question_id, user_id=user_id))
+        if len(batch) == 2000:
+            Through.objects.bulk_create(batch)
+            batch = []
+    Through.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+    # Nothing reads or writes users_voted any more; "has this user voted"
+    # is answered by Vote and its unique (user, question) constraint. Its
+    # rows carry no choice, so there is nothing to copy into Vote going forward.
+
+    dependencies = [
+        ('polls', '0012_question_total_votes_choice_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_users_voted),
+        migrations.RemoveField(
+            model_name='question',
+            name='users_voted',
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.0 on 2026-10-18 04:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('polls', '0013_remove_question_users_voted'),
+    ]
+
+    # The new composite index goes in before the single-column foreign key
+    # indexes it (and the unique constraints) make redundant are dropped.
+    operations = [
+        migrations.AddIndex(
+            model_name='choice',
+            index=models.Index(fields=['question', 'id', 'choice_text'], name='choice_question_listing_idx'),
+        ),
+        migrations.AlterField(
+            model_name='choice',
+            name='question',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='polls.question'),
+        ),
+        migrations.AlterField(
+            model_name='choicecountershard',
+            name='choice',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='polls.choice'),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='auth.user'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.0 on 2026-10-18 05:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0016_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedChoice',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('choice_text', models.CharField(max_length=200)),
+                ('votes', models.IntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedVote',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('user_id', models.BigIntegerField()),
+                ('question_id', models.BigIntegerField(db_index=True)),
+                ('choice_id', models.BigIntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='closes_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='voting ends'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(condition=models.Q(('archived_at__isnull', True), ('closes_at__isnull', False)), fields=['closes_at'], name='question_to_archive_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedchoice',
+            name='question',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_choices', to='polls.question'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedchoice',
+            index=models.Index(fields=['question', 'id'], name='archived_choice_question_idx'),
+        ),
+    ]
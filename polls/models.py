@@ -8,10 +8,36 @@ class Question(models.Model):
     question_text = models.CharField(max_length=200)
     pub_date = models.DateTimeField('date published', auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
-    users_voted = models.ManyToManyField(User, related_name='votes', blank=True)
+    # Denormalized from the choices: the sum of Choice.votes and the number
+    # of choices. Kept in step by polls.services and polls.counters;
+    # `manage.py reconcile_vote_totals` checks and repairs them.
+    total_votes = models.IntegerField(default=0)
+    choice_count = models.IntegerField(default=0)
+    # When the question, its choices or its vote totals last changed. Bumped
+    # by every write path, including the UPDATE ... SET statements that
+    # bypass save(); cached fragments are keyed by it (see polls.fragments).
+    updated_at = models.DateTimeField(auto_now=True)
+    # Votes are taken until closes_at (None = no end date). Some time after
+    # that `manage.py archive_polls` freezes the tally into ArchivedChoice,
+    # moves the Vote rows to ArchivedVote, deletes the choices and sets
+    # archived_at (see polls.archive).
+    closes_at = models.DateTimeField('voting ends', null=True, blank=True)
+    archived_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination on the index page walks this index.
+            models.Index(fields=['-pub_date', '-id'], name='question_pub_date_id_idx'),
+            # archive_polls looking for closed polls it hasn't archived yet.
+            models.Index(fields=['closes_at'], name='question_to_archive_idx',
+                         condition=models.Q(archived_at__isnull=True, closes_at__isnull=False)),
+        ]
 
     def __str__(self):
         return self.question_text
+
+    def is_closed(self):
+        return self.closes_at is not None and self.closes_at <= timezone.now()
     
     def was_published_recently(self):
         now = timezone.now()
@@ -23,21 +49,77 @@ class Question(models.Model):
 
 
 class Choice(models.Model):
-    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    # Indexed by choice_question_listing_idx below.
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, db_index=False)
     choice_text = models.CharField(max_length=200)
     votes = models.IntegerField(default=0)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    
+
+    class Meta:
+        indexes = [
+            # Covers listing a question's choices in id order (detail and
+            # edit pages) without touching the table. votes is left out so
+            # a vote doesn't have to rewrite the index entry.
+            models.Index(fields=['question', 'id', 'choice_text'], name='choice_question_listing_idx'),
+        ]
 
     def __str__(self):
         return self.choice_text
 
 
+class ChoiceCounterShard(models.Model):
+    """Pending vote increments for a choice, used when POLLS_COUNTER_MODE = 'sharded'."""
+    # Indexed by unique_counter_shard, which leads with choice.
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE, related_name='shards', db_index=False)
+    shard = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['choice', 'shard'], name='unique_counter_shard'),
+        ]
+
+
 class Vote(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Indexed by unique_vote_per_user_question, which leads with user.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            # One vote per user and question, enforced by the database.
+            models.UniqueConstraint(fields=['user', 'question'], name='unique_vote_per_user_question'),
+        ]
+
+
+class ArchivedChoice(models.Model):
+    """The frozen tally of a choice of an archived question, which replaces the Choice row."""
+    id = models.BigIntegerField(primary_key=True)  # the id the Choice had
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='archived_choices', db_index=False)
+    choice_text = models.CharField(max_length=200)
+    votes = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['question', 'id'], name='archived_choice_question_idx'),
+        ]
+
+    def __str__(self):
+        return self.choice_text
+
+
+class ArchivedVote(models.Model):
+    """
+    A Vote row moved out of polls_vote by archive_polls. The ids are plain
+    columns rather than foreign keys, so the table can live in its own
+    database (POLLS_ARCHIVE_DATABASE).
+    """
+    id = models.BigIntegerField(primary_key=True)  # the id the Vote had
+    user_id = models.BigIntegerField()
+    question_id = models.BigIntegerField(db_index=True)
+    choice_id = models.BigIntegerField()
+
 
 #QuestionUpdateView, -DeleteView
 class QuestionUpdateView(generic.UpdateView):
@@ -61,13 +143,39 @@ class QuestionDeleteView(generic.DeleteView):
         return qs.filter(created_by=self.request.user)
 
 # Fix 5_1
-"""
 class LoginAttempt(models.Model):
-    # LoginAttempt model for keeping logging attempt records in the database. 
+    # LoginAttempt model for keeping logging attempt records in the database.
+    # Rows are written in batches by polls.audit, so the timestamp is set when
+    # the attempt happens rather than when the row is inserted.
     username = models.CharField(max_length=255)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
     success = models.BooleanField(default=False)
 
     def __str__(self):
         return f"Attempt by {self.username} at {self.timestamp}"
-"""
\ No newline at end of file
+
+
+class Job(models.Model):
+    """
+    Background work queued by polls.jobs. A job is due once run_at has
+    passed; a worker claims it by pushing run_at past its lease and deletes
+    it when it's done. Jobs that keep failing are kept with failed_at set.
+    """
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(default=timezone.now)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    claimed_by = models.CharField(max_length=32, blank=True, default='')
+    failed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            # Finding the oldest due job, then a batch of due jobs of its kind.
+            models.Index(fields=['run_at'], name='job_due_idx', condition=models.Q(failed_at__isnull=True)),
+            models.Index(fields=['kind', 'run_at'], name='job_kind_due_idx', condition=models.Q(failed_at__isnull=True)),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} job {self.pk}"
@@ -0,0 +1,72 @@
+"""
+Keyset (cursor) pagination over (pub_date, id).
+
+Pages are fetched with WHERE (pub_date, id) < (last pub_date, last id)
+instead of OFFSET, written as pub_date <= x AND (pub_date < x OR id < y)
+so the database can range-scan the (pub_date, id) index. A page deep
+into the list then costs the same as the first one. Cursors are opaque
+url-safe tokens.
+"""
+import base64
+import json
+from collections import namedtuple
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+KeysetPage = namedtuple('KeysetPage', 'object_list next_cursor prev_cursor')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(obj, direction):
+    payload = json.dumps([direction, obj.pub_date.isoformat(), obj.pk], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        payload = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, pub_date, pk = json.loads(payload)
+        pub_date = parse_datetime(pub_date)
+    except (ValueError, TypeError):
+        raise InvalidCursor(token)
+    if direction not in ('next', 'prev') or pub_date is None or not isinstance(pk, int):
+        raise InvalidCursor(token)
+    return direction, pub_date, pk
+
+
+def keyset_page(queryset, cursor=None, page_size=10):
+    """
+    One page of `queryset`, newest first. `cursor` is a token from a
+    previous page's next_cursor/prev_cursor, or None for the first page.
+    """
+    if cursor is None:
+        direction = 'next'
+        rows = list(queryset.order_by('-pub_date', '-pk')[:page_size + 1])
+    else:
+        direction, pub_date, pk = decode_cursor(cursor)
+        if direction == 'next':
+            rows = list(queryset.filter(pub_date__lte=pub_date).filter(
+                Q(pub_date__lt=pub_date) | Q(pk__lt=pk)
+            ).order_by('-pub_date', '-pk')[:page_size + 1])
+        else:
+            rows = list(queryset.filter(pub_date__gte=pub_date).filter(
+                Q(pub_date__gt=pub_date) | Q(pk__gt=pk)
+            ).order_by('pub_date', 'pk')[:page_size + 1])
+
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    if direction == 'prev':
+        rows.reverse()
+        has_next, has_prev = True, more
+    else:
+        has_next, has_prev = more, cursor is not None
+
+    return KeysetPage(
+        rows,
+        encode_cursor(rows[-1], 'next') if rows and has_next else None,
+        encode_cursor(rows[0], 'prev') if rows and has_prev else None,
+    )
@@ -0,0 +1,120 @@
+"""
+Cache of the per-question vote tallies shown on the results page.
+
+Entries live in the cache alias named by POLLS_RESULTS_CACHE, so the
+storage is whatever that CACHES entry uses: the size-bounded local-memory
+LRU by default, or Django's file-based or Redis backends. Writers call
+invalidate() (vote, edit_question, delete_question), so entries don't need
+a timeout in the default counter mode.
+
+Each entry is stored with the Question.updated_at of the row it was read
+for, which every write bumps, and it's only served for that version or
+older. A reader that computed its tally before a vote committed may still
+store it after the vote's invalidate(), but under the old version, so the
+next reader of the new version recomputes it instead of keeping the stale
+tally until the next vote. Tallies are always read from the primary, even
+inside @read_only views, and after the version, so an entry is never older
+than the version it's stored under.
+
+With background jobs on and a cache shared between processes, a vote also
+queues a 'results.warm' job, so the next results page finds the new tally
+already cached.
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+from . import counters, instrumentation, jobs
+from .models import Question
+from .routers import reading_from
+
+
+class ResultsCache:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'POLLS_RESULTS_CACHE', 'default')]
+
+    @staticmethod
+    def key(question_id):
+        return f'polls:results:{question_id}'
+
+    @staticmethod
+    def timeout():
+        # In sharded mode votes don't invalidate; the timeout bounds staleness instead.
+        staleness = getattr(settings, 'POLLS_RESULTS_MAX_STALENESS', 0)
+        if counters.counter_mode() == 'sharded' and staleness:
+            return staleness
+        return getattr(settings, 'POLLS_RESULTS_CACHE_TIMEOUT', None)
+
+    @staticmethod
+    def version(updated_at):
+        return updated_at.timestamp()
+
+    def get_tally(self, question):
+        """The tally of `question`, a Question with its updated_at loaded."""
+        version = self.version(question.updated_at)
+        entry = self.cache.get(self.key(question.pk))
+        # A newer entry is served as it is: it's at least as fresh as this version.
+        tally = entry[1] if entry is not None and entry[0] >= version else None
+        with self._lock:
+            if tally is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        instrumentation.cache_access('results', tally is not None)
+        if tally is None:
+            with reading_from(None):
+                tally = counters.tally(question.pk)
+            self.cache.set(self.key(question.pk), (version, tally), self.timeout())
+        return tally
+
+    def invalidate(self, question_id):
+        self.cache.delete(self.key(question_id))
+
+    def warm(self, question_ids):
+        """Cache fresh tallies for `question_ids`, read with two queries."""
+        with reading_from(None):
+            versions = dict(Question.objects.filter(pk__in=question_ids).values_list('pk', 'updated_at'))
+            tallies = counters.tallies(list(versions))
+        self.cache.set_many({
+            self.key(question_id): (
+                self.version(versions[question_id]),
+                [{'id': pk, 'choice_text': text, 'votes': votes} for pk, text, votes in tally],
+            )
+            for question_id, tally in tallies.items()
+        }, self.timeout())
+
+    def vote_recorded(self, question_id):
+        if counters.counter_mode() == 'sharded' and getattr(settings, 'POLLS_RESULTS_MAX_STALENESS', 0):
+            return
+        self.invalidate(question_id)
+        # A worker warming its own local-memory cache wouldn't help the web processes.
+        if jobs.enabled() and not isinstance(self.cache, LocMemCache):
+            jobs.enqueue('results.warm', {'question_id': int(question_id)})
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        stats = {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / (hits + misses) if hits + misses else 0.0,
+        }
+        if hasattr(self.cache, 'size_bytes'):
+            stats['size_bytes'] = self.cache.size_bytes
+        return stats
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+
+results_cache = ResultsCache()
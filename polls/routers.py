@@ -0,0 +1,131 @@
+"""
+Database routing for the polls read paths.
+
+Views wrapped in @read_only send their reads to one of the read replicas
+in POLLS_READ_REPLICAS (the 'readonly' SQLite connection under the
+sqlite-production profile), picked at random per request. Routing is
+scoped to the request with a context variable, so sessions, auth and
+writes keep using 'default'.
+
+A client that has just written (any unsafe request) gets a short-lived
+cookie from PinPrimaryMiddleware and reads from 'default' until it
+expires, so the results page after a vote never lags behind the vote.
+"""
+import asyncio
+import contextvars
+import random
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from django.utils.deprecation import MiddlewareMixin
+
+PIN_COOKIE = 'polls_primary'
+
+_read_alias = contextvars.ContextVar('polls_read_alias', default=None)
+
+
+@contextmanager
+def reading_from(alias):
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def read_replicas():
+    """
+    The configured replicas that are really separate databases. Under the
+    test runner they mirror 'default' exactly, and reading through a
+    second connection would only see locked tables.
+    """
+    default_name = connections['default'].settings_dict['NAME']
+    return [
+        alias for alias in getattr(settings, 'POLLS_READ_REPLICAS', [])
+        if alias in connections.settings and connections[alias].settings_dict['NAME'] != default_name
+    ]
+
+
+def read_only_alias():
+    """A replica to read from, or None to stay on 'default'."""
+    replicas = read_replicas()
+    return random.choice(replicas) if replicas else None
+
+
+def read_alias_for(request):
+    if PIN_COOKIE in request.COOKIES:
+        return None
+    return read_only_alias()
+
+
+def read_only(view):
+    """Run `view` (sync or async) with its reads on a replica, unless the client is pinned to the primary."""
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapped(request, *args, **kwargs):
+            alias = read_alias_for(request)
+            if alias is None:
+                return await view(request, *args, **kwargs)
+            with reading_from(alias):
+                return await view(request, *args, **kwargs)
+        return wrapped
+
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        alias = read_alias_for(request)
+        if alias is None:
+            return view(request, *args, **kwargs)
+        with reading_from(alias):
+            response = view(request, *args, **kwargs)
+            # Render lazy TemplateResponses while the routing still applies.
+            if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+                response.render()
+            return response
+    return wrapped
+
+
+def _archive_alias(model):
+    # Archived votes live in POLLS_ARCHIVE_DATABASE, see polls.archive.
+    if model._meta.label_lower == 'polls.archivedvote':
+        return getattr(settings, 'POLLS_ARCHIVE_DATABASE', 'default')
+    return None
+
+
+class ReadOnlyRouter:
+
+    def db_for_read(self, model, **hints):
+        return _archive_alias(model) or _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return _archive_alias(model)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary.
+        if db == 'readonly' or db in getattr(settings, 'POLLS_READ_REPLICAS', []):
+            return False
+        archive = getattr(settings, 'POLLS_ARCHIVE_DATABASE', 'default')
+        if archive != 'default' and (db == archive or model_name == 'archivedvote'):
+            return db == archive and app_label == 'polls' and model_name == 'archivedvote'
+        return True
+
+
+class PinPrimaryMiddleware(MiddlewareMixin):
+    """
+    After a POST (or any other unsafe request) keep the client on the
+    primary for POLLS_REPLICA_PIN_SECONDS, long enough for the replicas
+    to catch up with what it just wrote.
+    """
+
+    def process_response(self, request, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE') and read_replicas():
+            response.set_cookie(
+                PIN_COOKIE, '1',
+                max_age=getattr(settings, 'POLLS_REPLICA_PIN_SECONDS', 5),
+                httponly=True, samesite='Lax',
+            )
+        return response
@@ -0,0 +1,239 @@
+"""
+Full-text search over Question.question_text.
+
+On SQLite the index is an FTS5 virtual table (polls_question_fts, created
+by migration 0009) ranked with bm25. Other database backends, or SQLite
+builds without FTS5, fall back to an in-process inverted index that is
+built on first use. Either way the index is kept in sync by the Question
+save/delete signals in polls.signals and can be rebuilt with the
+rebuild_search_index command. With background jobs on, FTS5 updates are
+queued as 'search.index' jobs; the inverted index lives in each process's
+memory, so its updates stay in the request.
+
+Every search term is matched as a prefix and all terms must match.
+Searches read through the routed connection, so inside @read_only views
+they go to a replica; index writes always go to 'default'.
+"""
+import bisect
+import re
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import DatabaseError, connection, connections, router
+
+from . import jobs
+from .models import Question
+
+FTS_TABLE = 'polls_question_fts'
+
+SearchPage = namedtuple('SearchPage', 'results page has_next')
+
+_word_re = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return [word.lower() for word in _word_re.findall(text or '')]
+
+
+# Database name -> whether the FTS5 table exists, so we only look once.
+_fts5_tables = {}
+
+
+def _read_connection():
+    return connections[router.db_for_read(Question)]
+
+
+def fts5_available():
+    connection = _read_connection()
+    if connection.vendor != 'sqlite':
+        return False
+    name = str(connection.settings_dict['NAME'])
+    if name not in _fts5_tables:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            _fts5_tables[name] = cursor.fetchone() is not None
+    return _fts5_tables[name]
+
+
+class FTS5Index:
+    """Questions indexed in an SQLite FTS5 table, rowid = question id."""
+
+    def match_expression(self, query):
+        # Quote every term so FTS5 operators in user input are taken literally.
+        return ' '.join('"%s"*' % term for term in tokenize(query))
+
+    def search(self, query, offset, count):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        with _read_connection().cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, question_text FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                "ORDER BY rank, rowid DESC LIMIT %s OFFSET %s",
+                [expression, count, offset],
+            )
+            return [{'id': pk, 'question_text': text} for pk, text in cursor.fetchall()]
+
+    def update(self, question_id, text):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [question_id])
+            cursor.execute(f"INSERT INTO {FTS_TABLE} (rowid, question_text) VALUES (%s, %s)", [question_id, text])
+
+    def remove(self, question_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [question_id])
+
+    def rebuild(self, chunk_size=None):
+        # The copy happens inside SQLite, so there's nothing to chunk.
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            cursor.execute(f"INSERT INTO {FTS_TABLE} (rowid, question_text) SELECT id, question_text FROM polls_question")
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+            cursor.execute(f"SELECT count(*) FROM {FTS_TABLE}")
+            return cursor.fetchone()[0]
+
+
+class InvertedIndex:
+    """
+    In-process fallback: token -> question ids, with a sorted token list
+    for prefix lookups. Results are ranked by how much of the question the
+    query covers, newest first on ties.
+
+    The index only sees saves and deletes made in its own process, so with
+    several workers it should be rebuilt periodically.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._postings = {}
+        self._tokens = []
+        self._docs = {}
+
+    def _ensure_built(self):
+        if not self._built:
+            self.rebuild()
+
+    def _add(self, question_id, text):
+        tokens = set(tokenize(text))
+        self._docs[question_id] = (text, len(tokens))
+        for token in tokens:
+            ids = self._postings.get(token)
+            if ids is None:
+                ids = self._postings[token] = set()
+                bisect.insort(self._tokens, token)
+            ids.add(question_id)
+
+    def _discard(self, question_id):
+        doc = self._docs.pop(question_id, None)
+        if doc is None:
+            return
+        for token in set(tokenize(doc[0])):
+            ids = self._postings.get(token)
+            if ids is not None:
+                ids.discard(question_id)
+                if not ids:
+                    del self._postings[token]
+                    del self._tokens[bisect.bisect_left(self._tokens, token)]
+
+    def _prefix_ids(self, prefix):
+        ids = set()
+        i = bisect.bisect_left(self._tokens, prefix)
+        while i < len(self._tokens) and self._tokens[i].startswith(prefix):
+            ids |= self._postings[self._tokens[i]]
+            i += 1
+        return ids
+
+    def search(self, query, offset, count):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        with self._lock:
+            self._ensure_built()
+            matches = None
+            for term in terms:
+                ids = self._prefix_ids(term)
+                matches = ids if matches is None else matches & ids
+                if not matches:
+                    return []
+            ranked = sorted(matches, key=lambda pk: (self._docs[pk][1], -pk))
+            return [
+                {'id': pk, 'question_text': self._docs[pk][0]}
+                for pk in ranked[offset:offset + count]
+            ]
+
+    def update(self, question_id, text):
+        with self._lock:
+            if self._built:
+                self._discard(question_id)
+                self._add(question_id, text)
+
+    def remove(self, question_id):
+        with self._lock:
+            if self._built:
+                self._discard(question_id)
+
+    def rebuild(self, chunk_size=5000):
+        with self._lock:
+            self._postings, self._tokens, self._docs = {}, [], {}
+            rows = Question.objects.values_list('id', 'question_text').iterator(chunk_size=chunk_size)
+            for question_id, text in rows:
+                self._add(question_id, text)
+            self._built = True
+            return len(self._docs)
+
+
+_fts5_index = FTS5Index()
+_inverted_index = InvertedIndex()
+
+
+def get_index():
+    backend = getattr(settings, 'POLLS_SEARCH_BACKEND', 'auto')
+    if backend == 'fts5' or (backend == 'auto' and fts5_available()):
+        return _fts5_index
+    return _inverted_index
+
+
+def search(query, page=1, per_page=None):
+    """
+    One page of ranked results for `query`, never going past
+    POLLS_SEARCH_LIMIT results in total.
+    """
+    per_page = per_page or getattr(settings, 'POLLS_SEARCH_PAGE_SIZE', 20)
+    limit = getattr(settings, 'POLLS_SEARCH_LIMIT', 200)
+    page = max(page, 1)
+    offset = (page - 1) * per_page
+    count = min(per_page + 1, limit - offset)
+    if count <= 0:
+        return SearchPage([], page, False)
+    results = get_index().search(query, offset, count)
+    has_next = len(results) > per_page and offset + per_page < limit
+    return SearchPage(results[:per_page], page, has_next)
+
+
+def index_question(question_id, text):
+    try:
+        get_index().update(question_id, text)
+    except DatabaseError:
+        # Don't let a missing or broken index block writes to questions;
+        # rebuild_search_index puts it right.
+        pass
+
+
+def unindex_question(question_id):
+    try:
+        get_index().remove(question_id)
+    except DatabaseError:
+        pass
+
+
+def queue_update(question_id, text):
+    """Index `text` for the question, or remove it if `text` is None."""
+    # A worker updating its own in-memory index wouldn't help the web processes.
+    if jobs.enabled() and isinstance(get_index(), FTS5Index):
+        jobs.enqueue('search.index', {'id': question_id, 'text': text})
+    elif text is None:
+        unindex_question(question_id)
+    else:
+        index_question(question_id, text)
@@ -0,0 +1,247 @@
+from collections import Counter
+from functools import partial
+from itertools import zip_longest
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import counters, live, search, voted
+from .models import Choice, Question, Vote
+from .results_cache import results_cache
+
+
+class AlreadyVoted(Exception):
+    """The user already has a Vote row for this question."""
+
+
+class InvalidChoice(Exception):
+    """The choice does not exist or belongs to another question."""
+
+
+class PollClosed(Exception):
+    """The question's closes_at has passed."""
+
+
+# update_poll() leaves closes_at alone unless given something else.
+UNCHANGED = object()
+
+
+def _closed(question_id):
+    return Question.objects.filter(pk=question_id, closes_at__lte=timezone.now()).exists()
+
+
+def _rejection(question_id, choice_id):
+    """Why a vote for `choice_id` didn't count: the poll closed, or the choice isn't one of its own."""
+    if _closed(question_id):
+        return PollClosed(question_id)
+    return InvalidChoice(choice_id)
+
+
+def record_vote(user, question_id, choice_id):
+    """
+    Record a vote for `choice_id` in a single transaction.
+
+    The counter is bumped with an UPDATE ... SET votes = votes + 1 (on
+    Choice, or on a counter shard in sharded mode) so concurrent voters
+    can't lose increments, and duplicate votes are caught by the unique
+    (user, question) constraint on Vote instead of a separate lookup.
+    Question.total_votes moves with the counter (see polls.counters).
+
+    The UPDATE runs first so that on SQLite the transaction takes the
+    write lock straight away and waits on the busy timeout instead of
+    failing on a lock upgrade.
+    """
+    try:
+        with transaction.atomic():
+            if not counters.increment(question_id, choice_id):
+                raise _rejection(question_id, choice_id)
+            Vote.objects.create(user=user, question_id=question_id, choice_id=choice_id)
+            transaction.on_commit(lambda: results_cache.vote_recorded(question_id))
+            transaction.on_commit(lambda: live.publish(int(question_id), {int(choice_id): 1}))
+            transaction.on_commit(lambda: voted.vote_recorded(user.pk, question_id))
+    except IntegrityError:
+        # The unique constraint rolled the whole transaction back,
+        # including the counter update. The vote may have come through
+        # another process, so tell this one's voted-set cache.
+        voted.vote_recorded(user.pk, question_id)
+        raise AlreadyVoted(question_id)
+
+
+def record_votes(question_id, votes):
+    """
+    Record many votes on one question together. `votes` is a list of
+    (user, choice_id) pairs; returns a list in the same order holding None
+    for each vote recorded and an AlreadyVoted, InvalidChoice or
+    PollClosed instance for each one turned away.
+
+    The choices and the users who already voted are read first, then one
+    transaction makes an UPDATE per choice voted for, one for the
+    question and a single multi-row INSERT of the Vote rows. If that
+    INSERT still hits the unique constraint (the vote came in through
+    another process meanwhile) it's all rolled back and the votes are
+    retried one at a time with record_vote(). Like record_vote(), the
+    counter UPDATEs only match while the poll is open, so a poll that
+    closes after the reads rolls the batch back too.
+    """
+    # The end date rides along with the choices, so a closed poll is turned away with this one read.
+    choices = dict(
+        Choice.objects.filter(question_id=question_id, pk__in={choice_id for _, choice_id in votes})
+        .values_list('pk', 'question__closes_at')
+    )
+    closes_at = next(iter(choices.values()), None)
+    if closes_at is not None and closes_at <= timezone.now():
+        return [PollClosed(question_id) for _ in votes]
+    valid = set(choices)
+    if not valid:
+        # Like _rejection(): a closed poll comes before a bad choice, checked once for the batch.
+        closed = _closed(question_id)
+        return [PollClosed(question_id) if closed else InvalidChoice(choice_id) for _, choice_id in votes]
+    seen = set(
+        Vote.objects.filter(question_id=question_id, user_id__in={user.pk for user, _ in votes})
+        .values_list('user_id', flat=True)
+    )
+    results, accepted = [], []
+    for user, choice_id in votes:
+        if choice_id not in valid:
+            results.append(InvalidChoice(choice_id))
+        elif user.pk in seen:
+            results.append(AlreadyVoted(question_id))
+        else:
+            seen.add(user.pk)
+            accepted.append((user, choice_id))
+            results.append(None)
+    if not accepted:
+        return results
+
+    counts = Counter(choice_id for _, choice_id in accepted)
+    try:
+        with transaction.atomic():
+            written = counters.increment_many(question_id, counts)
+            if written:
+                Vote.objects.bulk_create(
+                    Vote(user=user, question_id=question_id, choice_id=choice_id) for user, choice_id in accepted
+                )
+                transaction.on_commit(lambda: results_cache.vote_recorded(question_id))
+                transaction.on_commit(lambda: live.publish(int(question_id), dict(counts)))
+                for user, _ in accepted:
+                    transaction.on_commit(partial(voted.vote_recorded, user.pk, question_id))
+            else:
+                transaction.set_rollback(True)
+    except IntegrityError:
+        return [_record_one(user, question_id, choice_id) for user, choice_id in votes]
+    if not written:
+        # The poll closed (or a choice was deleted) since the choices were read.
+        if _closed(question_id):
+            return [PollClosed(question_id) for _ in votes]
+        return [_record_one(user, question_id, choice_id) for user, choice_id in votes]
+    return results
+
+
+def _record_one(user, question_id, choice_id):
+    try:
+        record_vote(user, question_id, choice_id)
+    except (AlreadyVoted, InvalidChoice, PollClosed) as exc:
+        return exc
+    return None
+
+
+def create_poll(user, question_text, choice_texts, closes_at=None):
+    """Create a question and its non-blank choices with two INSERTs."""
+    texts = _clean(choice_texts)
+    with transaction.atomic():
+        question = Question.objects.create(
+            question_text=question_text, user=user, choice_count=len(texts), closes_at=closes_at,
+        )
+        Choice.objects.bulk_create(Choice(question=question, choice_text=text, user=user) for text in texts)
+    return question
+
+
+def update_poll(question, choice_texts, question_text=None, closes_at=UNCHANGED):
+    """
+    Apply an edit to `question`, touching only the rows that changed.
+
+    `question_text` is the new text, or None if it wasn't edited;
+    `closes_at` the new end date (None for none) if it was.
+    `choice_texts` lines up with the existing choices in id order, like the
+    edit form: a changed text renames that choice (keeping its votes), a
+    blank one deletes it, and texts past the existing choices are added.
+    Returns (created, updated, deleted) counts.
+    """
+    texts = [(text or '').strip() for text in choice_texts]
+    with transaction.atomic():
+        edited = []
+        if question_text is not None:
+            question.question_text = question_text
+            edited.append('question_text')
+        if closes_at is not UNCHANGED:
+            question.closes_at = closes_at
+            edited.append('closes_at')
+        if edited:
+            question.save(update_fields=edited + ['updated_at'])
+
+        existing = list(question.choice_set.order_by('id'))
+        changed, removed = [], []
+        for choice, text in zip_longest(existing, texts[:len(existing)], fillvalue=''):
+            if not text:
+                removed.append(choice.id)
+            elif text != choice.choice_text:
+                choice.choice_text = text
+                changed.append(choice)
+        added = [
+            Choice(question=question, choice_text=text, user=question.user)
+            for text in _clean(texts[len(existing):])
+        ]
+
+        if changed:
+            Choice.objects.bulk_update(changed, ['choice_text'])
+        if removed:
+            Choice.objects.filter(pk__in=removed).delete()
+        if added:
+            Choice.objects.bulk_create(added)
+        if removed or added:
+            # Deleting a choice takes its (flushed) votes out of the total.
+            removed_votes = sum(choice.votes for choice in existing if choice.id in removed)
+            Question.objects.filter(pk=question.pk).update(
+                total_votes=F('total_votes') - removed_votes,
+                choice_count=F('choice_count') + len(added) - len(removed),
+                updated_at=timezone.now(),
+            )
+        elif changed:
+            Question.objects.filter(pk=question.pk).update(updated_at=timezone.now())
+        transaction.on_commit(lambda: results_cache.invalidate(question.id))
+        if removed:
+            # The deleted choices took their votes with them, so those voters may vote again.
+            transaction.on_commit(lambda: voted.voted_cache.forget_question(question.id))
+    return len(added), len(changed), len(removed)
+
+
+def bulk_create_polls(user, polls):
+    """
+    Create many polls in one transaction: one INSERT for the questions and
+    one for all their choices. `polls` is a list of (question_text,
+    choice_texts) pairs. Returns the created questions.
+
+    bulk_create() skips the post_save signal, so the search index is
+    updated here.
+    """
+    with transaction.atomic():
+        polls = [(text, _clean(choice_texts)) for text, choice_texts in polls]
+        questions = [Question(question_text=text, user=user, choice_count=len(texts)) for text, texts in polls]
+        if connection.features.can_return_rows_from_bulk_insert:
+            Question.objects.bulk_create(questions)
+        else:
+            for question in questions:
+                question.save()
+        Choice.objects.bulk_create(
+            Choice(question=question, choice_text=text, user=user)
+            for question, (_, choice_texts) in zip(questions, polls)
+            for text in choice_texts
+        )
+        for question in questions:
+            search.queue_update(question.id, question.question_text)
+    return questions
+
+
+def _clean(texts):
+    return [text.strip() for text in texts if text and text.strip()]
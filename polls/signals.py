@@ -0,0 +1,30 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import search
+from .auth_backends import user_cache
+from .models import ArchivedVote, Question
+from .voted import voted_cache
+
+
+@receiver(post_save, sender=Question)
+def question_saved(sender, instance, **kwargs):
+    search.queue_update(instance.id, instance.question_text)
+
+
+@receiver(post_delete, sender=Question)
+def question_deleted(sender, instance, **kwargs):
+    search.queue_update(instance.id, None)
+    voted_cache.forget_question(instance.id)
+    if instance.archived_at:
+        # Not a foreign key, so not deleted by the cascade.
+        ArchivedVote.objects.filter(question_id=instance.id).delete()
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def user_changed(sender, instance, **kwargs):
+    # Deactivations and password changes take effect at once in this process.
+    user_cache.discard(instance.pk)
+    voted_cache.discard(instance.pk)
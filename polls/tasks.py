@@ -0,0 +1,45 @@
+"""
+Handlers for the background jobs in polls.jobs. Each takes the payloads of
+a batch of jobs of its kind and handles them together.
+"""
+from django.utils.dateparse import parse_datetime
+
+from . import counters
+from .jobs import handler
+from .models import LoginAttempt
+from .results_cache import results_cache
+from .search import index_question, unindex_question
+
+
+@handler('audit.login', batch_size=500)
+def write_login_attempts(payloads):
+    LoginAttempt.objects.bulk_create(
+        LoginAttempt(username=p['username'], success=p['success'], timestamp=parse_datetime(p['timestamp']))
+        for p in payloads
+    )
+
+
+@handler('search.index', batch_size=500)
+def update_search_index(payloads):
+    # Payloads are in enqueue order, so the last one for a question wins;
+    # text None means the question was deleted.
+    latest = {p['id']: p['text'] for p in payloads}
+    for question_id, text in latest.items():
+        if text is None:
+            unindex_question(question_id)
+        else:
+            index_question(question_id, text)
+
+
+@handler('results.warm', batch_size=200)
+def warm_results(payloads):
+    results_cache.warm({p['question_id'] for p in payloads})
+
+
+@handler('counters.reconcile', batch_size=50)
+def reconcile_counters(payloads):
+    # A payload without question_ids asks for every question.
+    if any('question_ids' not in p for p in payloads):
+        counters.reconcile()
+    else:
+        counters.reconcile(question_ids={pk for p in payloads for pk in p['question_ids']})
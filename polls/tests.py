@@ -1,3 +1,1509 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import pstats
+import tempfile
+import threading
+import time
+from array import array
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import IntegrityError, connection, router
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.http import Http404
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+
+from . import archive, async_views, counters, instrumentation, jobs, live, search
+from .cache_backends import SizedLocMemCache
+from .coalescer import Overloaded, coalescer
+from .audit import login_audit
+from .auth_backends import user_cache
+from .benchmarks import scenarios, seed
+from .management.commands.live_broker import Broker
+from .models import ArchivedChoice, ArchivedVote, Choice, ChoiceCounterShard, Job, LoginAttempt, Question, Vote
+from .pagination import keyset_page
+from .results_cache import results_cache
+from .throttle import Throttle
+from .routers import PIN_COOKIE, ReadOnlyRouter, read_alias_for, reading_from
+from .services import (
+    AlreadyVoted, InvalidChoice, PollClosed, bulk_create_polls, create_poll, record_vote, record_votes, update_poll,
+)
+from .voted import voted_cache
+
+
+# Query counts below assume database sessions, no user or voted-set cache
+# and inline jobs, whatever POLLS_SESSION_PROFILE and POLLS_JOBS are.
+@override_settings(
+    SESSION_ENGINE='django.contrib.sessions.backends.db', POLLS_USER_CACHE_SECONDS=0, POLLS_JOBS_ENABLED=False,
+    POLLS_VOTED_CACHE_SECONDS=0,
+)
+class PollsTestCase(TestCase):
+    """Shared fixture: one logged-in user and a question with two choices."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='pw-alice-123')
+        cls.other = User.objects.create_user('bob', password='pw-bob-123')
+        cls.question = Question.objects.create(question_text='Tea or coffee?', user=cls.user, choice_count=2)
+        cls.tea = Choice.objects.create(question=cls.question, choice_text='Tea', user=cls.user)
+        cls.coffee = Choice.objects.create(question=cls.question, choice_text='Coffee', user=cls.user)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        results_cache.cache.clear()
+        results_cache.reset_stats()
+        caches['throttle'].clear()
+        caches['template_fragments'].clear()
+        user_cache.clear()
+        voted_cache.clear()
+        coalescer.reset()
+
+
+class RecordVoteTests(PollsTestCase):
+
+    def test_vote_bumps_counter_and_records_row(self):
+        record_vote(self.user, self.question.id, self.tea.id)
+        self.tea.refresh_from_db()
+        self.assertEqual(self.tea.votes, 1)
+        self.assertTrue(Vote.objects.filter(user=self.user, question=self.question).exists())
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.total_votes, 1)
+
+    def test_second_vote_is_rejected_and_rolled_back(self):
+        record_vote(self.user, self.question.id, self.tea.id)
+        with self.assertRaises(AlreadyVoted):
+            record_vote(self.user, self.question.id, self.coffee.id)
+        self.coffee.refresh_from_db()
+        self.question.refresh_from_db()
+        self.assertEqual((self.coffee.votes, self.question.total_votes), (0, 1))
+        self.assertEqual(Vote.objects.count(), 1)
+
+    def test_choice_from_another_question_is_invalid(self):
+        other = Question.objects.create(question_text='Other?', user=self.user)
+        with self.assertRaises(InvalidChoice):
+            record_vote(self.user, other.id, self.tea.id)
+        self.assertFalse(Vote.objects.exists())
+
+    def test_vote_view(self):
+        response = self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.tea.id})
+        self.assertRedirects(response, reverse('polls:results', args=(self.question.id,)))
+        response = self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.coffee.id})
+        self.assertRedirects(response, reverse('polls:results', args=(self.question.id,)))
+        self.tea.refresh_from_db()
+        self.coffee.refresh_from_db()
+        self.assertEqual((self.tea.votes, self.coffee.votes), (1, 0))
+
+    def test_vote_view_without_choice(self):
+        response = self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': 'nope'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['error_message'], "You didn't select a choice.")
+        self.assertFalse(Vote.objects.exists())
+
+
+class VoteCoalescingTests(PollsTestCase):
+
+    def test_record_votes_writes_a_batch_together(self):
+        carol = User.objects.create_user('carol', password='pw-carol-123')
+        votes = [(self.user, self.tea.id), (self.other, self.coffee.id), (self.user, self.coffee.id), (carol, 999)]
+        with CaptureQueriesContext(connection) as queries:
+            results = record_votes(self.question.id, votes)
+        self.assertEqual([type(result) for result in results], [type(None), type(None), AlreadyVoted, InvalidChoice])
+        # Two reads, then an UPDATE per choice, one for the question and one INSERT.
+        self.assertEqual(
+            [q['sql'].split()[0] for q in queries],
+            ['SELECT', 'SELECT', 'SAVEPOINT', 'UPDATE', 'UPDATE', 'UPDATE', 'INSERT', 'RELEASE'],
+        )
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.total_votes, 2)
+        self.assertEqual(Vote.objects.count(), 2)
+        self.assertEqual(counters.reconcile(repair=False), (1, 0))
+
+    def test_rejected_batch_costs_constant_queries(self):
+        with self.assertNumQueries(2):
+            results = record_votes(self.question.id, [(self.user, 998), (self.other, 999)])
+        self.assertEqual([type(result) for result in results], [InvalidChoice, InvalidChoice])
+        Question.objects.filter(pk=self.question.pk).update(closes_at=timezone.now())
+        with self.assertNumQueries(1):
+            results = record_votes(self.question.id, [(self.user, self.tea.id), (self.other, self.coffee.id)])
+        self.assertEqual([type(result) for result in results], [PollClosed, PollClosed])
+        # Same answer as record_vote() when none of the choices are the poll's own.
+        with self.assertNumQueries(2):
+            results = record_votes(self.question.id, [(self.user, 998), (self.other, 999)])
+        self.assertEqual([type(result) for result in results], [PollClosed, PollClosed])
+
+    def test_poll_closing_after_the_reads_rolls_the_batch_back(self):
+        Question.objects.filter(pk=self.question.pk).update(closes_at=timezone.now())
+        # Only the read before the transaction still sees the poll as open.
+        earlier = [timezone.now() - timedelta(hours=1)]
+        with mock.patch('polls.services.timezone') as clock:
+            clock.now.side_effect = lambda: earlier.pop() if earlier else timezone.now()
+            results = record_votes(self.question.id, [(self.user, self.tea.id), (self.other, self.coffee.id)])
+        self.assertEqual([type(result) for result in results], [PollClosed, PollClosed])
+        self.assertFalse(Vote.objects.exists())
+        self.assertEqual(counters.tally(self.question.id)[0]['votes'], 0)
+        self.assertEqual(Question.objects.get(pk=self.question.pk).total_votes, 0)
+
+    @override_settings(POLLS_COUNTER_MODE='sharded', POLLS_COUNTER_SHARDS=2, POLLS_RESULTS_MAX_STALENESS=0)
+    def test_record_votes_in_sharded_mode(self):
+        record_votes(self.question.id, [(self.user, self.tea.id), (self.other, self.tea.id)])
+        self.assertEqual(counters.pending_total(), 2)
+        self.assertEqual(results_cache.get_tally(self.question)[0]['votes'], 2)
+
+    def test_constraint_violation_falls_back_to_single_votes(self):
+        with mock.patch('polls.services.Vote.objects.bulk_create', side_effect=IntegrityError):
+            results = record_votes(self.question.id, [(self.user, self.tea.id), (self.other, self.coffee.id)])
+        self.assertEqual(results, [None, None])
+        self.assertEqual(Vote.objects.count(), 2)
+        self.assertEqual(counters.reconcile(repair=False), (1, 0))
+
+    def test_votes_arriving_during_a_write_are_batched(self):
+        writing, release = threading.Event(), threading.Event()
+
+        def slow_vote(*args):
+            writing.set()
+            release.wait(5)
+
+        def vote(user, choice_id):
+            try:
+                coalescer.record_vote(user, self.question.id, choice_id)
+            except AlreadyVoted as exc:
+                outcomes.append(exc)
+
+        outcomes = []
+        batch = mock.Mock(return_value=[None, AlreadyVoted(self.question.id), None])
+        with mock.patch('polls.coalescer.record_vote', slow_vote), mock.patch('polls.coalescer.record_votes', batch):
+            threads = [threading.Thread(target=vote, args=(self.user, self.tea.id))]
+            threads[0].start()
+            writing.wait(5)
+            for user in (self.other, self.user, self.other):
+                threads.append(threading.Thread(target=vote, args=(user, self.coffee.id)))
+                threads[-1].start()
+            while len(coalescer._polls[self.question.id].batch.votes) < 3:
+                time.sleep(0.001)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+        batch.assert_called_once()
+        self.assertEqual(len(batch.call_args[0][1]), 3)
+        self.assertEqual(len(outcomes), 1)
+        self.assertEqual(coalescer.stats()[0]['max_batch_size'], 3)
+
+    @override_settings(POLLS_VOTE_POLL_RATE=2, POLLS_VOTE_POLL_BURST=2, POLLS_VOTE_MAX_WAIT_MS=500)
+    def test_admission_queues_then_sheds(self):
+        with mock.patch('polls.coalescer.record_vote') as write, mock.patch('polls.coalescer.time') as clock:
+            clock.monotonic.return_value = 100.0
+            for _ in range(3):
+                coalescer.record_vote(self.user, self.question.id, self.tea.id)
+            with self.assertRaises(Overloaded):
+                coalescer.record_vote(self.user, self.question.id, self.tea.id)
+            clock.sleep.assert_called_once_with(0.5)
+            clock.monotonic.return_value = 102.0
+            coalescer.record_vote(self.user, self.question.id, self.tea.id)
+        self.assertEqual(write.call_count, 4)
+        stats = coalescer.stats()[0]
+        self.assertEqual((stats['votes'], stats['queued'], stats['shed']), (4, 1, 1))
+
+    @override_settings(POLLS_VOTE_POLL_RATE=1, POLLS_VOTE_POLL_BURST=1, POLLS_VOTE_MAX_WAIT_MS=0)
+    def test_shed_vote_gets_a_429(self):
+        url = reverse('polls:vote', args=(self.question.id,))
+        self.assertEqual(self.client.post(url, {'choice': self.tea.id}).status_code, 302)
+        self.client.force_login(self.other)
+        response = self.client.post(url, {'choice': self.tea.id})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(Vote.objects.count(), 1)
+
+        self.other.is_staff = True
+        self.other.save()
+        polls = self.client.get(reverse('polls:vote_stats')).json()['polls']
+        self.assertEqual([(p['id'], p['votes'], p['shed']) for p in polls], [(self.question.id, 1, 1)])
+
+
+@override_settings(POLLS_COUNTER_MODE='sharded', POLLS_COUNTER_SHARDS=4, POLLS_RESULTS_MAX_STALENESS=0)
+class ShardedCounterTests(PollsTestCase):
+
+    def test_votes_land_in_shards_until_flushed(self):
+        record_vote(self.user, self.question.id, self.tea.id)
+        record_vote(self.other, self.question.id, self.tea.id)
+        self.tea.refresh_from_db()
+        self.assertEqual(self.tea.votes, 0)
+        self.assertEqual(counters.pending_total(), 2)
+        self.assertEqual([c['votes'] for c in counters.tally(self.question.id)], [2, 0])
+
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.total_votes, 0)
+
+        self.assertEqual(counters.flush(), 2)
+        self.tea.refresh_from_db()
+        self.question.refresh_from_db()
+        self.assertEqual((self.tea.votes, self.question.total_votes), (2, 2))
+        self.assertEqual(counters.pending_total(), 0)
+        self.assertEqual([c['votes'] for c in counters.tally(self.question.id)], [2, 0])
+
+    def test_invalid_choice_creates_no_shard(self):
+        other = Question.objects.create(question_text='Other?', user=self.user)
+        with self.assertRaises(InvalidChoice):
+            record_vote(self.user, other.id, self.tea.id)
+        self.assertFalse(ChoiceCounterShard.objects.exists())
+
+    def test_results_page_includes_pending_votes(self):
+        record_vote(self.user, self.question.id, self.coffee.id)
+        response = self.client.get(reverse('polls:results', args=(self.question.id,)))
+        self.assertContains(response, 'Coffee -- 1 vote')
+
+    def test_reconcile_repairs_drift_around_pending_shards(self):
+        record_vote(self.user, self.question.id, self.tea.id)
+        counters.flush()
+        record_vote(self.other, self.question.id, self.tea.id)  # still pending
+        Question.objects.filter(pk=self.question.pk).update(total_votes=5, choice_count=7)
+        Choice.objects.filter(pk=self.coffee.pk).update(votes=3)
+
+        out = StringIO()
+        call_command('reconcile_vote_totals', dry_run=True, stdout=out)
+        self.assertIn('Checked 1 questions, found drift in 1.', out.getvalue())
+        self.assertEqual(Question.objects.get(pk=self.question.pk).total_votes, 5)
+
+        self.assertEqual(counters.reconcile(batch_size=1), (1, 1))
+        self.question.refresh_from_db()
+        self.coffee.refresh_from_db()
+        self.assertEqual((self.question.total_votes, self.question.choice_count, self.coffee.votes), (1, 2, 0))
+        self.assertEqual(counters.reconcile(), (1, 0))
+
+
+class ResultsCacheTests(PollsTestCase):
+
+    def results(self):
+        return self.client.get(reverse('polls:results', args=(self.question.id,)))
+
+    def test_second_view_is_a_hit(self):
+        self.results()
+        caches['template_fragments'].clear()
+        with self.assertNumQueries(3):  # session, user, question
+            self.assertContains(self.results(), 'Tea -- 0 votes')
+        self.assertEqual(results_cache.stats()['hits'], 1)
+        self.assertEqual(results_cache.stats()['misses'], 1)
+
+    def test_vote_invalidates(self):
+        self.results()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.tea.id})
+        self.assertContains(self.results(), 'Tea -- 1 vote')
+
+    def test_miss_that_races_a_vote_doesnt_stick(self):
+        real_tally = counters.tally
+
+        def tally_then_vote(question_id):
+            # The vote commits, and clears the entry, before this reader stores what it read.
+            tally = real_tally(question_id)
+            with self.captureOnCommitCallbacks(execute=True):
+                record_vote(self.other, self.question.id, self.tea.id)
+            return tally
+
+        with mock.patch.object(counters, 'tally', side_effect=tally_then_vote):
+            self.assertEqual(results_cache.get_tally(Question.objects.get(pk=self.question.pk))[0]['votes'], 0)
+        self.assertEqual(results_cache.get_tally(Question.objects.get(pk=self.question.pk))[0]['votes'], 1)
+        self.assertContains(self.results(), 'Tea -- 1 vote')
+
+    def test_edit_invalidates(self):
+        self.results()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('polls:edit_question', args=(self.question.id,)), {
+                'question_text': 'Tea or juice?',
+                'choices-TOTAL_FORMS': '2', 'choices-INITIAL_FORMS': '0',
+                'choices-0-choice_text': 'Tea', 'choices-1-choice_text': 'Juice',
+            })
+        self.assertContains(self.results(), 'Juice -- 0 votes')
+
+    def test_stats_are_staff_only(self):
+        self.assertEqual(self.client.get(reverse('polls:results_cache_stats')).status_code, 302)
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('polls:results_cache_stats')).json()['misses'], 0)
+
+
+class FragmentCacheTests(PollsTestCase):
+
+    def get(self, name, *args):
+        return self.client.get(reverse(name, args=args)).content.decode()
+
+    def test_results_fragment_is_keyed_by_updated_at(self):
+        self.get('polls:results', self.question.id)
+        with self.assertNumQueries(3):  # session, user, question; no tally
+            self.assertIn('Tea -- 0 votes', self.get('polls:results', self.question.id))
+        self.assertEqual(results_cache.stats()['hits'], 0)
+
+        stamp = Question.objects.get(pk=self.question.pk).updated_at
+        with self.captureOnCommitCallbacks(execute=True):
+            record_vote(self.user, self.question.id, self.tea.id)
+        self.assertGreater(Question.objects.get(pk=self.question.pk).updated_at, stamp)
+        self.assertIn('Tea -- 1 vote', self.get('polls:results', self.question.id))
+
+    def test_index_fragment_follows_edits(self):
+        self.assertIn('Tea or coffee?', self.get('polls:index'))
+        update_poll(self.question, ['Tea', 'Coffee'], question_text='Tea or cocoa?')
+        self.assertIn('Tea or cocoa?', self.get('polls:index'))
+        # Renaming a choice doesn't change the list but still moves the stamp.
+        stamp = Question.objects.get(pk=self.question.pk).updated_at
+        update_poll(self.question, ['Green tea', 'Coffee'])
+        self.assertGreater(Question.objects.get(pk=self.question.pk).updated_at, stamp)
+
+    @override_settings(POLLS_COUNTER_MODE='sharded', POLLS_RESULTS_MAX_STALENESS=0)
+    def test_sharded_votes_move_the_stamp_on_flush(self):
+        stamp = Question.objects.get(pk=self.question.pk).updated_at
+        self.get('polls:results', self.question.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            record_vote(self.user, self.question.id, self.tea.id)
+        self.assertEqual(Question.objects.get(pk=self.question.pk).updated_at, stamp)
+        # Same stamp, but with no staleness allowed the fragment isn't reused.
+        self.assertIn('Tea -- 1 vote', self.get('polls:results', self.question.id))
+        counters.flush()
+        self.assertGreater(Question.objects.get(pk=self.question.pk).updated_at, stamp)
+
+
+class ConditionalGetTests(PollsTestCase):
+
+    def get(self, name, *args, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(name, args=args), **headers)
+        return response, len(queries)
+
+    def test_repeat_results_request_is_not_modified(self):
+        first, first_queries = self.get('polls:results', self.question.id)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('Last-Modified', first)
+        self.assertIn('no-cache', first['Cache-Control'])
+
+        repeat, repeat_queries = self.get('polls:results', self.question.id, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(repeat.status_code, 304)
+        self.assertEqual(repeat.content, b'')
+        self.assertGreater(len(first.content), 500)
+        # Session, user and question; the tally query is skipped.
+        self.assertEqual((first_queries, repeat_queries), (4, 3))
+
+        since, _ = self.get('polls:results', self.question.id, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(since.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            record_vote(self.user, self.question.id, self.tea.id)
+        after_vote, _ = self.get('polls:results', self.question.id, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(after_vote.status_code, 200)
+        self.assertNotEqual(after_vote['ETag'], first['ETag'])
+
+    def test_repeat_index_request_is_not_modified(self):
+        first, first_queries = self.get('polls:index')
+        repeat, repeat_queries = self.get('polls:index', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(repeat.status_code, 304)
+        self.assertEqual(repeat.content, b'')
+        # The page itself is still loaded to work out the ETag; the saving is the render and the body.
+        self.assertEqual(first_queries, repeat_queries)
+
+        update_poll(self.question, ['Tea', 'Coffee'], question_text='Tea or cocoa?')
+        edited, _ = self.get('polls:index', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(edited.status_code, 200)
+        self.assertContains(edited, 'Tea or cocoa?')
+
+    @override_settings(POLLS_COUNTER_MODE='sharded', POLLS_RESULTS_MAX_STALENESS=0)
+    def test_live_sharded_results_have_no_validators(self):
+        response, _ = self.get('polls:results', self.question.id)
+        self.assertNotIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+
+
+class ApiTests(PollsTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.more = [create_poll(cls.other, f'Poll {i}?', ['Yes', 'No', 'Maybe']) for i in range(12)]
+
+    def api(self, name, *args, **params):
+        return self.client.get(reverse(name, args=args), params)
+
+    def test_batch_costs_the_same_queries_for_any_size(self):
+        ids = [q.id for q in self.more]
+        with self.assertNumQueries(4):  # session, user, questions, choices
+            one = self.api('polls:api_batch', ids=str(ids[0])).json()
+        with self.assertNumQueries(4):
+            many = self.api('polls:api_batch', ids=','.join(map(str, ids + [999]))).json()
+        self.assertEqual(len(one['questions']), 1)
+        self.assertEqual([row[0] for row in many['questions']], ids)
+        self.assertEqual(many['missing'], [999])
+        self.assertEqual(many['fields'][-1], 'choices')
+        self.assertEqual([c[1] for c in many['questions'][0][-1]], ['Yes', 'No', 'Maybe'])
+
+    def test_field_selection_skips_the_choice_query(self):
+        with self.assertNumQueries(3):
+            data = self.api('polls:api_question', self.question.id, fields='total_votes,question_text').json()
+        self.assertEqual(data['fields'], ['id', 'total_votes', 'question_text'])
+        self.assertEqual(data['questions'], [[self.question.id, 0, 'Tea or coffee?']])
+        self.assertEqual(self.api('polls:api_question', self.question.id, fields='password').status_code, 400)
+        self.assertEqual(self.api('polls:api_question', 999).status_code, 404)
+
+    def test_unpublished_questions_are_hidden(self):
+        future = Question.objects.create(question_text='Soon?', user=self.user)
+        Question.objects.filter(pk=future.pk).update(pub_date=timezone.now() + timedelta(days=1))
+        self.assertEqual(self.api('polls:api_question', future.id).status_code, 404)
+        self.assertEqual(self.api('polls:api_batch', ids=f'{future.id},{self.question.id}').json()['missing'], [future.id])
+
+    @override_settings(POLLS_COUNTER_MODE='sharded', POLLS_API_PAGE_SIZE=10)
+    def test_list_pages_and_includes_pending_votes(self):
+        record_vote(self.user, self.question.id, self.coffee.id)
+        first = self.api('polls:api_questions').json()
+        self.assertEqual(len(first['questions']), 10)
+        second = self.api('polls:api_questions', cursor=first['next_cursor']).json()
+        self.assertIsNone(second['next_cursor'])
+        tea_or_coffee = next(row for row in second['questions'] if row[0] == self.question.id)
+        self.assertEqual(tea_or_coffee[-1], [[self.tea.id, 'Tea', 0], [self.coffee.id, 'Coffee', 1]])
+
+    @override_settings(POLLS_API_BATCH_LIMIT=5)
+    def test_bad_batches_and_compression(self):
+        self.assertEqual(self.api('polls:api_batch', ids='1,x').status_code, 400)
+        self.assertEqual(self.api('polls:api_batch').status_code, 400)
+        self.assertEqual(self.api('polls:api_batch', ids='1,2,3,4,5,6').status_code, 400)
+        response = self.client.get(
+            reverse('polls:api_questions'), HTTP_ACCEPT_ENCODING='gzip, br'
+        )
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn(b'"fields":["id",', gzip.decompress(response.content))
+
+
+@override_settings(POLLS_ARCHIVE_AFTER=0)
+class PollLifecycleTests(PollsTestCase):
+    databases = {'default', archive.archive_database()}
+
+    def close(self, question=None):
+        question = question or self.question
+        Question.objects.filter(pk=question.pk).update(closes_at=timezone.now() - timedelta(minutes=1))
+
+    def test_closed_poll_takes_no_votes(self):
+        self.close()
+        with self.assertRaises(PollClosed):
+            record_vote(self.user, self.question.id, self.tea.id)
+        for result in record_votes(self.question.id, [(self.user, self.tea.id), (self.other, self.tea.id)]):
+            self.assertIsInstance(result, PollClosed)
+        with self.settings(POLLS_COUNTER_MODE='sharded', POLLS_RESULTS_MAX_STALENESS=0):
+            with self.assertRaises(PollClosed):
+                record_vote(self.user, self.question.id, self.tea.id)
+        self.assertFalse(Vote.objects.exists())
+        self.assertEqual(counters.reconcile(repair=False), (1, 0))
+
+        results = reverse('polls:results', args=(self.question.id,))
+        self.assertRedirects(self.client.get(reverse('polls:detail', args=(self.question.id,))), results)
+        self.assertRedirects(self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.tea.id}), results)
+
+    def test_end_date_from_the_forms(self):
+        self.client.post(reverse('polls:edit_question', args=(self.question.id,)), {
+            'question_text': 'Tea or coffee?', 'closes_at': '2030-01-01T12:00',
+            'choices-TOTAL_FORMS': '2', 'choices-INITIAL_FORMS': '0',
+            'choices-0-choice_text': 'Tea', 'choices-1-choice_text': 'Coffee',
+        })
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.closes_at.year, 2030)
+        self.assertFalse(self.question.is_closed())
+        self.assertContains(self.client.get(reverse('polls:detail', args=(self.question.id,))), 'Voting ends')
+
+    def test_archive_moves_votes_and_keeps_serving_results(self):
+        record_vote(self.user, self.question.id, self.tea.id)
+        record_vote(self.other, self.question.id, self.coffee.id)
+        self.close()
+        open_poll = create_poll(self.user, 'Still open?', ['Yes', 'No'])
+
+        self.assertEqual(archive.archive(batch_size=1), (1, 2))
+
+        self.assertFalse(Vote.objects.exists())
+        self.assertFalse(Choice.objects.filter(question=self.question).exists())
+        self.assertEqual(sorted(ArchivedVote.objects.values_list('user_id', 'choice_id')),
+                         sorted([(self.user.id, self.tea.id), (self.other.id, self.coffee.id)]))
+        self.question.refresh_from_db()
+        self.assertIsNotNone(self.question.archived_at)
+        self.assertEqual((self.question.total_votes, self.question.choice_count), (2, 2))
+        self.assertIsNone(Question.objects.get(pk=open_poll.pk).archived_at)
+
+        self.assertContains(self.client.get(reverse('polls:results', args=(self.question.id,))), 'Tea -- 1 vote')
+        api = self.client.get(reverse('polls:api_question', args=(self.question.id,))).json()
+        self.assertEqual(api['questions'][0][-1], [[self.tea.id, 'Tea', 1], [self.coffee.id, 'Coffee', 1]])
+        # Frozen: reconcile leaves it alone and it can't be edited.
+        self.assertEqual(counters.reconcile(repair=False), (1, 0))
+        self.assertEqual(self.client.get(reverse('polls:edit_question', args=(self.question.id,))).status_code, 404)
+
+        self.question.delete()
+        self.assertFalse(ArchivedVote.objects.exists())
+
+    def test_interrupted_run_is_finished_by_the_next(self):
+        record_vote(self.user, self.question.id, self.tea.id)
+        self.close()
+        archive.freeze(self.question.id)
+        self.assertEqual(archive.due(), [self.question.id])
+        self.assertEqual(archive.archive(), (1, 1))
+        self.assertEqual(archive.due(), [])
+        self.assertEqual(ArchivedChoice.objects.get(pk=self.tea.id).votes, 1)
+
+    @override_settings(POLLS_ARCHIVE_AFTER=3600)
+    def test_recently_closed_polls_wait(self):
+        self.close()
+        self.assertEqual(archive.due(), [])
+        out = StringIO()
+        call_command('archive_polls', stdout=out)
+        self.assertIn('Archived 0 polls', out.getvalue())
+
+
+class SizedLocMemCacheTests(TestCase):
+
+    def test_evicts_least_recently_used_by_size(self):
+        cache = SizedLocMemCache('test-sized', {'OPTIONS': {'MAX_BYTES': 3000}})
+        cache.clear()
+        cache.set('a', 'x' * 1000)
+        cache.set('b', 'x' * 1000)
+        cache.get('a')
+        cache.set('c', 'x' * 1000)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertLessEqual(cache.size_bytes, 3000)
+        cache.delete('a')
+        cache.delete('c')
+        self.assertEqual(cache.size_bytes, 0)
+
+
+class SearchTests(PollsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Question.objects.create(question_text='Best coffee brewing method?', user=self.user)
+        Question.objects.create(question_text='Coffee or espresso after dinner?', user=self.user)
+
+    def texts(self, keyword, **kwargs):
+        return [r['question_text'] for r in search.search(keyword, **kwargs).results]
+
+    def check_backend(self):
+        self.assertEqual(len(self.texts('coffee')), 3)
+        self.assertEqual(self.texts('espres'), ['Coffee or espresso after dinner?'])
+        self.assertEqual(self.texts('tea coff'), ['Tea or coffee?'])
+        self.assertEqual(self.texts('"; DROP TABLE polls_question; --'), [])
+
+        page = search.search('coffee', page=1, per_page=2)
+        self.assertTrue(page.has_next)
+        self.assertEqual(len(search.search('coffee', page=2, per_page=2).results), 1)
+
+        self.question.question_text = 'Juice or water?'
+        self.question.save()
+        self.assertEqual(len(self.texts('coffee')), 2)
+        self.assertEqual(self.texts('juice'), ['Juice or water?'])
+        self.question.delete()
+        self.assertEqual(self.texts('juice'), [])
+
+    def test_fts5(self):
+        self.assertIsInstance(search.get_index(), search.FTS5Index)
+        self.check_backend()
+
+    @override_settings(POLLS_SEARCH_BACKEND='python')
+    def test_inverted_index(self):
+        search.get_index().rebuild()
+        self.check_backend()
+
+    def test_reads_follow_read_only_routing(self):
+        # Only 'replica1' is reachable, so a read through 'default' would fail.
+        with mock.patch.multiple(search, connection=None, connections={'replica1': connection}), \
+                reading_from('replica1'):
+            self.assertEqual(self.texts('espres'), ['Coffee or espresso after dinner?'])
+
+    @override_settings(POLLS_SEARCH_LIMIT=2)
+    def test_limit(self):
+        self.assertEqual(len(self.texts('coffee')), 2)
+        self.assertFalse(search.search('coffee').has_next)
+
+    def test_view(self):
+        response = self.client.get(reverse('polls:search'), {'keyword': 'espresso'})
+        self.assertContains(response, 'Coffee or espresso after dinner?')
+        self.assertNotContains(response, 'Tea or coffee?')
+
+
+class KeysetPaginationTests(PollsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Question.objects.bulk_create(Question(question_text=f'Q{i}') for i in range(11))
+        # Force ties on pub_date so the id tie-breaker matters.
+        Question.objects.update(pub_date=timezone.now() - timedelta(hours=1))
+
+    def test_walk_forward_and_back(self):
+        expected = list(Question.objects.order_by('-pub_date', '-pk'))
+        seen, cursor, pages = [], None, []
+        while True:
+            page = keyset_page(Question.objects.all(), cursor, page_size=5)
+            pages.append(page)
+            seen += page.object_list
+            if not page.next_cursor:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(pages), 3)
+        self.assertIsNone(pages[0].prev_cursor)
+
+        back = keyset_page(Question.objects.all(), pages[2].prev_cursor, page_size=5)
+        self.assertEqual(back.object_list, pages[1].object_list)
+        first = keyset_page(Question.objects.all(), back.prev_cursor, page_size=5)
+        self.assertEqual(first.object_list, pages[0].object_list)
+        self.assertIsNone(first.prev_cursor)
+
+    @override_settings(POLLS_INDEX_PAGE_SIZE=4)
+    def test_index_view(self):
+        response = self.client.get(reverse('polls:index'))
+        self.assertEqual(len(response.context['latest_question_list']), 4)
+        response = self.client.get(reverse('polls:index'), {'cursor': response.context['next_cursor']})
+        self.assertEqual(len(response.context['latest_question_list']), 4)
+        self.assertIsNotNone(response.context['prev_cursor'])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(reverse('polls:index'), {'cursor': 'garbage'}).status_code, 404)
+
+
+class QueryBudgetTests(PollsTestCase):
+    """
+    Upper bounds on the queries each polls view may run, with enough rows
+    that an N+1 would blow the budget. Every logged-in request pays 2 of
+    them for the session and the user.
+    """
+
+    BUDGETS = {
+        'index': 3,
+        'detail': 4,
+        'detail_voted': 3,
+        'results': 4,
+        # Inside TestCase the vote transaction shows up as SAVEPOINT/RELEASE.
+        'vote': 8,
+        'vote_again': 8,
+        'search': 3,
+        'add_form': 2,
+        'edit_form': 4,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for i in range(10):
+            question = Question.objects.create(question_text=f'Question {i}?', user=cls.other)
+            Choice.objects.bulk_create(
+                Choice(question=question, choice_text=f'Choice {j}', user=cls.other) for j in range(10)
+            )
+        cls.busy = question
+
+    def assertWithinBudget(self, name, method, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data)
+        self.assertLess(response.status_code, 400)
+        self.assertLessEqual(
+            len(queries), self.BUDGETS[name],
+            f"{name} ran {len(queries)} queries:\n" + '\n'.join(q['sql'] for q in queries),
+        )
+        return response
+
+    def test_read_views(self):
+        self.assertWithinBudget('index', 'get', reverse('polls:index'))
+        self.assertWithinBudget('detail', 'get', reverse('polls:detail', args=(self.busy.id,)))
+        self.assertWithinBudget('results', 'get', reverse('polls:results', args=(self.busy.id,)))
+        self.assertWithinBudget('search', 'get', reverse('polls:search'), {'keyword': 'question'})
+
+    def test_vote_path(self):
+        choice = self.busy.choice_set.first()
+        url = reverse('polls:vote', args=(self.busy.id,))
+        self.assertWithinBudget('vote', 'post', url, {'choice': choice.id})
+        self.assertWithinBudget('vote_again', 'post', url, {'choice': choice.id})
+        self.assertWithinBudget('detail_voted', 'get', reverse('polls:detail', args=(self.busy.id,)))
+
+    def test_write_forms(self):
+        self.assertWithinBudget('add_form', 'get', reverse('polls:add_question'))
+        self.assertWithinBudget('edit_form', 'get', reverse('polls:edit_question', args=(self.question.id,)))
+
+
+@override_settings(POLLS_USER_CACHE_SECONDS=60, AUTHENTICATION_BACKENDS=['polls.auth_backends.CachedModelBackend'])
+class SessionFastPathTests(PollsTestCase):
+
+    def request_queries(self, method, *args):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(*args)
+        return response, len(queries)
+
+    def vote_and_index_queries(self):
+        self.client.get(reverse('polls:index'))  # warm the caches
+        _, index = self.request_queries('get', reverse('polls:index'))
+        response, vote = self.request_queries('post', reverse('polls:vote', args=(self.question.id,)), {'choice': self.tea.id})
+        self.assertEqual(response.status_code, 302)
+        return index, vote
+
+    def test_cached_user_skips_the_user_query(self):
+        with self.settings(POLLS_USER_CACHE_SECONDS=0):
+            baseline = self.vote_and_index_queries()
+        Vote.objects.all().delete()
+        self.assertEqual(self.vote_and_index_queries(), (baseline[0] - 1, baseline[1] - 1))
+
+    def test_saving_a_user_drops_the_cached_copy(self):
+        self.client.get(reverse('polls:index'))
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get(reverse('polls:index')).status_code, 200)  # still cached
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('polls:index')).status_code, 302)
+
+    def fresh_login(self):
+        # SessionMiddleware picks its engine when the client first loads it.
+        self.client = self.client_class()
+        self.client.force_login(self.user)
+
+    def test_cached_db_sessions(self):
+        with self.settings(POLLS_USER_CACHE_SECONDS=0):
+            baseline = self.vote_and_index_queries()
+        Vote.objects.all().delete()
+        with self.settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db', SESSION_CACHE_ALIAS='sessions'):
+            self.fresh_login()
+            # No session or user SELECT left on either view.
+            self.assertEqual(self.vote_and_index_queries(), (baseline[0] - 2, baseline[1] - 2))
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_signed_cookie_sessions(self):
+        self.fresh_login()
+        self.client.get(reverse('polls:index'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('polls:index'))
+        self.assertFalse([q for q in queries if 'django_session' in q['sql'] or 'auth_user' in q['sql']])
+
+
+@override_settings(POLLS_VOTED_CACHE_SECONDS=60)
+class VotedCacheTests(PollsTestCase):
+
+    def queries(self, method, *args):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(*args)
+        return response, [q['sql'] for q in queries if 'django_session' not in q['sql'] and 'auth_user' not in q['sql']]
+
+    def vote(self, choice):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': choice.id})
+
+    def test_detail_check_is_answered_from_memory(self):
+        self.client.get(reverse('polls:detail', args=(self.question.id,)))  # loads the voted set
+        self.vote(self.tea)
+        response, queries = self.queries('get', reverse('polls:detail', args=(self.question.id,)))
+        self.assertRedirects(response, reverse('polls:results', args=(self.question.id,)))
+        self.assertEqual(queries, [])
+
+    def test_repeat_vote_skips_the_write(self):
+        self.client.get(reverse('polls:detail', args=(self.question.id,)))
+        self.vote(self.tea)
+        response, queries = self.queries('post', reverse('polls:vote', args=(self.question.id,)), {'choice': self.coffee.id})
+        self.assertRedirects(response, reverse('polls:results', args=(self.question.id,)), fetch_redirect_response=False)
+        self.assertEqual(queries, [])
+        self.assertEqual(Vote.objects.get().choice, self.tea)
+
+    def test_vote_from_another_process_is_learned_from_the_constraint(self):
+        self.client.get(reverse('polls:detail', args=(self.question.id,)))
+        Vote.objects.create(user=self.user, question=self.question, choice=self.tea)
+        self.assertEqual(self.client.get(reverse('polls:detail', args=(self.question.id,))).status_code, 200)
+        self.vote(self.coffee)
+        self.assertEqual(self.client.get(reverse('polls:detail', args=(self.question.id,))).status_code, 302)
+
+    def test_index_marks_voted_polls(self):
+        create_poll(self.other, 'Cats or dogs?', ['Cats', 'Dogs'])
+        first = self.client.get(reverse('polls:index'))
+        self.assertNotContains(first, '(voted)')
+        self.vote(self.tea)
+        response = self.client.get(reverse('polls:index'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '(voted)', count=1)
+        self.assertEqual(
+            [q.user_has_voted for q in response.context['latest_question_list']],
+            [q.pk == self.question.pk for q in response.context['latest_question_list']],
+        )
+        # Another user's page isn't served from the first one's fragment.
+        self.client.force_login(self.other)
+        self.assertNotContains(self.client.get(reverse('polls:index')), '(voted)')
+
+    def test_deleted_choice_lets_its_voters_vote_again(self):
+        self.vote(self.tea)
+        self.assertTrue(voted_cache.voted_ids(self.user.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            update_poll(self.question, ['', 'Coffee'])
+        self.assertEqual(self.client.get(reverse('polls:detail', args=(self.question.id,))).status_code, 200)
+
+    def test_load_reads_the_primary_and_keeps_votes_recorded_meanwhile(self):
+        def racing_array(typecode, question_ids):
+            loaded = array(typecode, question_ids)
+            voted_cache.add(self.user.pk, self.question.id)  # a vote commits while the set loads
+            return loaded
+
+        # 'replica1' doesn't exist, so the load has to go to 'default'.
+        with mock.patch('polls.voted.array', racing_array), reading_from('replica1'):
+            self.assertEqual(list(voted_cache.voted_ids(self.user.pk)), [self.question.id])
+        self.assertEqual(list(voted_cache.voted_ids(self.user.pk, load=False)), [self.question.id])
+
+    @override_settings(POLLS_VOTED_CACHE_USERS=1)
+    def test_least_recently_used_user_is_evicted(self):
+        voted_cache.voted_ids(self.user.pk)
+        voted_cache.voted_ids(self.other.pk)
+        self.assertIsNone(voted_cache.voted_ids(self.user.pk, load=False))
+        self.assertIsNotNone(voted_cache.voted_ids(self.other.pk, load=False))
+
+
+@skipUnless(connection.vendor == 'sqlite', "Reads SQLite's EXPLAIN QUERY PLAN output.")
+class QueryPlanTests(PollsTestCase):
+    """Every query a view runs against a few thousand polls should be an index lookup."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        questions = bulk_create_polls(cls.other, [(f'Question {i}?', ['Yes', 'No', 'Maybe']) for i in range(2000)])
+        first_choices = dict(Choice.objects.order_by('-id').values_list('question_id', 'id'))
+        voters = User.objects.bulk_create(User(username=f'voter{i}') for i in range(20))
+        Vote.objects.bulk_create(
+            Vote(user=voter, question=question, choice_id=first_choices[question.id])
+            for voter in voters for question in questions[::10]
+        )
+        cls.busy = questions[-1]
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertIndexed(self, method, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            getattr(self.client, method)(url, data)
+        plans = []
+        for query in queries:
+            if not query['sql'].startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                steps = [row[3] for row in cursor.fetchall()]
+            plans.extend(steps)
+            for step in steps:
+                # Full-text search sorts its own matches by rank; anything else must not scan or sort.
+                if 'VIRTUAL TABLE' in step or ('TEMP B-TREE' in step and '_fts' in query['sql']):
+                    continue
+                self.assertFalse(
+                    (step.startswith('SCAN ') and ' USING ' not in step)
+                    or 'TEMP B-TREE' in step or 'AUTOMATIC' in step,
+                    f"{url}: {step}\n{query['sql']}",
+                )
+        return plans
+
+    def test_read_views(self):
+        self.assertIndexed('get', reverse('polls:index'))
+        cursor = keyset_page(Question.objects.all(), None, 5).next_cursor
+        self.assertIndexed('get', reverse('polls:index'), {'cursor': cursor})
+        plans = self.assertIndexed('get', reverse('polls:detail', args=(self.busy.id,)))
+        self.assertIn('SEARCH polls_choice USING COVERING INDEX choice_question_listing_idx (question_id=?)', plans)
+        self.assertIndexed('get', reverse('polls:results', args=(self.busy.id,)))
+        self.assertIndexed('get', reverse('polls:search'), {'keyword': 'question 19'})
+        self.assertIndexed('get', reverse('polls:api_questions'))
+        ids = ','.join(str(pk) for pk in Question.objects.values_list('pk', flat=True)[:50])
+        self.assertIndexed('get', reverse('polls:api_batch'), {'ids': ids})
+
+    def test_write_views(self):
+        self.assertIndexed('post', reverse('polls:vote', args=(self.busy.id,)), {'choice': self.busy.choice_set.first().id})
+        self.assertIndexed('post', reverse('polls:vote', args=(self.busy.id,)), {'choice': self.busy.choice_set.first().id})
+        self.assertIndexed('get', reverse('polls:edit_question', args=(self.busy.id,)))
+        # Deleting cascades to choices, votes and counter shards.
+        self.assertIndexed('get', reverse('polls:delete_question', args=(self.busy.id,)))
+
+
+class PollWriteTests(PollsTestCase):
+
+    def test_create_poll_skips_blank_choices(self):
+        # savepoint, question, search index (2), choices, release
+        with self.assertNumQueries(6):
+            question = create_poll(self.user, 'New?', ['A', '', '  ', 'B'])
+        self.assertEqual(list(question.choice_set.order_by('id').values_list('choice_text', flat=True)), ['A', 'B'])
+        self.assertEqual(question.choice_count, 2)
+
+    def test_update_poll_keeps_votes_on_unchanged_choices(self):
+        record_vote(self.other, self.question.id, self.tea.id)
+        record_vote(self.user, self.question.id, self.coffee.id)
+        created, updated, deleted = update_poll(self.question, ['Tea', 'Green tea', 'Juice', ''])
+        self.assertEqual((created, updated, deleted), (1, 1, 0))
+        self.tea.refresh_from_db()
+        self.coffee.refresh_from_db()
+        self.assertEqual((self.tea.votes, self.coffee.choice_text, self.coffee.votes), (1, 'Green tea', 1))
+        self.assertEqual(Vote.objects.count(), 2)
+
+        self.assertEqual(update_poll(self.question, ['Tea', '', 'Juice']), (0, 0, 1))
+        self.assertFalse(Choice.objects.filter(pk=self.coffee.pk).exists())
+        self.assertEqual(Vote.objects.count(), 1)
+        self.question.refresh_from_db()
+        self.assertEqual((self.question.choice_count, self.question.total_votes), (2, 1))
+
+    def test_edit_view(self):
+        record_vote(self.other, self.question.id, self.tea.id)
+        self.client.post(reverse('polls:edit_question', args=(self.question.id,)), {
+            'question_text': 'Tea or coffee?',
+            'choices-TOTAL_FORMS': '3', 'choices-INITIAL_FORMS': '0',
+            'choices-0-choice_text': 'Tea', 'choices-1-choice_text': 'Coffee',
+            'choices-2-choice_text': 'Water',
+        })
+        self.tea.refresh_from_db()
+        self.assertEqual(self.tea.votes, 1)
+        self.assertEqual(self.question.choice_set.count(), 3)
+
+    def test_import_command(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = Path(tmp.name) / 'polls.jsonl'
+        path.write_text(
+            json.dumps({'question_text': 'Cats or dogs?', 'choices': ['Cats', 'Dogs']}) + '\n'
+            + json.dumps({'question_text': 'Summer or winter?', 'choices': ['Summer', 'Winter', '']}) + '\n'
+        )
+        call_command('import_polls', str(path), user='alice', chunk_size=1, stdout=StringIO())
+        imported = Question.objects.get(question_text='Summer or winter?')
+        self.assertEqual((imported.choice_set.count(), imported.choice_count), (2, 2))
+        self.assertEqual(imported.user, self.user)
+        self.assertEqual(search.search('dogs').results[0]['question_text'], 'Cats or dogs?')
+
+        csv_path = path.with_suffix('.csv')
+        csv_path.write_text('question_text,choice,choice\nRain or shine?,Rain,Shine\n')
+        call_command('import_polls', str(csv_path), user='alice', stdout=StringIO())
+        self.assertEqual(Question.objects.get(question_text='Rain or shine?').choice_set.count(), 2)
+
+
+class ExportTests(PollsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        record_vote(self.user, self.question.id, self.tea.id)
+        record_vote(self.other, self.question.id, self.coffee.id)
+
+    def test_endpoint_is_staff_only(self):
+        self.assertEqual(self.client.get(reverse('polls:export', args=('votes', 'csv'))).status_code, 302)
+
+    def test_csv_and_incremental_jsonl(self):
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse('polls:export', args=('choices', 'csv')))
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,question_id,choice_text,votes,user_id')
+        self.assertEqual(len(lines), 3)
+
+        first_vote = Vote.objects.order_by('id').first()
+        response = self.client.get(reverse('polls:export', args=('votes', 'jsonl')), {'since_id': first_vote.id})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['user_id'] for row in rows], [self.other.id])
+
+    def test_gzip(self):
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse('polls:export', args=('questions', 'jsonl')), {'gzip': '1'})
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="questions.jsonl.gz"')
+        rows = gzip.decompress(b''.join(response.streaming_content)).splitlines()
+        self.assertEqual(json.loads(rows[0])['question_text'], 'Tea or coffee?')
+
+    def test_command(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = Path(tmp.name) / 'votes.csv.gz'
+        stderr = StringIO()
+        call_command('export_polls', 'votes', output=str(path), gzip=True, stderr=stderr)
+        self.assertEqual(len(gzip.decompress(path.read_bytes()).splitlines()), 3)
+        self.assertIn(f'Last id: {Vote.objects.order_by("-id").first().id}', stderr.getvalue())
+
+
+@override_settings(POLLS_THROTTLE_RATES={'login': (3, 300), 'search': (2, 60), 'vote': (30, 60), 'register': (10, 3600)})
+class ThrottleTests(PollsTestCase):
+
+    def test_sliding_window(self):
+        throttle = Throttle('search')
+        self.assertTrue(throttle.attempt('k', now=1000))
+        self.assertTrue(throttle.attempt('k', now=1001))
+        self.assertFalse(throttle.attempt('k', now=1002))
+        # Halfway through the next window half of the old hits still count.
+        self.assertEqual(throttle.count('k', now=1050), 1)
+        self.assertTrue(throttle.attempt('k', now=1050))
+        self.assertFalse(throttle.attempt('k', now=1050))
+
+    def test_search_is_throttled(self):
+        url = reverse('polls:search')
+        self.assertEqual(self.client.get(url, {'keyword': 'tea'}).status_code, 200)
+        self.assertEqual(self.client.get(url, {'keyword': 'tea'}).status_code, 200)
+        response = self.client.get(url, {'keyword': 'tea'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+
+    @override_settings(POLLS_THROTTLE_ENABLED=False)
+    def test_disabled(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get(reverse('polls:search'), {'keyword': 'tea'}).status_code, 200)
+
+    @override_settings(POLLS_AUDIT_BATCH_SIZE=4)
+    def test_failed_logins_are_throttled_and_audited_in_batches(self):
+        self.client.logout()
+        url = reverse('polls:login')
+        for _ in range(3):
+            self.assertEqual(self.client.post(url, {'username': 'alice', 'password': 'wrong'}).status_code, 200)
+        self.assertEqual(LoginAttempt.objects.count(), 0)
+        self.assertEqual(login_audit.pending(), 3)
+
+        response = self.client.post(url, {'username': 'alice', 'password': 'pw-alice-123'})
+        self.assertEqual(response.status_code, 429)
+        # Other usernames are unaffected; this attempt fills the batch.
+        response = self.client.post(url, {'username': 'bob', 'password': 'pw-bob-123'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(LoginAttempt.objects.filter(success=False).count(), 3)
+        self.assertEqual(LoginAttempt.objects.filter(success=True).count(), 1)
+
+
+class AsyncViewTests(PollsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.async_client.force_login(self.user)
+
+    def request(self, path, user=None, **data):
+        request = AsyncRequestFactory().get(path, data)
+        request.user = user or self.user
+        return request
+
+    async def test_index(self):
+        response = await async_views.index(self.request('/'))
+        self.assertContains(response, 'Tea or coffee?')
+
+    async def test_anonymous_is_redirected(self):
+        response = await async_views.index(self.request('/', user=AnonymousUser()))
+        self.assertEqual(response.status_code, 302)
+
+    async def test_results_and_json(self):
+        await sync_to_async(record_vote)(self.other, self.question.id, self.coffee.id)
+        response = await async_views.results(self.request('/'), pk=self.question.id)
+        self.assertContains(response, 'Coffee -- 1 vote')
+        response = await self.async_client.get(reverse('polls:results_json', args=(self.question.id,)))
+        self.assertEqual(response.json()['choices'][1], {'id': self.coffee.id, 'choice_text': 'Coffee', 'votes': 1})
+
+    async def test_missing_question(self):
+        with self.assertRaises(Http404):
+            await async_views.results(self.request('/'), pk=999)
+
+    async def test_search(self):
+        response = await async_views.search(self.request('/', keyword='coff'))
+        self.assertContains(response, 'Tea or coffee?')
+
+    async def test_search_loads_the_user_before_going_to_a_replica(self):
+        aliases = {}
+
+        def load_user():
+            aliases['user'] = router.db_for_read(User)
+            return self.user
+
+        def fake_search(keyword, page):
+            aliases['search'] = router.db_for_read(Question)
+            return search.SearchPage([], page, False)
+
+        request = AsyncRequestFactory().get('/', {'keyword': 'tea'})
+        request.user = SimpleLazyObject(load_user)
+        with mock.patch('polls.routers.read_replicas', return_value=['replica1']), \
+                mock.patch.object(search, 'search', fake_search):
+            await async_views.search(request)
+        self.assertEqual(aliases, {'user': 'default', 'search': 'replica1'})
+
+
+class LiveResultsTests(PollsTestCase):
+
+    async def test_deltas_are_coalesced(self):
+        subscription = live.local_bus.subscribe(self.question.id)
+        self.addCleanup(live.local_bus.unsubscribe, subscription)
+        for i in range(1000):
+            live.local_bus.publish(self.question.id, {self.tea.id: 1} if i % 4 else {self.coffee.id: 1})
+        batch = await subscription.next_batch(interval=0.2)
+        self.assertEqual(batch, {self.tea.id: 750, self.coffee.id: 250})
+
+        live.local_bus.publish(self.question.id, {self.tea.id: 1})
+        started = time.monotonic()
+        self.assertEqual(await subscription.next_batch(interval=0.2), {self.tea.id: 1})
+        self.assertGreaterEqual(time.monotonic() - started, 0.15)
+
+    def test_vote_publishes_after_commit(self):
+        with mock.patch('polls.live.publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                record_vote(self.user, self.question.id, self.tea.id)
+                publish.assert_not_called()
+        publish.assert_called_once_with(self.question.id, {self.tea.id: 1})
+
+    async def stream(self, cookie=''):
+        """Run the stream app until it has sent its first vote update; return what it sent."""
+        sent, disconnect = [], asyncio.Event()
+
+        async def receive():
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            if message.get('body', b'').startswith(b'data:'):
+                disconnect.set()
+
+        scope = {
+            'type': 'http',
+            'path': f'/polls/{self.question.id}/results/stream/',
+            'headers': [(b'cookie', cookie.encode())],
+        }
+        app = live.with_live_results(None)
+        task = asyncio.ensure_future(app(scope, receive, send))
+        while not live.local_bus.has_subscribers() and not task.done():
+            await asyncio.sleep(0.01)
+        live.publish(self.question.id, {self.tea.id: 1})
+        await asyncio.wait_for(task, 5)
+        return sent
+
+    async def test_stream_requires_login(self):
+        sent = await self.stream()
+        self.assertEqual(sent[0]['status'], 403)
+
+    async def test_stream_pushes_votes(self):
+        cookie = f'{settings.SESSION_COOKIE_NAME}={self.client.session.session_key}'
+        sent = await self.stream(cookie)
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertEqual(json.loads(sent[-1]['body'][len(b'data: '):]), {str(self.tea.id): 1})
+        self.assertFalse(live.local_bus.has_subscribers())
+
+    async def test_unreachable_broker_is_skipped_for_a_while(self):
+        def connect(address, timeout):
+            time.sleep(0.3)
+            raise ConnectionRefusedError
+
+        subscription = live.local_bus.subscribe(self.question.id)
+        self.addCleanup(live.local_bus.unsubscribe, subscription)
+        self.addCleanup(live._publisher.close)
+        with override_settings(POLLS_LIVE_BROKER='127.0.0.1:9'), \
+                mock.patch('polls.live.socket.create_connection', side_effect=connect) as create_connection:
+            started = time.monotonic()
+            live.publish(self.question.id, {self.tea.id: 1})
+            self.assertLess(time.monotonic() - started, 0.1)  # the vote doesn't wait for the connect
+            # Once the connect fails the delta still reaches local subscribers.
+            self.assertEqual(await asyncio.wait_for(subscription.next_batch(interval=0), 5), {self.tea.id: 1})
+            live.publish(self.question.id, {self.coffee.id: 1})
+            self.assertEqual(await asyncio.wait_for(subscription.next_batch(interval=0), 5), {self.coffee.id: 1})
+        self.assertEqual(create_connection.call_count, 1)
+
+    async def test_stream_only_serves_published_questions(self):
+        cookie = f'{settings.SESSION_COOKIE_NAME}={self.client.session.session_key}'
+        future = await sync_to_async(Question.objects.create)(question_text='Soon?', user=self.user)
+        await sync_to_async(Question.objects.filter(pk=future.pk).update)(pub_date=timezone.now() + timedelta(days=1))
+
+        sent = []
+
+        async def receive():
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        for question_id in (future.id, 999):
+            sent.clear()
+            scope = {'type': 'http', 'path': f'/polls/{question_id}/results/stream/',
+                     'headers': [(b'cookie', cookie.encode())]}
+            await live.results_stream_app(scope, receive, send, question_id)
+            self.assertEqual(sent[0]['status'], 404)
+        self.assertFalse(live.local_bus.has_subscribers())
+
+    async def test_broker_relays_between_processes(self):
+        server = await asyncio.start_server(Broker().handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        with override_settings(POLLS_LIVE_BROKER=f'127.0.0.1:{port}'):
+            subscription = live.local_bus.subscribe(self.question.id)
+            self.addCleanup(live.local_bus.unsubscribe, subscription)
+            live._ensure_relay()
+            await asyncio.sleep(0.1)
+            # Publishers are plain request threads.
+            await sync_to_async(live.publish, thread_sensitive=False)(self.question.id, {self.tea.id: 1})
+            batch = await asyncio.wait_for(subscription.next_batch(interval=0), 5)
+        self.assertEqual(batch, {self.tea.id: 1})
+
+        # Hang up both sides so the broker's handlers finish before the loop closes.
+        live._relay_task.cancel()
+        await asyncio.gather(live._relay_task, return_exceptions=True)
+        live._publisher.close()
+        await asyncio.sleep(0.05)
+        server.close()
+        await server.wait_closed()
+
+
+class SQLiteProfileTests(TestCase):
+
+    def connect(self, name):
+        wrapper = DatabaseWrapper({**connection.settings_dict, 'NAME': name, 'OPTIONS': {}}, alias='profile-test')
+        self.addCleanup(wrapper.close)
+        wrapper.ensure_connection()
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    @override_settings(POLLS_DB_PROFILE='sqlite-production')
+    def test_pragmas_applied_on_connect(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = Path(tmp.name) / 'db.sqlite3'
+        writer = self.connect(str(path))
+        self.assertEqual(self.pragma(writer, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(writer, 'synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma(writer, 'busy_timeout'), 20000)
+        reader = self.connect(f'file:{path}?mode=ro')
+        self.assertEqual(self.pragma(reader, 'query_only'), 1)
+
+    @override_settings(POLLS_DB_PROFILE='default')
+    def test_default_profile_leaves_connections_alone(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        writer = self.connect(str(Path(tmp.name) / 'db.sqlite3'))
+        self.assertEqual(self.pragma(writer, 'journal_mode'), 'delete')
+
+    def test_router_follows_read_only_scope(self):
+        router = ReadOnlyRouter()
+        self.assertIsNone(router.db_for_read(Question))
+        with reading_from('readonly'):
+            self.assertEqual(router.db_for_read(Question), 'readonly')
+            self.assertIsNone(router.db_for_write(Question))
+        self.assertFalse(router.allow_migrate('readonly', 'polls'))
+
+
+@override_settings(POLLS_READ_REPLICAS=['replica1', 'replica2'])
+class ReplicaRoutingTests(PollsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('polls.routers.read_replicas', return_value=['replica1', 'replica2'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_are_spread_over_replicas(self):
+        request = RequestFactory().get('/')
+        seen = {read_alias_for(request) for _ in range(50)}
+        self.assertEqual(seen, {'replica1', 'replica2'})
+        self.assertFalse(ReadOnlyRouter().allow_migrate('replica1', 'polls'))
+
+    @override_settings(POLLS_REPLICA_PIN_SECONDS=7)
+    def test_vote_pins_client_to_primary(self):
+        response = self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.tea.id})
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 7)
+
+        request = RequestFactory().get('/')
+        request.COOKIES[PIN_COOKIE] = response.cookies[PIN_COOKIE].value
+        self.assertIsNone(read_alias_for(request))
+        # The follow-up results page reads from 'default' (the replicas
+        # here don't exist) and doesn't extend the pin.
+        response = self.client.get(reverse('polls:results', args=(self.question.id,)))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_results_cache_is_filled_from_the_primary(self):
+        real_tallies = counters.tallies
+
+        def lagging(question_ids):
+            # The replicas haven't seen any votes yet.
+            if router.db_for_read(Choice) != 'default':
+                return {pk: [(self.tea.id, 'Tea', 0), (self.coffee.id, 'Coffee', 0)] for pk in question_ids}
+            return real_tallies(question_ids)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            record_vote(self.other, self.question.id, self.tea.id)
+        with mock.patch.object(counters, 'tallies', side_effect=lagging):
+            # An unpinned reader refills the entry the vote cleared.
+            with reading_from('replica1'):
+                self.assertEqual(results_cache.get_tally(self.question)[0]['votes'], 1)
+            self.assertEqual(results_cache.get_tally(self.question)[0]['votes'], 1)
+            results_cache.invalidate(self.question.id)
+            with reading_from('replica1'):
+                results_cache.warm([self.question.id])
+            self.assertEqual(results_cache.get_tally(self.question)[0]['votes'], 1)
+
+
+@override_settings(POLLS_THROTTLE_ENABLED=False)
+class BenchmarkTests(TestCase):
+
+    def test_seed_and_run_every_scenario(self):
+        result = seed.seed(users=4, questions=20, choices=3, votes=40)
+        self.assertEqual((result.users, result.questions, result.choices), (4, 20, 60))
+        self.assertEqual(Vote.objects.count(), result.votes)
+        self.assertEqual(counters.reconcile(repair=False), (20, 0))
+
+        report = scenarios.run(requests=70, concurrency=1)
+        self.assertEqual(report['overall']['requests'], 70)
+        self.assertEqual(report['overall']['errors'], 0)
+        self.assertEqual(set(report['scenarios']), set(scenarios.DEFAULT_MIX))
+        for summary in report['scenarios'].values():
+            self.assertLessEqual(summary['p50_ms'], summary['p99_ms'])
+            self.assertGreater(summary['queries_per_request'], 0)
+        self.assertEqual(len(scenarios.compare(report, report)), len(report['scenarios']) + 1)
+
+        api = scenarios.run(requests=30, concurrency=1, mix={'results': 1, 'api_batch': 1})
+        self.assertEqual(api['overall']['errors'], 0)
+        self.assertLessEqual(api['scenarios']['api_batch']['queries_per_request'], 4)
+
+        seed.clear()
+        self.assertFalse(User.objects.filter(username__startswith=seed.USER_PREFIX).exists())
+        self.assertFalse(Vote.objects.exists())
+
+
+@override_settings(POLLS_JOBS_ENABLED=True, POLLS_JOBS_OUTBOX_INTERVAL=60)
+class JobQueueTests(PollsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(jobs.outbox.flush)
+        instrumentation.registry.reset()
+        self.addCleanup(instrumentation.registry.reset)
+
+    def queue(self):
+        jobs.outbox.flush()
+        return list(Job.objects.order_by('pk').values_list('kind', flat=True))
+
+    def test_writes_queue_jobs_after_commit_and_workers_batch_them(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            question = create_poll(self.user, 'Cats or dogs?', ['Cats', 'Dogs'])
+            update_poll(question, ['Cats', 'Dogs'], question_text='Cats or hamsters?')
+            login_audit.record('alice', False)
+            self.assertEqual(jobs.outbox.pending(), 0)  # nothing until commit
+        self.assertEqual(self.queue(), ['search.index', 'search.index', 'audit.login'])
+        self.assertEqual(search.search('hamsters').results, [])
+
+        self.assertEqual(jobs.work(), 3)
+        self.assertEqual([r['question_text'] for r in search.search('hamsters').results], ['Cats or hamsters?'])
+        self.assertEqual(LoginAttempt.objects.get().username, 'alice')
+        self.assertFalse(Job.objects.exists())
+        metrics = instrumentation.registry.render()
+        # Both index updates ran as one batch.
+        self.assertIn('polls_job_batch_seconds_count{kind="search.index"} 1', metrics)
+        self.assertIn('polls_job_latency_seconds_count{kind="search.index"} 2', metrics)
+
+    @override_settings(POLLS_SEARCH_BACKEND='python')
+    def test_in_memory_search_index_is_updated_in_the_request(self):
+        search.get_index().rebuild()
+        with self.captureOnCommitCallbacks(execute=True):
+            create_poll(self.user, 'Cats or dogs?', ['Cats', 'Dogs'])
+        # A worker's copy of the index isn't the one the web processes search.
+        self.assertEqual(self.queue(), [])
+        self.assertEqual([r['question_text'] for r in search.search('cats').results], ['Cats or dogs?'])
+
+    def test_failures_back_off_then_give_up(self):
+        Job.objects.create(kind='counters.reconcile', payload={'question_ids': [self.question.id]})
+        with override_settings(POLLS_JOBS_MAX_ATTEMPTS=2, POLLS_JOBS_RETRY_DELAY=30), \
+                mock.patch.object(counters, 'reconcile', side_effect=RuntimeError('boom')):
+            self.assertEqual(jobs.work(), 1)
+            job = Job.objects.get()
+            self.assertEqual((job.attempts, job.failed_at), (1, None))
+            self.assertIn('RuntimeError: boom', job.last_error)
+            self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=25))
+            self.assertEqual(jobs.work(), 0)  # not due yet
+
+            Job.objects.update(run_at=timezone.now())
+            self.assertEqual(jobs.work(), 1)
+            self.assertIsNotNone(Job.objects.get().failed_at)
+            Job.objects.update(run_at=timezone.now())
+            self.assertEqual(jobs.work(), 0)
+
+        metrics = instrumentation.registry.render()
+        self.assertIn('polls_jobs_total{kind="counters.reconcile",result="error"} 2', metrics)
+        self.assertIn('polls_jobs_failed{kind="counters.reconcile"} 1', metrics)
+        self.assertIn('polls_jobs_queued{kind="counters.reconcile"} 0', metrics)
+
+    def test_expired_claims_are_picked_up_again(self):
+        Job.objects.create(kind='audit.login', payload={'username': 'bob', 'success': True,
+                                                        'timestamp': timezone.now().isoformat()})
+        kind, claimed = jobs.claim()
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(jobs.claim(), (None, []))
+        _, again = jobs.claim(now=timezone.now() + timedelta(seconds=settings.POLLS_JOBS_LEASE + 1))
+        self.assertEqual([job.pk for job in again], [claimed[0].pk])
+        self.assertEqual(again[0].attempts, 2)
+
+    def test_votes_warm_a_shared_results_cache(self):
+        with tempfile.TemporaryDirectory() as location:
+            shared = {**settings.CACHES, 'shared': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location,
+            }}
+            with self.settings(CACHES=shared, POLLS_RESULTS_CACHE='shared'):
+                with self.captureOnCommitCallbacks(execute=True):
+                    record_vote(self.user, self.question.id, self.tea.id)
+                self.assertEqual(self.queue(), ['results.warm'])
+                jobs.work()
+                with self.assertNumQueries(0):
+                    self.assertEqual(results_cache.get_tally(self.question)[0]['votes'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            record_vote(self.other, self.question.id, self.tea.id)
+        self.assertEqual(self.queue(), [])  # a worker can't warm this process's local memory
+
+    def test_reconcile_command_can_enqueue(self):
+        Question.objects.filter(pk=self.question.pk).update(total_votes=9)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('reconcile_vote_totals', enqueue=True, stdout=StringIO())
+        self.assertEqual(self.queue(), ['counters.reconcile'])
+        call_command('run_jobs', once=True, stdout=StringIO())
+        self.assertEqual(Question.objects.get(pk=self.question.pk).total_votes, 0)
+
+    def test_reconcile_walks_every_batch(self):
+        for i in range(3):
+            create_poll(self.user, f'Poll {i}?', ['A', 'B'])
+        Question.objects.update(total_votes=5)
+        out = StringIO()
+        call_command('reconcile_vote_totals', batch_size=2, stdout=out)
+        self.assertIn('Checked 4 questions, repaired drift in 4.', out.getvalue())
+        self.assertFalse(Question.objects.exclude(total_votes=0).exists())
+        # The same for the ids a 'counters.reconcile' job names.
+        Question.objects.update(total_votes=5)
+        ids = list(Question.objects.values_list('pk', flat=True))
+        self.assertEqual(counters.reconcile(batch_size=2, question_ids=ids), (4, 4))
+
+
+class InstrumentationTests(PollsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        instrumentation.registry.reset()
+        self.addCleanup(instrumentation.registry.reset)
+
+    def test_metrics_cover_time_queries_templates_and_cache(self):
+        url = reverse('polls:results', args=(self.question.id,))
+        self.client.get(url)
+        self.client.get(url)
+
+        self.assertEqual(self.client.get(reverse('polls:metrics')).status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        body = self.client.get(reverse('polls:metrics')).content.decode()
+
+        view = 'view="polls:results"'
+        self.assertIn(f'polls_requests_total{{{view},status="200"}} 2', body)
+        self.assertIn(f'polls_request_duration_seconds_count{{{view}}} 2', body)
+        self.assertIn(f'polls_request_template_seconds_bucket{{{view},le="+Inf"}} 2', body)
+        # The second view is served from the rendered fragment and never asks for the tally.
+        self.assertNotIn('result="hit"', body)
+        self.assertIn(f'polls_cache_requests_total{{{view},cache="results",result="miss"}} 1', body)
+        # Session, user and question, plus the tally on the miss.
+        self.assertIn(f'polls_request_queries_sum{{{view}}} 7.000000', body)
+
+    @override_settings(POLLS_METRICS_TOKEN='scrape-me')
+    def test_scraper_token(self):
+        self.client.logout()
+        url = reverse('polls:metrics')
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer scrape-me')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+    def test_slow_requests_are_profiled(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        with override_settings(POLLS_PROFILE_DIR=tmp.name, POLLS_PROFILE_SAMPLE_RATE=1, POLLS_PROFILE_SLOW_MS=0):
+            self.client.get(reverse('polls:index'))
+        with override_settings(POLLS_PROFILE_DIR=tmp.name, POLLS_PROFILE_SAMPLE_RATE=1, POLLS_PROFILE_SLOW_MS=60_000):
+            self.client.get(reverse('polls:index'))
+        dumps = list(Path(tmp.name).glob('*-polls_index-*ms.prof'))
+        self.assertEqual(len(dumps), 1)
+        self.assertTrue(pstats.Stats(str(dumps[0])).total_calls)
@@ -0,0 +1,117 @@
+"""
+Request throttling with a sliding-window counter kept in a cache.
+
+Each (scope, key) pair counts hits in fixed windows of POLLS_THROTTLE_RATES
+[scope][1] seconds. The rate is the current window's count plus the
+previous window's count weighted by how much of it still overlaps the
+sliding window, which smooths out the burst a plain fixed window allows
+at its edges. Counters live in the POLLS_THROTTLE_CACHE alias and expire
+with the cache timeout, so nothing is written to the database.
+"""
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+DEFAULT_RATES = {
+    # scope: (requests, per seconds)
+    'login': (5, 300),
+    'register': (10, 3600),
+    'vote': (30, 60),
+    'search': (60, 60),
+}
+
+
+def enabled():
+    return getattr(settings, 'POLLS_THROTTLE_ENABLED', True)
+
+
+class Throttle:
+
+    def __init__(self, scope):
+        self.scope = scope
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'POLLS_THROTTLE_CACHE', 'default')]
+
+    @property
+    def rate(self):
+        return getattr(settings, 'POLLS_THROTTLE_RATES', {}).get(self.scope, DEFAULT_RATES[self.scope])
+
+    def _keys(self, key, now):
+        window = self.rate[1]
+        current = int(now // window)
+        return (
+            f'throttle:{self.scope}:{key}:{current}',
+            f'throttle:{self.scope}:{key}:{current - 1}',
+            (now % window) / window,
+        )
+
+    def count(self, key, now=None):
+        """Hits in the sliding window ending now."""
+        now = time.time() if now is None else now
+        current, previous, elapsed = self._keys(key, now)
+        counts = self.cache.get_many([current, previous])
+        return counts.get(current, 0) + counts.get(previous, 0) * (1 - elapsed)
+
+    def allowed(self, key, now=None):
+        return not enabled() or self.count(key, now) < self.rate[0]
+
+    def hit(self, key, now=None):
+        now = time.time() if now is None else now
+        current, _, _ = self._keys(key, now)
+        # Keep the counter long enough to serve as the next window's "previous".
+        self.cache.add(current, 0, timeout=2 * self.rate[1])
+        try:
+            self.cache.incr(current)
+        except ValueError:
+            # Expired between add() and incr().
+            self.cache.set(current, 1, timeout=2 * self.rate[1])
+
+    def attempt(self, key, now=None):
+        """Count a hit and say whether it was within the rate."""
+        if not enabled():
+            return True
+        if not self.allowed(key, now):
+            return False
+        self.hit(key, now)
+        return True
+
+    def reset(self, key, now=None):
+        now = time.time() if now is None else now
+        current, previous, _ = self._keys(key, now)
+        self.cache.delete_many([current, previous])
+
+    def retry_after(self):
+        return self.rate[1]
+
+
+def too_many_requests(throttle):
+    """A 429 for `throttle`, or anything else with a retry_after() in seconds."""
+    response = HttpResponse("Too many requests. Please wait and try again later.", status=429)
+    response['Retry-After'] = str(throttle.retry_after())
+    return response
+
+
+def client_key(request):
+    """The user id for logged-in users, the client address otherwise."""
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f"addr:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def throttle(scope, methods=None):
+    """View decorator answering 429 once the client goes over the scope's rate."""
+    limiter = Throttle(scope)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if (methods is None or request.method in methods) and not limiter.attempt(client_key(request)):
+                return too_many_requests(limiter)
+            return view(request, *args, **kwargs)
+        return wrapped
+    return decorator
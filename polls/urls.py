@@ -1,21 +1,36 @@
+from django.conf import settings
 from django.urls import path
 from django.contrib.auth import views as auth_views
 from .views import LoginView
 
-from . import views
+from . import api, async_views, views
+
+# Under ASGI the read-heavy views are served by their async versions.
+if settings.POLLS_ASYNC_VIEWS:
+    index_view, results_view, search_view = async_views.index, async_views.results, async_views.search
+else:
+    index_view, results_view, search_view = views.IndexView.as_view(), views.ResultsView.as_view(), views.search
 
 app_name = 'polls'
 urlpatterns = [
     path('register/', views.register, name='register'),
-    path('', views.IndexView.as_view(), name='index'),
+    path('', index_view, name='index'),
     path('<int:pk>/', views.DetailView.as_view(), name='detail'),
-    path('<int:pk>/results/', views.ResultsView.as_view(), name='results'),
+    path('<int:pk>/results/', results_view, name='results'),
+    path('<int:pk>/results.json', async_views.results_json, name='results_json'),
+    path('api/questions/', api.questions, name='api_questions'),
+    path('api/questions/batch/', api.batch, name='api_batch'),
+    path('api/questions/<int:pk>/', api.question, name='api_question'),
+    path('results-cache/stats/', views.results_cache_stats, name='results_cache_stats'),
+    path('votes/stats/', views.vote_stats, name='vote_stats'),
+    path('metrics/', views.metrics, name='metrics'),
     path('<int:question_id>/vote/', views.vote, name='vote'),
     path('login/', LoginView.as_view(template_name='polls/login.html'), name='login'),
     path('logout/', auth_views.LogoutView.as_view(next_page='polls:index'), name='logout'),
     path('add/', views.add_question, name='add_question'),
     path('<int:question_id>/edit/', views.edit_question, name='edit_question'),
     path('<int:question_id>/delete/', views.delete_question, name='delete_question'),
-    path('search/', views.search, name='search'),
+    path('search/', search_view, name='search'),
+    path('export/<str:kind>.<str:fmt>', views.export, name='export'),
 
 ]
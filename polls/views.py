@@ -1,98 +1,229 @@
-from django.http import HttpResponseForbidden, HttpResponseRedirect, HttpResponse
+from django.conf import settings
+from django.http import Http404, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseRedirect, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render, redirect
 from django.urls import reverse
 from django.views import generic
+from django.db.models import Prefetch, prefetch_related_objects
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_datetime
                                             # Fix 5_2
-from .models import Choice, Question, Vote #, LoginAttempt
+from .models import Choice, Question, Vote, LoginAttempt
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.utils.decorators import method_decorator
 from .forms import QuestionForm
+from .pagination import InvalidCursor, keyset_page
+from .routers import read_only
+from .throttle import Throttle, throttle, too_many_requests
+from .audit import login_audit
+from .results_cache import results_cache
+from .coalescer import Overloaded, coalescer
+from .instrumentation import registry as metrics_registry
+from . import conditional, exports, fragments, search as search_index, voted
+from .services import UNCHANGED, AlreadyVoted, InvalidChoice, PollClosed, create_poll, update_poll
 from .forms import ChoiceForm, ChoiceFormset
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login, authenticate
 from django.forms import formset_factory
-from django.db import connection
 from django.contrib.auth.views import LoginView
 from datetime import timedelta
+from functools import partial
 
 
 
 @method_decorator(login_required, name='dispatch')
+@method_decorator(read_only, name='dispatch')
 class IndexView(generic.ListView):
     template_name = 'polls/index.html'
     context_object_name = 'latest_question_list'
 
     def get_queryset(self):
-        #Return the last five published questions
-        return Question.objects.filter(
-            pub_date__lte=timezone.now()
-        ).order_by('-pub_date')[:5]
+        # Return one page of published questions, newest first. ?cursor=
+        # comes from the previous page, so deep pages stay as cheap as the first.
+        # The "voted" marks ride along as an EXISTS unless the voted-set
+        # cache is on (see polls.voted).
+        queryset = Question.objects.filter(pub_date__lte=timezone.now())
+        if not voted.enabled():
+            queryset = voted.with_vote_flag(queryset, self.request.user)
+        try:
+            self.page = keyset_page(
+                queryset,
+                cursor=self.request.GET.get('cursor') or None,
+                page_size=getattr(settings, 'POLLS_INDEX_PAGE_SIZE', 5),
+            )
+        except InvalidCursor:
+            raise Http404("Invalid cursor.")
+        return self.page.object_list
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['next_cursor'] = self.page.next_cursor
+        context['prev_cursor'] = self.page.prev_cursor
+        context['list_version'] = fragments.list_version(self.page.object_list)
+        context['voted_version'] = fragments.voted_version(self.voted_ids)
+        return context
 
+    def get(self, request, *args, **kwargs):
+        self.object_list = self.get_queryset()
+        self.voted_ids = voted.mark(request.user, self.object_list)
+        return conditional.respond(
+            request,
+            lambda: self.render_to_response(self.get_context_data()),
+            etag=conditional.index_etag(self.page, self.voted_ids),
+        )
+
+
+
+def question_to_vote_on(user, question_id):
+    """
+    The question for the voting form, or None if `user` already voted on
+    it or it's closed. With the voted-set cache on, a known vote doesn't
+    load the question at all; otherwise the check is an EXISTS on the
+    question fetch.
+    """
+    if voted.enabled():
+        if voted.has_voted(user, question_id):
+            return None
+        question = get_object_or_404(Question, pk=question_id)
+        return None if question.is_closed() else question
+    question = get_object_or_404(voted.with_vote_flag(Question.objects.all(), user), pk=question_id)
+    return None if question.user_has_voted or question.is_closed() else question
+
+
+def render_detail(request, question, **context):
+    # Load all choices in one query; the template iterates question.choice_set.all.
+    # Only the columns in choice_question_listing_idx, so the index covers it.
+    choices = Choice.objects.only('id', 'question_id', 'choice_text').order_by('id')
+    prefetch_related_objects([question], Prefetch('choice_set', queryset=choices))
+    return render(request, 'polls/detail.html', {'question': question, **context})
 
 
 @method_decorator(login_required, name='dispatch')
+@method_decorator(read_only, name='dispatch')
 class DetailView(generic.DetailView):
     model = Question
     template_name = 'polls/detail.html'
 
     def get(self, request, *args, **kwargs):
-        # Call the base implementation to get the question
-        response = super().get(request, *args, **kwargs)
-
-        question = self.get_object()
+        question = question_to_vote_on(request.user, kwargs['pk'])
+        if question is None:
+            # Redirect to results page if the user has already voted or voting has ended
+            return HttpResponseRedirect(reverse('polls:results', args=(kwargs['pk'],)))
+        return render_detail(request, question)
 
-        user_vote = Vote.objects.filter(user=request.user, question=question).first()
-        if user_vote:
-            # Redirect to results page if the user has already voted
-            return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
-
-        return response
-    
 
 @method_decorator(login_required, name='dispatch')
+@method_decorator(read_only, name='dispatch')
 class ResultsView(generic.DetailView):
     model = Question
     template_name = 'polls/results.html'
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Totals include votes still sitting in counter shards. Passed as a
+        # callable so the template only asks for it when the fragment isn't cached.
+        context['choices'] = partial(results_cache.get_tally, self.object)
+        context['results_version'] = fragments.stamp(self.object)
+        context['fragment_timeout'] = fragments.results_timeout()
+        # The live stream is only served under ASGI.
+        context['live_results'] = settings.POLLS_ASYNC_VIEWS
+        return context
+
+    def get(self, request, *args, **kwargs):
+        # A repeat visit with a matching ETag skips the tally and the template.
+        self.object = self.get_object()
+        etag, last_modified = conditional.results_validators(self.object)
+        return conditional.respond(
+            request,
+            lambda: self.render_to_response(self.get_context_data(object=self.object)),
+            etag=etag,
+            last_modified=last_modified,
+        )
+
+
+@staff_member_required
+def results_cache_stats(request):
+    return JsonResponse(results_cache.stats())
+
+
+@staff_member_required
+def vote_stats(request):
+    """Admission and batching numbers of the busiest polls in this process."""
+    return JsonResponse({'polls': coalescer.stats()})
+
+
+def metrics(request):
+    """Request metrics in Prometheus text format, for staff or a scraper holding POLLS_METRICS_TOKEN."""
+    token = getattr(settings, 'POLLS_METRICS_TOKEN', None)
+    authorized = request.user.is_staff or (
+        token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    )
+    if not authorized:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@staff_member_required
+def export(request, kind, fmt):
+    """
+    Stream an export of questions, choices or votes, e.g.
+    /polls/export/votes.csv?since_id=1000&gzip=1
+    """
+    if kind not in exports.EXPORTS or fmt not in exports.FORMATS:
+        raise Http404("Unknown export.")
+    try:
+        since_id = int(request.GET['since_id']) if request.GET.get('since_id') else None
+    except ValueError:
+        return HttpResponseBadRequest("since_id must be an integer.")
+    since = None
+    if request.GET.get('since'):
+        since = parse_datetime(request.GET['since'])
+        if since is None:
+            return HttpResponseBadRequest("since must be an ISO 8601 datetime.")
+    compress = request.GET.get('gzip') == '1'
+
+    rows = exports.export_rows(kind, since_id=since_id, since=since)
+    response = StreamingHttpResponse(
+        exports.encode(exports.render_lines(kind, rows, fmt), compress=compress),
+        content_type=exports.FORMATS[fmt],
+    )
+    filename = f'{kind}.{fmt}' + ('.gz' if compress else '')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
 
 @login_required
 def poll_detail(request, question_id):
-    question = get_object_or_404(Question, pk=question_id)
-    
+    question = question_to_vote_on(request.user, question_id)
+
     # Check if the user has already voted for this question
-    user_vote = Vote.objects.filter(user=request.user, question=question).first()
-    if user_vote:
-        # Redirect to results page if the user has already voted
-        return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
+    if question is None:
+        # Redirect to results page if the user has already voted or voting has ended
+        return HttpResponseRedirect(reverse('polls:results', args=(question_id,)))
     else:
-        return render(request, 'polls/detail.html', {'question': question})
+        return render_detail(request, question)
 
 @login_required
+@throttle('vote')
 def vote(request, question_id):
-    question = get_object_or_404(Question, pk=question_id)
+    # The happy path is just the counter UPDATE and the Vote INSERT; the
+    # question is only loaded when there's an error page to render. A repeat
+    # vote the voted-set cache already knows about skips the write entirely.
+    if voted.enabled() and voted.has_voted(request.user, question_id, load=False):
+        return HttpResponseRedirect(reverse('polls:results', args=(question_id,)))
     try:
-        selected_choice = question.choice_set.get(pk=request.POST['choice'])
-    except (KeyError, Choice.DoesNotExist):
-        return render(request, 'polls/detail.html', {
-            'question': question,
-            'error_message': "You didn't select a choice.",
-        })
-    else:
-        # Check if the user has already voted for this question
-        user_vote = Vote.objects.filter(user=request.user, question=question).first()
-        if user_vote:
-            # Redirect to results page if the user has already voted
-            return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
-        else:
-            # Record the vote
-            selected_choice.votes += 1
-            selected_choice.save()
-            
-            # Create a new Vote instance to record the user's vote
-            Vote.objects.create(user=request.user, question=question, choice=selected_choice)
-            
-            return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
+        # Written together with other votes on the same poll (polls.coalescer).
+        coalescer.record_vote(request.user, question_id, request.POST['choice'])
+    except Overloaded as exc:
+        return too_many_requests(exc)
+    except (KeyError, ValueError, InvalidChoice):
+        question = get_object_or_404(Question, pk=question_id)
+        return render_detail(request, question, error_message="You didn't select a choice.")
+    except (AlreadyVoted, PollClosed):
+        # Redirect to results page if the user has already voted or voting has ended
+        pass
+    return HttpResponseRedirect(reverse('polls:results', args=(question_id,)))
 
 
 @login_required
@@ -104,21 +235,13 @@ def add_question(request):
         form = QuestionForm(request.POST)
         formset = ChoiceFormSet(request.POST, prefix='choices')
         if form.is_valid() and formset.is_valid():
-            question = form.save(commit=False)
-            question.pub_date = timezone.now()
-            question.user = request.user
-            question.save()
-
             # Save only filled out choices.
-            for choice_form in formset:
-                choice_text = choice_form.cleaned_data.get('choice_text')
-                if choice_text:  # Only if choice_text is filled
-                    choice = choice_form.save(commit=False)
-                    choice.question = question
-                    choice.user = request.user  # Assign the user to the choice here.
-                    choice.save()
-
-
+            create_poll(
+                request.user,
+                form.cleaned_data['question_text'],
+                [choice_form.cleaned_data.get('choice_text') for choice_form in formset],
+                closes_at=form.cleaned_data.get('closes_at'),
+            )
             return HttpResponseRedirect(reverse('polls:index'))
     else:
         form = QuestionForm()
@@ -130,39 +253,34 @@ def add_question(request):
 
 @login_required
 def edit_question(request, question_id):
-    question = get_object_or_404(Question, pk=question_id, user=request.user)
-    
-    existing_choices_count = question.choice_set.count()
-    extra_forms = max(0, 5 - existing_choices_count)  # Adjust 5 to your desired max
+    # Archived polls are frozen.
+    question = get_object_or_404(Question, pk=question_id, user=request.user, archived_at__isnull=True)
+
+    existing_choices = list(question.choice_set.order_by('id').values_list('choice_text', flat=True))
+    extra_forms = max(0, 5 - len(existing_choices))  # Adjust 5 to your desired max
 
     ChoiceFormSet = formset_factory(ChoiceForm, extra=extra_forms, can_delete=False)  # can_delete set to False
 
     if request.method == "POST":
-        
+
         form = QuestionForm(request.POST, instance=question)
         formset = ChoiceFormSet(request.POST, prefix='choices')
-           
+
         if form.is_valid() and formset.is_valid():
-            # Remove all existing choices related to the question
-            question.choice_set.all().delete()
-
-            # Save the updated question
-            form.save()
-            
-            # Handle new choices
-            for choice_form in formset:
-                if choice_form.cleaned_data and choice_form.cleaned_data.get('choice_text').strip():  # check for non-empty choice_text
-                    new_choice = choice_form.save(commit=False)
-                    new_choice.question = question
-                    new_choice.user = request.user
-                    new_choice.save()
-            
+            # Only the choices that changed are written, so votes on the
+            # others survive the edit.
+            update_poll(
+                question,
+                [choice_form.cleaned_data.get('choice_text') for choice_form in formset],
+                question_text=form.cleaned_data['question_text'] if 'question_text' in form.changed_data else None,
+                closes_at=form.cleaned_data['closes_at'] if 'closes_at' in form.changed_data else UNCHANGED,
+            )
             return HttpResponseRedirect(reverse('polls:index'))
 
     else:
         form = QuestionForm(instance=question)
 
-        choices_data = [{'choice_text': choice.choice_text} for choice in question.choice_set.all()]
+        choices_data = [{'choice_text': choice_text} for choice_text in existing_choices]
         formset = ChoiceFormSet(prefix='choices', initial=choices_data)
 
     return render(request, 'polls/edit_question.html', {'form': form, 'formset': formset, 'question_id': question.id})
@@ -182,10 +300,12 @@ def delete_question(request, question_id):
     # Fix 4:
     # if request.method == "POST": 
         question.delete()
+        results_cache.invalidate(question_id)
         return HttpResponseRedirect(reverse('polls:index'))
     return render(request, 'polls/confirm_delete.html', {'question': question})
 
 
+@throttle('register', methods=['POST'])
 def register(request):
     if request.method == "POST":
         form = UserCreationForm(request.POST)
@@ -198,29 +318,31 @@ def register(request):
         form = UserCreationForm()
     return render(request, 'polls/register.html', {'form': form})
 
+@throttle('search')
+@read_only
 def search(request):
     """
     Search for questions based on a keyword provided by GET request.
 
-    Currently, this method uses a vulnerable SQL query prone to SQL injection.
-    There's a safe parameterized query approach commented out.
+    Results come from the full-text index in polls.search (ranked, prefix
+    matching, paged with ?page=N) instead of a LIKE scan over
+    polls_question. The index queries are parameterized, so the old
+    SQL injection through `keyword` is gone as well.
     """
-    keyword = request.GET.get('keyword')
-    
-    # 2. SQL Injection
-    with connection.cursor() as cursor:
-        cursor.execute("SELECT * FROM polls_question WHERE question_text LIKE '%" + keyword + "%'")
-        # Fix by using parameterized queries:
-        # cursor.execute("SELECT * FROM polls_question WHERE question_text LIKE %s", ['%' + keyword + '%'])
+    keyword = request.GET.get('keyword', '')
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        page = 1
 
-        rows = cursor.fetchall()
-        columns = [col[0] for col in cursor.description]
-        results = [
-            dict(zip(columns, row))
-            for row in rows
-        ]
+    results = search_index.search(keyword, page=page)
 
-    return render(request, 'polls/search_results.html', {'results': results})
+    return render(request, 'polls/search_results.html', {
+        'results': results.results,
+        'keyword': keyword,
+        'page': results.page,
+        'has_next': results.has_next,
+    })
 
 
 
@@ -231,29 +353,29 @@ class LoginView(LoginView):
     Logs every login attempt in the `LoginAttempt` model.
     If a user exceeds 5 failed login attempts, they are prevented
     from making another attempt for the next 5 minute.
-        
+
+    Failed attempts are counted by the 'login' throttle (an in-memory
+    sliding window) rather than a COUNT over LoginAttempt, and the audit
+    rows are written in batches by polls.audit.
     """
 
     # Monitoring logging attempts:
 
-    """
     def post(self, request, *args, **kwargs):
+        username = request.POST.get('username', '')
+        if not login_throttle.allowed(username):
+            return too_many_requests(login_throttle)
 
         response = super().post(request, *args, **kwargs)
-        username = request.POST.get('username')
-        # computes the datetime 5 minutes prior to the current time.
-        time_threshold = timezone.now() - timedelta(minutes=5)
-        recent_attempts = LoginAttempt.objects.filter(username=username, timestamp__gte=time_threshold, success=False).count()
-        
-        if recent_attempts >= 5:
-            return HttpResponse("Too many failed login attempts. Please wait 5 minutes and try again.")
-        
-        was_successful = response.status_code == 302  
-        LoginAttempt.objects.create(username=username, success=was_successful)
 
+        was_successful = response.status_code == 302
+        login_audit.record(username, was_successful)
         if was_successful:
-            LoginAttempt.objects.filter(username=username, success=False).delete()
-        
+            login_throttle.reset(username)
+        else:
+            login_throttle.hit(username)
+
         return response
 
-    """
\ No newline at end of file
+
+login_throttle = Throttle('login')
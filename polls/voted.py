@@ -0,0 +1,154 @@
+"""
+"Already voted" checks answered from memory.
+
+The detail page, the vote view and the marks on the index all ask whether
+a user has voted on a question. With POLLS_VOTED_CACHE_SECONDS set, the
+first check loads every question id the user has voted on into a sorted
+array with one query on the primary (an index-only scan of
+unique_vote_per_user_question), and later checks are a binary search. A
+vote adds its question to the array in the process that recorded it, even
+while the array is still loading; entries expire after
+POLLS_VOTED_CACHE_SECONDS, and at most POLLS_VOTED_CACHE_USERS users are
+kept, least recently used going first.
+
+A vote recorded by another process shows up once the entry expires. Until
+then the user may see the voting form again, but the unique constraint
+still turns the second vote away, and that AlreadyVoted adds the question
+here. With the cache off (0), the check is an EXISTS subquery on the
+question fetch instead.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+
+from .models import Vote
+from .routers import reading_from
+
+
+def timeout():
+    return getattr(settings, 'POLLS_VOTED_CACHE_SECONDS', 0)
+
+
+def enabled():
+    return bool(timeout())
+
+
+def _contains(ids, question_id):
+    i = bisect_left(ids, question_id)
+    return i < len(ids) and ids[i] == question_id
+
+
+class VotedCache:
+    """Sorted arrays of voted question ids by user pk, each kept for a fixed number of seconds."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = OrderedDict()  # user pk -> (expires, array of question ids)
+        self._loading = {}  # user pk -> [loads running, question ids added meanwhile]
+
+    def _get(self, user_id):
+        # Callers hold the lock.
+        entry = self._users.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._users[user_id]
+            return None
+        self._users.move_to_end(user_id)
+        return entry[1]
+
+    def voted_ids(self, user_id, load=True):
+        """The user's voted question ids, loading them on a miss (or None if `load` is off)."""
+        with self._lock:
+            ids = self._get(user_id)
+            if ids is not None or not load:
+                return ids
+            self._loading.setdefault(user_id, [0, set()])[0] += 1
+        ids = None
+        try:
+            # From the primary: a replica may not have the user's latest vote yet.
+            with reading_from(None):
+                ids = array('q', Vote.objects.filter(user_id=user_id).order_by('question_id').values_list('question_id', flat=True))
+        finally:
+            with self._lock:
+                loading = self._loading[user_id]
+                loading[0] -= 1
+                if not loading[0]:
+                    del self._loading[user_id]
+                if ids is not None:
+                    # Votes recorded while the query ran, and anything another load stored meanwhile.
+                    for question_id in loading[1].union(self._get(user_id) or ()):
+                        if not _contains(ids, question_id):
+                            insort(ids, question_id)
+                    self._users[user_id] = (time.monotonic() + timeout(), ids)
+                    self._users.move_to_end(user_id)
+                    while len(self._users) > getattr(settings, 'POLLS_VOTED_CACHE_USERS', 10000):
+                        self._users.popitem(last=False)
+        return ids
+
+    def add(self, user_id, question_id):
+        """Record a vote; users that aren't cached or being loaded are left alone, their next load will see it."""
+        with self._lock:
+            ids = self._get(user_id)
+            if ids is not None:
+                if not _contains(ids, question_id):
+                    insort(ids, question_id)
+            elif user_id in self._loading:
+                self._loading[user_id][1].add(question_id)
+
+    def forget_question(self, question_id):
+        """Drop `question_id` from every user, after its votes were deleted."""
+        with self._lock:
+            for _, ids in self._users.values():
+                i = bisect_left(ids, question_id)
+                if i < len(ids) and ids[i] == question_id:
+                    del ids[i]
+
+    def discard(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._loading.clear()
+
+
+voted_cache = VotedCache()
+
+
+def with_vote_flag(queryset, user):
+    """`queryset` annotated with `user_has_voted`, so the check rides along with the fetch."""
+    return queryset.annotate(user_has_voted=Exists(Vote.objects.filter(user=user, question=OuterRef('pk'))))
+
+
+def has_voted(user, question_id, load=True):
+    """
+    Whether `user` voted on `question_id`, from the cache. With `load` off
+    a user who isn't cached counts as not voted, so no query is run.
+    """
+    ids = voted_cache.voted_ids(user.pk, load=load)
+    return ids is not None and _contains(ids, int(question_id))
+
+
+def mark(user, questions):
+    """
+    Set `user_has_voted` on each of `questions` (already set if they came
+    through with_vote_flag) and return the ids of those voted on.
+    """
+    questions = list(questions)
+    if enabled():
+        ids = voted_cache.voted_ids(user.pk)
+        for question in questions:
+            question.user_has_voted = _contains(ids, question.pk)
+    return [question.pk for question in questions if question.user_has_voted]
+
+
+def vote_recorded(user_id, question_id):
+    if enabled():
+        voted_cache.add(user_id, int(question_id))